@@ -0,0 +1,203 @@
+# End-to-end benchmark on the datasets of the repository, doubling as a non-regression check ("golden outputs").
+# Each dataset is imported with its importer (GeoJSON, native OSM, drawIO, railML 3.2 or SD1), then, for GeoJSON,
+# native OSM and drawIO datasets, transformed by the full transformation, stage by stage (see
+# scaling_benchmark.benchmark_transformation).
+# Each dataset runs in a fresh process; for each stage, the time, the peak memory (RSS) and the number of triples are
+# recorded.
+# The resulting graph is reduced to a canonical hash: SHA-256 of its sorted N-Triples lines, blank nodes being
+# relabelled canonically (by colour refinement), and xsd:double literals being rounded to DOUBLE_SIGNIFICANT_DIGITS
+# (computed lengths may differ in their last digits after a mere change in the order of operations). The hash is compared with the one
+# stored in golden_outputs.json, so that any change in the results is detected.
+import hashlib
+import json
+import os
+import sys
+import traceback
+from typing import Optional
+
+from rdflib import Graph, BNode, Literal, XSD
+
+from Benchmarks.scaling_benchmark import BENCHMARK_FOLDER, measure_stage, benchmark_transformation, \
+    run_in_fresh_process, save_results
+from Graph_transformation.triple_writer import ntriples_term
+
+CODE_FOLDER = os.path.join(os.path.dirname(__file__), '..')
+DATA_FOLDER = os.path.join(CODE_FOLDER, '..', 'Source_data')
+DRAWIO_TEST_DATA_FOLDER = os.path.join(CODE_FOLDER, 'Import', 'drawIO_import', 'TestData')
+RAILML_TEST_DATA_FOLDER = os.path.join(CODE_FOLDER, 'Import', 'railML32_import', 'TestData')
+GOLDEN_OUTPUTS_FILE = os.path.join(os.path.dirname(__file__), 'golden_outputs.json')
+RESULTS_FILE_NAME = 'dataset_results.json'
+DOUBLE_SIGNIFICANT_DIGITS = 9
+
+# key = dataset name, value = (importer, source files)
+DATASETS = {
+    'sankt_poelten': ('geojson', [os.path.join(DATA_FOLDER, 'OSM', 'Sankt_Pölten.geojson')]),
+    'sankt_poelten_native': ('osm', [os.path.join(DATA_FOLDER, 'OSM', 'Sankt_Pölten.json')]),
+    'ventimiglia_albenga': ('geojson', [os.path.join(DATA_FOLDER, 'OSM', 'Ventimiglia_Albenga.geojson')]),
+    'alnabru': ('drawio', [os.path.join(DRAWIO_TEST_DATA_FOLDER, 'Alnabru.drawio.xml')]),
+    'siding': ('drawio', [os.path.join(DRAWIO_TEST_DATA_FOLDER, '241104 siding.drawio.xml')]),
+    'simple_example_rtc': ('drawio', [os.path.join(DRAWIO_TEST_DATA_FOLDER,
+                                                   '241023-Simple_Example+RTC-121.drawio.xml')]),
+    'railml_advanced_example': ('railml', [os.path.join(RAILML_TEST_DATA_FOLDER, 'Advanced Example railML.org.xml')]),
+    'scheibenberg': ('sd1', [os.path.join(DATA_FOLDER, 'scheibenberg', 'infra_v0.4.2.xml'),
+                             os.path.join(DATA_FOLDER, 'scheibenberg', 'map_v0.4.2.xml')]),
+}
+
+
+def run_dataset_benchmark(dataset_names: Optional[list[str]] = None, output_folder: str = BENCHMARK_FOLDER,
+                          update_golden: bool = False) -> list[dict]:
+    """
+    :param dataset_names: keys of DATASETS; by default, all of them
+    :param output_folder: for the intermediate and output files, and the results
+    :param update_golden: if True, the golden outputs are replaced by the results of this run (for the datasets that
+    were processed successfully)
+    :return: one result per dataset (see benchmark_dataset), with its golden output status; also saved as JSON in the
+    output folder
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    golden_outputs = load_golden_outputs()
+    results = []
+    for name in dataset_names or DATASETS:
+        print(f"Benchmarking dataset {name}")
+        result = run_in_fresh_process(benchmark_dataset, name, output_folder)
+        result['golden'] = golden_status(result, golden_outputs.get(name))
+        results.append(result)
+        _print_result(result)
+        if update_golden and 'error' not in result:
+            golden_outputs[name] = {'triples': result['triples'], 'canonical_hash': result['canonical_hash']}
+
+    save_results(results, os.path.join(output_folder, RESULTS_FILE_NAME))
+    if update_golden:
+        save_golden_outputs(golden_outputs)
+    return results
+
+
+def benchmark_dataset(name: str, output_folder: str) -> dict:
+    """
+    Imports and transforms a dataset, stage by stage.
+    :return: dataset name, records of the stages (see scaling_benchmark.measure_stage), number of triples and
+    canonical hash of the resulting graph; or error (traceback), if processing failed
+    """
+    importer, source_paths = DATASETS[name]
+    result = {'dataset': name, 'records': []}
+    records = result['records']
+    try:
+        if importer in ('geojson', 'osm'):
+            graph = benchmark_transformation(source_paths[0], output_folder, records)
+        elif importer == 'drawio':
+            from Import.drawIO_import.drawIO_XML_to_geojson import GeojsonGenerator
+            from Import.drawIO_import.drawio_parameters import DRAWIO_XML_EXTENSION
+            measure_stage(records, "drawio_import",
+                          lambda: GeojsonGenerator().drawio_to_geojson(source_paths[0], output_folder))
+            geojson_name = os.path.basename(source_paths[0]).replace(DRAWIO_XML_EXTENSION, '.geojson')
+            graph = benchmark_transformation(os.path.join(output_folder, geojson_name), output_folder, records)
+        elif importer == 'railml':
+            from Import.railML32_import.Railml32ToRsm import Railml32ToRsm
+            converter = Railml32ToRsm()
+            measure_stage(records, "railml_import",
+                          lambda: converter.process_railML32(source_paths[0], output_folder, name))
+            graph = Graph().parse(converter.output_path)
+            records[-1]['triples'] = len(graph)
+        else:
+            # the SD1 modules import each other as top-level modules
+            sys.path.append(os.path.join(CODE_FOLDER, 'Import', 'SD1_import'))
+            from Import.SD1_import.sd1_import import import_sd1_infra_data
+            graph = measure_stage(records, "sd1_import", lambda: import_sd1_infra_data(*source_paths))
+            records[-1]['triples'] = len(graph)
+    except Exception:
+        result['error'] = traceback.format_exc()
+        return result
+    result['triples'] = len(graph)
+    result['canonical_hash'] = canonical_hash(graph)
+    return result
+
+
+def canonical_hash(graph: Graph) -> str:
+    """
+    :return: SHA-256 of the sorted N-Triples lines of the graph, blank nodes being relabelled canonically (see
+    blank_node_labels), and xsd:double literals rounded to DOUBLE_SIGNIFICANT_DIGITS
+    """
+    labels = blank_node_labels(graph, _rounded_term)
+
+    def term(node) -> str:
+        return f"_:{labels[node]}" if isinstance(node, BNode) else _rounded_term(node)
+
+    digest = hashlib.sha256()
+    for line in sorted(f"{term(subj)} {term(pred)} {term(obj)} .\n" for subj, pred, obj in graph):
+        digest.update(line.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def blank_node_labels(graph: Graph, term) -> dict[BNode, str]:
+    """
+    Labels the blank nodes independently of their identifiers, by colour refinement: each blank node is first
+    labelled with a hash of the triples it occurs in (other blank nodes being left anonymous), then, round after round,
+    with a hash of these triples in which the other blank nodes are given their labels of the previous round, until
+    the number of distinct labels stops growing. This is linear in the number of triples per round (rdflib's
+    to_canonical_graph did not finish in ten minutes on the SD1 alignments, with their thousands of blank nodes).
+    Blank nodes that cannot be told apart this way get the same label, which is all the hash needs.
+    :param term: N-Triples representation of the terms that are not blank nodes
+    :return: key = blank node, value = label
+    """
+    occurrences: dict[BNode, list[tuple]] = {}
+    for triple in graph:
+        for node in {node for node in triple if isinstance(node, BNode)}:
+            occurrences.setdefault(node, []).append(triple)
+    labels = {node: '' for node in occurrences}
+    distinct_count = 1 if labels else 0
+    while True:
+        new_labels = {}
+        for node, triples in occurrences.items():
+            signature = sorted(' '.join('*' if other == node else f"_:{labels[other]}" if isinstance(other, BNode)
+                                        else term(other) for other in triple) for triple in triples)
+            new_labels[node] = hashlib.sha256('\n'.join([labels[node], *signature]).encode('utf-8')).hexdigest()
+        new_distinct_count = len(set(new_labels.values()))
+        labels = new_labels
+        if new_distinct_count <= distinct_count:
+            return labels
+        distinct_count = new_distinct_count
+
+
+def _rounded_term(node) -> str:
+    if isinstance(node, Literal) and node.datatype == XSD.double:
+        node = Literal(f"{float(node):.{DOUBLE_SIGNIFICANT_DIGITS - 1}e}", datatype=XSD.double)
+    return ntriples_term(node)
+
+
+def golden_status(result: dict, golden_output: Optional[dict]) -> str:
+    if 'error' in result:
+        return "failed"
+    if golden_output is None:
+        return "no golden output"
+    return "identical" if golden_output['canonical_hash'] == result['canonical_hash'] else "DIFFERENT"
+
+
+def load_golden_outputs(golden_path: str = GOLDEN_OUTPUTS_FILE) -> dict:
+    """
+    :return: key = dataset name, value = dict of triples (count) and canonical_hash
+    """
+    if not os.path.exists(golden_path):
+        return {}
+    with open(golden_path, encoding='utf-8') as source:
+        return json.load(source)
+
+
+def save_golden_outputs(golden_outputs: dict, golden_path: str = GOLDEN_OUTPUTS_FILE):
+    with open(golden_path, 'w', encoding='utf-8') as output:
+        json.dump(golden_outputs, output, indent=1, sort_keys=True)
+    print(f"Golden outputs saved to {golden_path}")
+
+
+def _print_result(result: dict):
+    for record in result['records']:
+        print(f"    {record['stage']:<24} {record['seconds']:9.3f} s {record['peak_rss_mb']:9.1f} MB "
+              f"{record.get('triples', ''):>9}")
+    if 'error' in result:
+        print(f"    failed: {result['error'].strip().splitlines()[-1]}")
+    print(f"    golden output: {result['golden']}")
+
+
+if __name__ == "__main__":
+    # dataset names may be given as arguments; --update-golden replaces the golden outputs by the results of the run
+    arguments = [argument for argument in sys.argv[1:] if argument != '--update-golden']
+    run_dataset_benchmark(arguments or None, update_golden='--update-golden' in sys.argv)
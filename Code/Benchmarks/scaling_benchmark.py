@@ -0,0 +1,205 @@
+# Scaling benchmark of the transformation (see Graph_transformation/full_transformation.py), on synthetic networks
+# of increasing size (see synthetic_network.py).
+# Each stage of the transformation is timed separately: import, topology view, the steps 01-04a, KML export and slip
+# functionality (step04b). Each network size is processed in a fresh process, so that the peak memory (resident set
+# size) of a size is not inherited from the previous ones; the peak reported for a stage is the highest one reached
+# since the start of its process, i.e. up to the end of the stage. With trace_memory=True, the peak of the memory
+# allocated by Python during the stage itself is also reported (at the cost of slower execution).
+# Results are saved as JSON; scaling exponents are fitted on them (time ~ size^exponent: about 1 for a linear stage,
+# 2 for a quadratic one), and the scaling curves are plotted if matplotlib is available.
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from Benchmarks.synthetic_network import write_network
+from Graph_transformation.instrumentation import peak_rss_mb
+
+BENCHMARK_FOLDER = os.path.join(os.path.dirname(__file__), 'BenchmarkOutput')
+RESULTS_FILE_NAME = 'scaling_results.json'
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+MIN_FITTED_SECONDS = 0.01  # shorter timings are dominated by noise, and left out of the fits
+
+
+def run_scaling_benchmark(sizes: list[int] = DEFAULT_SIZES, output_folder: str = BENCHMARK_FOLDER,
+                          all_double_slip: bool = False, trace_memory: bool = False) -> list[dict]:
+    """
+    :param sizes: numbers of linear elements of the synthetic networks
+    :param output_folder: for the networks, the results, and the plot
+    :param all_double_slip: see transform_geojson_to_rsm
+    :param trace_memory: if True, the peak of the memory allocated by Python is measured for each stage
+    :return: one record per size and stage (see benchmark_network), also saved as JSON in the output folder
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    records = []
+    for size in sizes:
+        geojson_path = os.path.join(output_folder, f"synthetic_{size}.geojson")
+        write_network(geojson_path, size)
+        # one process per size, for independent memory peaks
+        size_records = run_in_fresh_process(benchmark_network, geojson_path, output_folder, all_double_slip,
+                                            trace_memory)
+        for record in size_records:
+            record['size'] = size
+        records.extend(size_records)
+        _print_records(size_records)
+        # saved after each size, so that the results of the smaller sizes are kept if a larger one fails
+        save_results(records, os.path.join(output_folder, RESULTS_FILE_NAME))
+
+    exponents = fit_scaling_exponents(records)
+    print("Scaling exponents (time ~ size^exponent):")
+    for stage, exponent in exponents.items():
+        print(f"    {stage}: {exponent:.2f}")
+    plot_scaling_curves(records, os.path.join(output_folder, 'scaling_curves.png'))
+    return records
+
+
+def benchmark_network(geojson_path: str, output_folder: str, all_double_slip: bool = False,
+                      trace_memory: bool = False) -> list[dict]:
+    """
+    Runs the transformation of a GeoJSON file stage by stage, as full_transformation does (without stage cache).
+    :return: one record per stage (see measure_stage)
+    """
+    records = []
+    benchmark_transformation(geojson_path, output_folder, records, all_double_slip, trace_memory)
+    return records
+
+
+def benchmark_transformation(geojson_path: str, output_folder: str, records: list[dict],
+                             all_double_slip: bool = False, trace_memory: bool = False):
+    """
+    Runs the transformation of a GeoJSON file stage by stage, as full_transformation does (without stage cache).
+    Native OSM files (.osm, Overpass .json, .osm.pbf) are transformed as by transform_osm_to_rsm.
+    :param records: list the records of the stages are appended to (see measure_stage)
+    :return: the resulting graph
+    """
+    from Code.Export.export_ttl_to_kml import graph_to_kml
+    from Code.Import.OSM_import.osm_geojson_to_ttl import osm_to_graph
+    from Code.Import.OSM_import.osm_native_import import osm_native_to_graph, OSM_XML_EXTENSION, \
+        OSM_PBF_EXTENSION, OVERPASS_JSON_EXTENSION
+    from Graph_transformation.full_transformation import PROCESS_STEPS, SLIP_FUNCTIONALITY_SUFFIX, \
+        generate_kml_path, native_osm_process_steps
+    from Graph_transformation.step04b_add_slip_functionality import add_slip_functionality_in_graph
+    from Graph_transformation.topology_view import TopologyView
+
+    short_name = os.path.splitext(os.path.basename(geojson_path))[0]
+    if trace_memory:
+        tracemalloc.start()
+    if geojson_path.endswith((OSM_XML_EXTENSION, OSM_PBF_EXTENSION, OVERPASS_JSON_EXTENSION)):
+        graph, element_end_nodes = measure_stage(records, "import", lambda: osm_native_to_graph(
+            geojson_path, short_name=short_name), trace_memory)
+        process_steps = native_osm_process_steps(element_end_nodes)
+    else:
+        graph = measure_stage(records, "import", lambda: osm_to_graph(geojson_path, short_name=short_name,
+                                                                       base_path=output_folder), trace_memory)
+        process_steps = PROCESS_STEPS
+    records[-1]['triples'] = len(graph)
+    topology = measure_stage(records, "topology_view", lambda: TopologyView(graph), trace_memory)
+    stages = [(stage, lambda step=step: step(graph, topology, all_double_slip)) for stage, step in process_steps]
+    stages.append(("kml", lambda: graph_to_kml(graph, generate_kml_path(short_name, output_folder), topology)))
+    stages.append((SLIP_FUNCTIONALITY_SUFFIX, lambda: add_slip_functionality_in_graph(graph, topology=topology)))
+    for stage, function in stages:
+        measure_stage(records, stage, function, trace_memory)
+        records[-1]['triples'] = len(graph)  # counted out of the timings
+    if trace_memory:
+        tracemalloc.stop()
+    return graph
+
+
+def measure_stage(records: list[dict], stage: str, function, trace_memory: bool = False):
+    """
+    Runs a stage, and appends its record to records: stage name, seconds, peak_rss_mb, and peak_traced_mb if
+    trace_memory (tracemalloc must then have been started).
+    :param function: runs the stage, without arguments
+    :return: the result of function
+    """
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = function()
+    record = {'stage': stage, 'seconds': time.perf_counter() - start}
+    if trace_memory:
+        record['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    record['peak_rss_mb'] = peak_rss_mb()
+    records.append(record)
+    return result
+
+
+def run_in_fresh_process(function, *args):
+    """
+    Runs a function in a new process (spawned, not forked), so that its memory peak is its own.
+    :return: the result of function, which must be picklable
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(function, *args).result()
+
+
+def save_results(records: list[dict], output_path: str):
+    with open(output_path, 'w', encoding='utf-8') as output:
+        json.dump(records, output, indent=1)
+
+
+def load_results(input_path: str) -> list[dict]:
+    with open(input_path, encoding='utf-8') as source:
+        return json.load(source)
+
+
+def fit_scaling_exponents(records: list[dict]) -> dict[str, float]:
+    """
+    Fits time = a * size^exponent for each stage (least squares on the logarithms), leaving out the timings shorter
+    than MIN_FITTED_SECONDS.
+    :return: key = stage, value = exponent (nan if less than 2 sizes are available)
+    """
+    exponents = {}
+    for stage in dict.fromkeys(record['stage'] for record in records):
+        points = [(record['size'], record['seconds']) for record in records
+                  if record['stage'] == stage and record['seconds'] >= MIN_FITTED_SECONDS]
+        if len({size for size, _ in points}) < 2:
+            exponents[stage] = float('nan')
+            continue
+        sizes, seconds = np.log(np.array(points)).T
+        exponents[stage] = float(np.polyfit(sizes, seconds, 1)[0])
+    return exponents
+
+
+def plot_scaling_curves(records: list[dict], output_path: str) -> Optional[str]:
+    """
+    Plots the time of each stage against the network size, on log-log axes.
+    :return: path to the plot, or None if matplotlib is not installed
+    """
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not installed: no plot of the scaling curves")
+        return None
+    figure, axes = plt.subplots(figsize=(8, 6))
+    for stage in dict.fromkeys(record['stage'] for record in records):
+        points = sorted((record['size'], record['seconds']) for record in records if record['stage'] == stage)
+        axes.plot(*zip(*points), marker='o', label=stage)
+    axes.set_xscale('log')
+    axes.set_yscale('log')
+    axes.set_xlabel('linear elements')
+    axes.set_ylabel('seconds')
+    axes.legend()
+    figure.savefig(output_path)
+    plt.close(figure)
+    print(f"Scaling curves saved to {output_path}")
+    return output_path
+
+
+def _print_records(records: list[dict]):
+    for record in records:
+        print(f"    {record['size']:>8} {record['stage']:<24} {record['seconds']:9.3f} s "
+              f"{record['peak_rss_mb']:9.1f} MB")
+
+
+if __name__ == "__main__":
+    # sizes may be given as arguments, e.g. python scaling_benchmark.py 100 1000 10000
+    run_scaling_benchmark([int(argument) for argument in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,93 @@
+# Generator of synthetic railway networks, as pre-processed GeoJSON files (see Import/OSM_import), of any size, for
+# benchmarking the transformation (see scaling_benchmark.py).
+# The network is a grid of identical cells, laid out in rows. Each row is a long line: its main track runs through all
+# the cells of the row. A cell holds:
+# - the main track, cut into MAIN_TRACK_FEATURES features, each with many intermediate vertices (nodes of degree 2,
+#   to be joined by step02);
+# - a yard: a siding leaving the main track at a switch and coming back to it, and a second siding branching off the
+#   first one (their ends lie on intermediate vertices of the track they branch off: the split is up to step01);
+# - a diamond crossing: a track crossing the main track at a common vertex;
+# - a double-slip crossing: another crossing, with two slip switch artefacts in the drawIO style (short, annotated
+#   linestrings, whose ends lie close to the legs of the crossing; see step04b).
+# Coordinates are computed from integer grid positions, so that shared vertices are exactly equal.
+import json
+import math
+
+from Import.OSM_import.osm_geojson_to_ttl import PREPROCESSED
+from Import.drawIO_import.drawio_parameters import SLIP_SWITCH_KEY
+
+ORIGIN = (10.0, 60.0)  # lon, lat of the south-west corner of the network
+GRID_STEP = (0.0005, 0.0002)  # degrees (about 28 m x 22 m at the origin latitude)
+CELL_WIDTH = 40  # grid steps
+CELL_HEIGHT = 10  # grid steps
+CELLS_PER_ROW = 50
+MAIN_TRACK_FEATURES = 4
+SLIP_OFFSET = 0.01  # grid steps: distance between the ends of a slip switch artefact and the legs of its crossing
+COORDINATE_DECIMALS = 7  # as in OSM data
+
+# Features of a cell, as lists of (x, y) grid positions relative to the south-west corner of the cell's main track
+SIDINGS = [
+    [(2, 0), (4, -1)] + [(x, -1) for x in range(5, 13)] + [(14, 0)],
+    [(5, -1), (7, -2), (8, -2), (9, -2), (11, -1)],
+]
+DIAMOND_CROSSING = [(22, -3), (23, -1.5), (24, 0), (25, 1.5), (26, 3)]
+DOUBLE_SLIP_CROSSING = [(32, 3), (33, 1.5), (34, 0), (35, -1.5), (36, -3)]
+SLIP_SWITCHES = [
+    [(33.6, SLIP_OFFSET), (34.4, -0.6 - SLIP_OFFSET)],  # main track, west leg - crossing track, south-east leg
+    [(33.6, 0.6 + SLIP_OFFSET), (34.4, -SLIP_OFFSET)],  # crossing track, north-west leg - main track, east leg
+]
+FEATURES_PER_CELL = MAIN_TRACK_FEATURES + len(SIDINGS) + 2 + len(SLIP_SWITCHES)
+
+
+def generate_network(element_count: int, cells_per_row: int = CELLS_PER_ROW) -> dict:
+    """
+    :param element_count: number of linear elements (features) wanted; rounded up to a whole number of cells
+    :param cells_per_row: length of the lines, in cells
+    :return: GeoJSON feature collection, flagged as pre-processed
+    """
+    cell_count = max(1, math.ceil(element_count / FEATURES_PER_CELL))
+    features = []
+    for cell in range(cell_count):
+        row, column = divmod(cell, cells_per_row)
+        features.extend(cell_features(row, column))
+    return {'type': 'FeatureCollection', PREPROCESSED: 'synthetic network', 'features': features}
+
+
+def write_network(output_path: str, element_count: int, cells_per_row: int = CELLS_PER_ROW) -> int:
+    """
+    Writes a synthetic network as a GeoJSON file.
+    :return: number of features written
+    """
+    network = generate_network(element_count, cells_per_row)
+    with open(output_path, 'w', encoding='utf-8') as output:
+        json.dump(network, output)
+    print(f"Synthetic network of {len(network['features'])} linear elements saved to {output_path}")
+    return len(network['features'])
+
+
+def cell_features(row: int, column: int) -> list[dict]:
+    x0, y0 = column * CELL_WIDTH, row * CELL_HEIGHT
+
+    def feature(positions, label='', annotations=None) -> dict:
+        properties = {'label': label, 'rsm_class': 'LinearElement', 'railway': 'rail'}
+        if annotations:
+            properties['annotations'] = annotations
+        coordinates = [_coordinates(x0 + x, y0 + y) for x, y in positions]
+        return {'type': 'Feature', 'properties': properties,
+                'geometry': {'type': 'LineString', 'coordinates': coordinates}}
+
+    features = []
+    part_length = CELL_WIDTH // MAIN_TRACK_FEATURES
+    for part in range(MAIN_TRACK_FEATURES):
+        start = part * part_length
+        features.append(feature([(x, 0) for x in range(start, start + part_length + 1)], label=f"line {row}"))
+    features.extend(feature(siding) for siding in SIDINGS)
+    features.append(feature(DIAMOND_CROSSING))
+    features.append(feature(DOUBLE_SLIP_CROSSING))
+    features.extend(feature(slip_switch, label='slip', annotations=SLIP_SWITCH_KEY) for slip_switch in SLIP_SWITCHES)
+    return features
+
+
+def _coordinates(x: float, y: float) -> list[float]:
+    return [round(ORIGIN[0] + x * GRID_STEP[0], COORDINATE_DECIMALS),
+            round(ORIGIN[1] + y * GRID_STEP[1], COORDINATE_DECIMALS)]
@@ -1,9 +1,8 @@
 from rdflib import URIRef, Graph
-from rdflib.namespace import RDF
-from shapely.wkt import loads
 from shapely.geometry import LineString
 from typing import Dict, List
 from Code.Namespaces import *
+from Graph_transformation.topology_view import TopologyView
 
 LINEAR_ELEMENT_WIDTH = 4  # adjust as needed
 
@@ -14,7 +13,27 @@ def ttl_to_kml(input_ttl_: str, output_kml_: str):
     :param output_kml_: full path to output kml file
     :return: None
     """
-    elements = parse_ttl_linestrings(input_ttl_)
+    g = Graph()
+    g.parse(input_ttl_, format="turtle")
+    graph_to_kml(g, output_kml_)
+
+
+def graph_to_kml(g: Graph, output_kml_: str, topology: TopologyView = None):
+    """
+    :param g: sRSM graph, already in memory
+    :param output_kml_: full path to output kml file
+    :param topology: view of the graph, if already available
+    :return: None
+    """
+    linestrings_to_kml(graph_linestrings(g, topology), output_kml_)
+
+
+def linestrings_to_kml(elements: Dict[URIRef, LineString], output_kml_: str):
+    """
+    :param elements: key = URI of linear element, value = its geometry
+    :param output_kml_: full path to output kml file
+    :return: None
+    """
     if elements:
         adjacency_list = build_adjacency_list(elements)
         element_colors = color_elements(adjacency_list)
@@ -23,20 +42,23 @@ def ttl_to_kml(input_ttl_: str, output_kml_: str):
 
 
 def parse_ttl_linestrings(input_ttl_: str) -> Dict[URIRef, LineString]:
-    VALID_TYPES = ['POINT', 'LINESTRING', 'POLYGON', 'MULTIPOINT', 'MULTILINESTRING', 'MULTIPOLYGON',
-                   'GEOMETRYCOLLECTION']
-
     g = Graph()
     g.parse(input_ttl_, format="turtle")
+    return graph_linestrings(g)
+
+
+def graph_linestrings(g: Graph, topology: TopologyView = None) -> Dict[URIRef, LineString]:
+    VALID_TYPES = ['POINT', 'LINESTRING', 'POLYGON', 'MULTIPOINT', 'MULTILINESTRING', 'MULTIPOLYGON',
+                   'GEOMETRYCOLLECTION']
+    topology = topology or TopologyView(g)
 
     elements: Dict[URIRef, LineString] = {}
-    for line in g.subjects(RDF.type, RSM_TOPOLOGY.LinearElement):
-        geom = g.value(line, RSM_GEOSPARQL_ADAPTER.hasNominalGeometry)
-        wkt = g.value(geom, GEOSPARQL.asWKT)
+    for line in topology.linear_elements:
+        wkt = topology.wkt_of(line)
 
         if wkt is not None:
-            linestring = loads(str(wkt))
-            if any(type_ in str(wkt) for type_ in VALID_TYPES):
+            linestring = topology.shape_of(line)
+            if any(type_ in wkt for type_ in VALID_TYPES):
                 if isinstance(linestring, LineString):
                     elements[line] = linestring
             else:
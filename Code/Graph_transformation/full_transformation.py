@@ -1,84 +1,313 @@
 # See readme.md for explanations
+import itertools
 import os
+import shutil
+from typing import Optional
 
-from Code.Export.export_ttl_to_kml import ttl_to_kml
+from rdflib import Graph
 
-from Code.Graph_transformation.step01_split_linear_elements import split_linestrings_in_file
-from Code.Graph_transformation.step02_join_linear_elements import join_linear_elements
-from Graph_transformation.step03_add_ports import add_ports_to_linear_elements
-from Graph_transformation.step04a_add_port_properties import set_port_connections, set_navigabilities
-from Graph_transformation.step04b_add_slip_functionality import add_slip_functionality
+from Code.Export.export_ttl_to_kml import graph_to_kml
+
+from Code.Graph_transformation.step01_split_linear_elements import split_linestrings_in_graph
+from Code.Graph_transformation.step02_join_linear_elements import join_linear_elements_in_graph, \
+    compute_nominal_metric_lengths
+from Graph_transformation.graph_file_handing import load_graph, save_graph, read_graph_file, FILE_SAVE_MSG
+from Graph_transformation.graph_store import StoreConfig
+from Graph_transformation.instrumentation import Stage, ProgressCallback, report_progress
+from Graph_transformation.step03_add_ports import add_ports_in_graph
+from Graph_transformation.step04a_add_port_properties import set_port_connections_in_graph, \
+    set_navigabilities_in_graph, set_port_connections_by_node_in_graph
+from Graph_transformation.stage_cache import StageCache, CACHE_FOLDER_NAME
+from Graph_transformation.step04b_add_slip_functionality import add_slip_functionality_in_graph
+from Graph_transformation.topology_view import TopologyView
 
 OUTPUT_FOLDER = os.path.join(os.path.dirname(__file__), 'TestOutput')
 NAVIGABILITIES_SUFFIX = "with_navigabilities"
+SLIP_FUNCTIONALITY_SUFFIX = "with_slip_functionality"
 KML_SUFFIX = " including slip switch representation"
 
+# Steps 01-04a, in their order of execution: stage name (as used in file names), and function of the graph,
+# the topology view, the all_double_slip parameter and, optionally, a progress callback.
+PROCESS_STEPS = [
+    ("split", lambda graph, topology, _, progress=None:
+        split_linestrings_in_graph(graph, topology=topology, progress=progress)),
+    ("joint", lambda graph, topology, _, progress=None:
+        join_linear_elements_in_graph(graph, topology=topology, progress=progress)),
+    ("with_ports", lambda graph, topology, _, progress=None:
+        add_ports_in_graph(graph, topology=topology, progress=progress)),
+    ("with_connected_ports", lambda graph, topology, _, progress=None:
+        set_port_connections_in_graph(graph, topology=topology, progress=progress)),
+    (NAVIGABILITIES_SUFFIX, lambda graph, topology, all_double_slip, progress=None:
+        set_navigabilities_in_graph(graph, double_slip_crossings=all_double_slip, topology=topology,
+                                    progress=progress)),
+]
+
+
+def native_osm_process_steps(element_end_nodes: dict) -> list:
+    """
+    Process steps for native OSM data (see transform_osm_to_rsm), in the same form as PROCESS_STEPS: the import having
+    split and joined the linear elements, the joint stage only computes their lengths, and ports are connected by
+    node instead of by coordinates.
+    :param element_end_nodes: as returned by osm_native_to_graph
+    """
+    return [
+        ("joint", lambda graph, topology, _, progress=None: compute_nominal_metric_lengths(graph, topology)),
+        PROCESS_STEPS[2],
+        ("with_connected_ports", lambda graph, topology, _, progress=None:
+            set_port_connections_by_node_in_graph(graph, element_end_nodes, topology=topology, progress=progress)),
+        PROCESS_STEPS[4],
+    ]
+
+
+# Share of each stage in the whole transformation, as reported to progress callbacks (rough proportions of the
+# processing times measured by Benchmarks/scaling_benchmark.py)
+STAGE_WEIGHTS = {"import": 0.3, "split": 0.05, "joint": 0.1, "with_ports": 0.1, "with_connected_ports": 0.05,
+                 NAVIGABILITIES_SUFFIX: 0.05, "kml": 0.15, SLIP_FUNCTIONALITY_SUFFIX: 0.05, "output": 0.15}
+
 
 def generate_file_path(short_name, stage, to_folder=OUTPUT_FOLDER):
     return os.path.join(to_folder, f"{short_name}_{stage}.ttl")
 
 
-def transform_geojson_to_rsm(geojson_path, short_name, output_folder=OUTPUT_FOLDER, all_double_slip: bool = False) -> str:
+def transform_geojson_to_rsm(geojson_path, short_name, output_folder=OUTPUT_FOLDER, all_double_slip: bool = False,
+                             checkpoints: bool = False, use_cache: bool = True,
+                             cache: Optional[StageCache] = None, store: Optional[StoreConfig] = None,
+                             progress: Optional[ProgressCallback] = None) -> str:
     """
 
-    :param geojson_path: source data (if from OSM, should be pre-processed)
+    :param geojson_path: source data (OSM data are preprocessed in memory, see osm_to_graph)
     :param short_name: will be used in the name of generated files
     :param output_folder: folder for the ttl file
     :param all_double_slip: if True, all crossings will default to double slip
+    :param checkpoints: if True, the preprocessed GeoJSON file is saved, and the raw graph and the graph after each step
+    are also saved as ttl files
+    :param use_cache: if True, the result of each stage is looked up in, and stored into, the stage cache
+    :param cache: stage cache; by default, the one located in the output folder
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory.
+    An on-disk store allows processing inputs too large to be held in memory.
+    :param progress: called back with the current stage and the fraction of the whole transformation done (see
+    overall_progress)
     :return: resulting ttl file as string
     """
-    from Code.Import.OSM_import.osm_geojson_to_ttl import osm_to_ttl
+    from Code.Import.OSM_import.osm_geojson_to_ttl import osm_to_graph
 
     print()
     print("Preparing the transformation of an OSM file (GeoJSON format) into a sRSM file (TTL format)")
     print(f"Reading the OSM file: {geojson_path}")
 
-    # Read the OSM geojson file and produce the raw ttl file
-    osm_to_ttl(geojson_path, short_name=short_name, base_path=output_folder)
+    progress = overall_progress(progress) if progress else None
+    stage_keys = {}
+    if use_cache:
+        cache = cache or StageCache(os.path.join(output_folder, CACHE_FOLDER_NAME))
+        stage_keys = generate_stage_keys(StageCache.file_key(geojson_path, short_name=short_name), all_double_slip)
+        cached_result = _restore_cached_result(cache, stage_keys, short_name, output_folder, checkpoints)
+        if cached_result is not None:
+            report_progress(progress, "output", 1.0)
+            return cached_result
 
-    print(f'TTL file produced from the OSM geojson file, output at {output_folder}')
+        # resume from the latest stage available in the cache, if any
+        for stage in reversed(["raw"] + [stage for stage, _ in PROCESS_STEPS]):
+            graph = cache.load_graph(stage_keys[stage], store)
+            if graph is not None:
+                print(f"Resuming from the cached {stage} graph")
+                _restore_cached_checkpoints(cache, stage_keys, short_name, output_folder, checkpoints, stage)
+                run_graph_process_steps(graph, short_name, output_folder, all_double_slip, checkpoints,
+                                        cache, stage_keys, from_stage=stage, progress=progress)
+                return read_output(short_name, output_folder)
+
+    # Read the OSM geojson file and produce the raw graph, kept in memory
+    graph = osm_to_graph(geojson_path, short_name=short_name, base_path=output_folder, store=store, progress=progress,
+                         save_preprocessed=checkpoints)
+    _save_checkpoint(graph, short_name, "raw", output_folder, checkpoints)
+    if use_cache:
+        cache.put_graph(stage_keys["raw"], graph)
+
+    print('Raw graph produced from the OSM geojson file')
 
     # Process steps 01-04b, affecting Linear elements, connections, ports, and navigabilities
-    result = run_process_steps(short_name, output_folder, all_double_slip)
-    return result
+    run_graph_process_steps(graph, short_name, output_folder, all_double_slip, checkpoints,
+                            cache if use_cache else None, stage_keys, progress=progress)
+    return read_output(short_name, output_folder)
+
+
+def transform_osm_to_rsm(osm_path, short_name, output_folder=OUTPUT_FOLDER, all_double_slip: bool = False,
+                         checkpoints: bool = False, store: Optional[StoreConfig] = None,
+                         progress: Optional[ProgressCallback] = None) -> str:
+    """
+    Same as transform_geojson_to_rsm, for native OSM data (.osm, Overpass .json, or .osm.pbf; see
+    Import/OSM_import/osm_native_import.py), without stage cache. The topology being given by the identifiers of the
+    OSM nodes, the import splits and joins the linear elements, and the ports are connected by node: the stages
+    matching coordinates (split, joint, connections) are skipped.
+
+    :param osm_path: source data
+    :param short_name: will be used in the name of generated files
+    :param output_folder: folder for the ttl file
+    :param all_double_slip: if True, all crossings will default to double slip
+    :param checkpoints: if True, the raw graph and the graph after each step are also saved as ttl files
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory
+    :param progress: called back with the current stage and the fraction of the whole transformation done (see
+    overall_progress)
+    :return: resulting ttl file as string
+    """
+    from Code.Import.OSM_import.osm_native_import import osm_native_to_graph
+
+    print()
+    print("Preparing the transformation of a native OSM file into a sRSM file (TTL format)")
+    print(f"Reading the OSM file: {osm_path}")
+
+    progress = overall_progress(progress) if progress else None
+    graph, element_end_nodes = osm_native_to_graph(osm_path, short_name, store, progress)
+    _save_checkpoint(graph, short_name, "raw", output_folder, checkpoints)
+    run_graph_process_steps(graph, short_name, output_folder, all_double_slip, checkpoints, progress=progress,
+                            steps=native_osm_process_steps(element_end_nodes))
+    return read_output(short_name, output_folder)
 
 
-def run_process_steps(short_name, output_folder=OUTPUT_FOLDER, all_double_slip: bool = False) -> str:
+def run_process_steps(short_name, output_folder=OUTPUT_FOLDER, all_double_slip: bool = False,
+                      checkpoints: bool = False, store: Optional[StoreConfig] = None) -> str:
     """
+    Runs the process steps on the raw ttl file previously produced for short_name.
 
     :param all_double_slip:
     :param short_name:
     :param output_folder:
+    :param checkpoints: if True, the graph after each step is also saved as a ttl file
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory
     :return: processed ttl file as string
     """
+    graph = load_graph(generate_file_path(short_name, "raw", output_folder), store)
+    run_graph_process_steps(graph, short_name, output_folder, all_double_slip, checkpoints)
+    return read_output(short_name, output_folder)
 
-    split_linestrings_in_file(generate_file_path(short_name, "raw", output_folder), short_name)
-    join_linear_elements(
-        generate_file_path(short_name, "split", output_folder),
-        generate_file_path(short_name, "joint", output_folder)
-    )
-    add_ports_to_linear_elements(
-        generate_file_path(short_name, "joint", output_folder),
-        generate_file_path(short_name, "with_ports", output_folder)
-    )
-    set_port_connections(
-        generate_file_path(short_name, "with_ports", output_folder),
-        generate_file_path(short_name, "with_connected_ports", output_folder)
-    )
-    set_navigabilities(
-        generate_file_path(short_name, "with_connected_ports", output_folder),
-        generate_file_path(short_name, NAVIGABILITIES_SUFFIX, output_folder),
-        double_slip_crossings=all_double_slip
-    )
-    result = add_slip_functionality(
-        generate_file_path(short_name, NAVIGABILITIES_SUFFIX, output_folder),
-        generate_file_path(short_name, "with_slip_functionality", output_folder)
-    )
-    ttl_to_kml(
-        generate_file_path(short_name, NAVIGABILITIES_SUFFIX, output_folder),
-        os.path.join(OUTPUT_FOLDER, f"{short_name}{KML_SUFFIX}.kml")
-    )
-    return result
+
+def run_graph_process_steps(graph: Graph, short_name, output_folder=OUTPUT_FOLDER, all_double_slip: bool = False,
+                            checkpoints: bool = False, cache: Optional[StageCache] = None,
+                            stage_keys: Optional[dict[str, str]] = None, from_stage: str = "raw",
+                            progress: Optional[ProgressCallback] = None, steps: Optional[list] = None) -> Graph:
+    """
+    Runs the process steps 01-04b on a raw graph, which is kept in memory (and modified in place) throughout.
+    Only the final graph and its KML representation are saved, unless checkpoints are requested.
+    Each step, the KML export and the output are instrumented as stages (see instrumentation).
+    A single topology view is shared by the steps, each of them keeping it in line with the graph.
+
+    :param graph: raw graph, as produced by the OSM import, or the graph resulting from from_stage
+    :param short_name: will be used in the name of generated files
+    :param output_folder:
+    :param all_double_slip: if True, all crossings will default to double slip
+    :param checkpoints: if True, the graph after each step is also saved as a ttl file
+    :param cache: if provided, together with stage_keys, the result of each stage is stored in it
+    :param stage_keys: as produced by generate_stage_keys
+    :param from_stage: stage the graph results from; only the subsequent steps are run
+    :param progress: called back with the current stage and the fraction of this stage done
+    :param steps: steps to be run instead of PROCESS_STEPS (e.g. native_osm_process_steps)
+    :return: the processed graph
+    """
+    topology = TopologyView(graph)
+    steps = steps or PROCESS_STEPS
+    stages = [stage for stage, _ in steps]
+    for stage, step in steps[stages.index(from_stage) + 1 if from_stage in stages else 0:]:
+        with Stage(stage, graph):
+            step(graph, topology, all_double_slip, progress)
+        _save_checkpoint(graph, short_name, stage, output_folder, checkpoints)
+        if cache:
+            cache.put_graph(stage_keys[stage], graph)
+    # the KML representation still includes the slip switch artefacts, which are removed by the next step
+    kml_path = generate_kml_path(short_name, output_folder)
+    with Stage("kml", graph):
+        graph_to_kml(graph, kml_path, topology)
+    report_progress(progress, "kml", 1.0)
+    with Stage(SLIP_FUNCTIONALITY_SUFFIX, graph):
+        add_slip_functionality_in_graph(graph, topology=topology, progress=progress)
+    output_path = generate_file_path(short_name, SLIP_FUNCTIONALITY_SUFFIX, output_folder)
+    with Stage("output", graph):
+        save_graph(graph, output_path, streaming=True)
+    report_progress(progress, "output", 1.0)
+    if cache:
+        if os.path.exists(kml_path):
+            cache.put_file(stage_keys["kml"], ".kml", kml_path)
+        cache.put_file(stage_keys[SLIP_FUNCTIONALITY_SUFFIX], ".ttl", output_path)
+    return graph
+
+
+def overall_progress(progress: ProgressCallback) -> ProgressCallback:
+    """
+    :param progress: callback expecting the fraction of the whole transformation done
+    :return: callback for the stages (reporting the fraction of the current stage done), which calls progress with
+    the overall fraction, each stage weighing as set in STAGE_WEIGHTS
+    """
+    starts = dict(zip(STAGE_WEIGHTS, itertools.accumulate(STAGE_WEIGHTS.values(), initial=0.0)))
+
+    def stage_progress(stage: str, fraction: float):
+        progress(stage, min(1.0, starts[stage] + STAGE_WEIGHTS[stage] * fraction))
+
+    return stage_progress
+
+
+def read_output(short_name, output_folder=OUTPUT_FOLDER) -> str:
+    """
+    :return: the content of the final ttl file produced for short_name (cheaper than serializing the graph again)
+    """
+    return read_graph_file(generate_file_path(short_name, SLIP_FUNCTIONALITY_SUFFIX, output_folder))
+
+
+def generate_kml_path(short_name, to_folder=OUTPUT_FOLDER):
+    return os.path.join(to_folder, f"{short_name}{KML_SUFFIX}.kml")
+
+
+def generate_stage_keys(source_key: str, all_double_slip: bool = False) -> dict[str, str]:
+    """
+    Cache keys of the results of all stages, each of them depending on the key of the previous one.
+    :param source_key: key of the source file
+    :param all_double_slip:
+    :return: dict, key = stage name, value = cache key
+    """
+    stage_keys = {"raw": StageCache.stage_key(source_key, "raw")}
+    previous_key = stage_keys["raw"]
+    for stage, _ in PROCESS_STEPS:
+        parameters = {"all_double_slip": all_double_slip} if stage == NAVIGABILITIES_SUFFIX else {}
+        stage_keys[stage] = previous_key = StageCache.stage_key(previous_key, stage, **parameters)
+    stage_keys["kml"] = StageCache.stage_key(previous_key, "kml")
+    stage_keys[SLIP_FUNCTIONALITY_SUFFIX] = StageCache.stage_key(previous_key, SLIP_FUNCTIONALITY_SUFFIX)
+    return stage_keys
+
+
+def _restore_cached_result(cache: StageCache, stage_keys: dict[str, str], short_name, output_folder,
+                           checkpoints: bool) -> Optional[str]:
+    """
+    Copies the cached final ttl file (and KML file) to the output folder.
+    :return: the content of the ttl file, or None if it is not cached
+    """
+    cached_output = cache.get(stage_keys[SLIP_FUNCTIONALITY_SUFFIX], ".ttl")
+    if cached_output is None:
+        return None
+    print("Cached result found: no processing needed")
+    os.makedirs(output_folder, exist_ok=True)
+    output_path = generate_file_path(short_name, SLIP_FUNCTIONALITY_SUFFIX, output_folder)
+    shutil.copyfile(cached_output, output_path)
+    print(FILE_SAVE_MSG.format(output_path))
+    if cached_kml := cache.get(stage_keys["kml"], ".kml"):
+        shutil.copyfile(cached_kml, generate_kml_path(short_name, output_folder))
+    _restore_cached_checkpoints(cache, stage_keys, short_name, output_folder, checkpoints)
+    return read_output(short_name, output_folder)
+
+
+def _restore_cached_checkpoints(cache: StageCache, stage_keys: dict[str, str], short_name, output_folder,
+                                checkpoints: bool, up_to_stage: str = NAVIGABILITIES_SUFFIX):
+    """
+    Saves the ttl files of the stages that were not run, from their cached graphs (as far as they are still cached).
+    """
+    if not checkpoints:
+        return
+    for stage in ["raw"] + [stage for stage, _ in PROCESS_STEPS]:
+        if (graph := cache.load_graph(stage_keys[stage])) is not None:
+            save_graph(graph, generate_file_path(short_name, stage, output_folder), streaming=True)
+        if stage == up_to_stage:
+            break
+
+
+def _save_checkpoint(graph: Graph, short_name, stage, output_folder=OUTPUT_FOLDER, checkpoints: bool = False):
+    if checkpoints:
+        save_graph(graph, generate_file_path(short_name, stage, output_folder), streaming=True)
 
 
 def osm_via_rsm_to_kml(osm_geojson_file, short_name, base_path=OUTPUT_FOLDER):
@@ -86,6 +315,7 @@ def osm_via_rsm_to_kml(osm_geojson_file, short_name, base_path=OUTPUT_FOLDER):
     Direct transformation, without attempting to split or merge.
     """
     print(f"Reading the OSM file: {osm_geojson_file}")
+    from Code.Export.export_ttl_to_kml import ttl_to_kml
     from Import.OSM_import.osm_geojson_to_ttl import geojson_to_ttl
     geojson_to_ttl(osm_geojson_file)
     ttl_to_kml(
@@ -0,0 +1,59 @@
+# Batch computation of geodesic metrics (segment lengths, element lengths, azimuths at extremities) of linestrings.
+# Coordinates of all linestrings are held in flat NumPy arrays (longitudes, latitudes, WGS84), together with an
+# offsets array: linestring i spans the indices offsets[i] to offsets[i + 1] - 1.
+# Metrics are then obtained with a few calls to the pyproj Geod array APIs, instead of one call per vertex pair.
+import numpy as np
+import shapely
+from pyproj import Geod
+
+wgs84_geod = Geod(ellps='WGS84')
+
+
+def flatten_linestrings(linestrings) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :param linestrings: array-like of shapely linestrings, longitude first
+    :return: longitudes, latitudes, and offsets (length = number of linestrings + 1)
+    """
+    linestrings = np.asarray(linestrings, dtype=object)
+    coords = shapely.get_coordinates(linestrings)
+    offsets = np.zeros(len(linestrings) + 1, dtype=np.int64)
+    np.cumsum(shapely.get_num_coordinates(linestrings), out=offsets[1:])
+    return coords[:, 0], coords[:, 1], offsets
+
+
+def segment_lengths(lons: np.ndarray, lats: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Lengths of the segments between consecutive coordinates, in meter.
+    :return: array of length len(lons) - 1; "segments" joining the last vertex of a linestring to the first vertex
+    of the next one are set to 0.
+    """
+    if len(lons) < 2:
+        return np.zeros(0)
+    lengths = np.asarray(wgs84_geod.line_lengths(lons, lats), dtype=float)
+    boundaries = offsets[1:-1] - 1
+    lengths[boundaries[(boundaries >= 0) & (boundaries < len(lengths))]] = 0.
+    return lengths
+
+
+def linestring_lengths(lons: np.ndarray, lats: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Geodesic length of each linestring, in meter.
+    Note that this is the length of the 2D projection.
+    """
+    cumulated = np.concatenate(([0.], np.cumsum(segment_lengths(lons, lats, offsets))))
+    starts, ends = offsets[:-1], np.maximum(offsets[1:] - 1, offsets[:-1])
+    return cumulated[ends] - cumulated[starts]
+
+
+def end_azimuths(lons: np.ndarray, lats: np.ndarray, offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Azimuths at both extremities of each linestring, in degrees ([-180, 180], pyproj setting),
+    pointing outwards: from the neighbouring vertex to the extremity.
+    Linestrings must have at least two vertices (otherwise, the vertices of their neighbours would be read): callers
+    filter out the others (see step03_add_ports.add_ports_in_graph).
+    :return: azimuths at the start points, azimuths at the end points
+    """
+    starts, ends = offsets[:-1], offsets[1:] - 1
+    azimuths0 = wgs84_geod.inv(lons[starts + 1], lats[starts + 1], lons[starts], lats[starts])[0]
+    azimuths1 = wgs84_geod.inv(lons[ends - 1], lats[ends - 1], lons[ends], lats[ends])[0]
+    return np.asarray(azimuths0, dtype=float), np.asarray(azimuths1, dtype=float)
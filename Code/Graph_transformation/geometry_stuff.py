@@ -2,12 +2,14 @@
 # Topology can be set up from schematic or geographic representations of the network with low risk of error.
 import itertools
 
+import numpy as np
+import shapely
 from pyproj import Transformer
 from rdflib import URIRef
-from rdflib.namespace import RDF
-from shapely.geometry import Point, LineString
+from shapely.geometry import Point
+from shapely.strtree import STRtree
 
-from Namespaces import RSM_TOPOLOGY, GEOSPARQL
+from Graph_transformation.topology_view import TopologyView
 
 NAVIGABILITY_ANGULAR_THRESHOLD = 75  # degrees. Used for detecting the heel side of a switch on a schematic representation.
 
@@ -15,112 +17,138 @@ NAVIGABILITY_ANGULAR_THRESHOLD = 75  # degrees. Used for detecting the heel side
 transformer = Transformer.from_crs("EPSG:4326", "EPSG:3034", always_xy=True)
 
 
-def deviation_angle(azimuth_1: float, azimuth_2: float) -> float:
+def deviation_angles(azimuths_1: np.ndarray, azimuths_2: np.ndarray) -> np.ndarray:
     """
-    Deviation angle at the junction between two linear elements.
-    :param azimuth_1: of port X of element A at junction
-    :param azimuth_2: of port Y of element B at junction
-    :return: angle, in degrees, in [-180, 180] interval
+    Deviation angles at junctions between linear elements: navigability is possible when the absolute deviation is
+    small (see NAVIGABILITY_ANGULAR_THRESHOLD).
+    :param azimuths_1: of ports X of elements A at junctions, in degrees, in [-180, 180] (pyproj setting)
+    :param azimuths_2: of ports Y of elements B at junctions, idem
+    :return: angles, in degrees, in [-180, 180] interval
     """
-    dev = azimuth_1 - (azimuth_2 - 180)
-    if dev > 180:
-        dev -= 360
-    elif dev < -180:
-        dev += 360
-    return dev
+    dev = azimuths_1 - (azimuths_2 - 180)
+    return np.where(dev > 180, dev - 360, np.where(dev < -180, dev + 360, dev))
 
 
-def possible_navigability(azimuth_1: float, azimuth_2: float,
-                          small_angle: float = NAVIGABILITY_ANGULAR_THRESHOLD) -> bool:
+def project_geometries(geometries):
     """
-    Determines whether it is possible to navigate between linear elements basing on the azimuths of their connected
-    extremities. Azimuths values are provided in degrees, in the range [-180, 180] (this is a pyproj setting).
-    "Possibility" is provided when the azimuth difference, modulo 180 degrees, is "small".
-    :param azimuth_1:
-    :param azimuth_2:
-    :param small_angle: 30° by default
-    :return: True if navigability is possible, else False
+    Reprojects shapely geometries from WGS84 to EPSG:3034, all coordinates at once.
+    :param geometries: array-like of shapely geometries, longitude first
+    :return: array of projected geometries
     """
-    abs_deviation = abs(deviation_angle(azimuth_1, azimuth_2))
-    return abs_deviation < small_angle
+    return shapely.transform(np.asarray(geometries, dtype=object),
+                             lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])))
 
 
-def find_nearest_linear_elements(lonlat: tuple[float, float], graph, count: int = 1) -> dict[URIRef:float]:
+class SpatialIndex:
+    """
+    STRtree-based index over the linear elements and the ports of a topology view, in projected coordinates
+    (EPSG:3034). Build it once per graph, then query it as often as needed; it must be rebuilt if linear elements
+    or ports are added or moved, but removed ones can be excluded at query time.
+    """
+
+    def __init__(self, topology: TopologyView):
+        self.element_ports: dict[URIRef, list[URIRef]] = {}
+        port_uris, port_wkts = [], []
+        for port in topology.ports:
+            if wkt := topology.wkt_of(port):
+                port_uris.append(port)
+                port_wkts.append(wkt)
+
+        element_uris, element_wkts = [], []
+        for element in topology.linear_elements:
+            self.element_ports[element] = topology.ports_of(element)
+            if wkt := topology.wkt_of(element):
+                element_uris.append(element)
+                element_wkts.append(wkt)
+
+        self.element_uris = element_uris
+        self.element_geometries = project_geometries(shapely.from_wkt(element_wkts))
+        self.port_uris = port_uris
+        self.port_points = project_geometries(shapely.from_wkt(port_wkts))
+        self.port_index = {port: index for index, port in enumerate(port_uris)}
+        self._element_tree = STRtree(self.element_geometries)
+        self._port_tree = STRtree(self.port_points)
+
+    @staticmethod
+    def project(lonlat: tuple[float, float]) -> Point:
+        return Point(transformer.transform(*lonlat))
+
+    def nearest_elements(self, lonlat: tuple[float, float], count: int = 1) -> dict[URIRef:float]:
+        """
+        :param lonlat: longitude and latitude, decimal degrees (WGS84)
+        :param count: max number of linear elements to be returned
+        :return: dict, key = URIRef of linear element, value = projected distance, sorted by increasing distance
+        """
+        return self._k_nearest(self._element_tree, self.element_geometries, self.element_uris, lonlat, count)
+
+    def elements_within(self, lonlat: tuple[float, float], distance: float) -> dict[URIRef:float]:
+        """
+        :param lonlat: longitude and latitude, decimal degrees (WGS84)
+        :param distance: in meters
+        :return: dict, key = URIRef of linear element, value = projected distance, sorted by increasing distance
+        """
+        return self._within(self._element_tree, self.element_geometries, self.element_uris, lonlat, distance)
+
+    def nearest_ports(self, lonlat: tuple[float, float], count: int = 1) -> dict[URIRef:float]:
+        return self._k_nearest(self._port_tree, self.port_points, self.port_uris, lonlat, count)
+
+    def ports_within(self, lonlat: tuple[float, float], distance: float) -> dict[URIRef:float]:
+        return self._within(self._port_tree, self.port_points, self.port_uris, lonlat, distance)
+
+    def nearest_ports_of_element(self, lonlat: tuple[float, float], net_element, count: int = 1) -> dict[URIRef:float]:
+        point = self.project(lonlat)
+        distances = {port: point.distance(self.port_points[self.port_index[port]])
+                     for port in self.element_ports.get(net_element, []) if port in self.port_index}
+        return dict(sorted(distances.items(), key=lambda item: item[1])[:count])
+
+    def _within(self, tree: STRtree, geometries, uris: list, lonlat: tuple[float, float], distance: float) -> dict:
+        point = self.project(lonlat)
+        indices = tree.query(point, predicate='dwithin', distance=distance)
+        distances = shapely.distance(point, geometries[indices])
+        order = np.argsort(distances, kind='stable')
+        return {uris[indices[i]]: float(distances[i]) for i in order}
+
+    def _k_nearest(self, tree: STRtree, geometries, uris: list, lonlat: tuple[float, float], count: int) -> dict:
+        """The search radius starts at the distance of the nearest item, and is doubled until count items are found."""
+        if not uris or count < 1:
+            return {}
+        point = self.project(lonlat)
+        _, (nearest_distance,) = tree.query_nearest(point, return_distance=True, all_matches=False)
+        radius = max(float(nearest_distance), 1.0)
+        while True:
+            found = self._within(tree, geometries, uris, lonlat, radius)
+            if len(found) >= count or len(found) == len(uris):
+                return dict(itertools.islice(found.items(), count))
+            radius *= 2
+
+
+def find_nearest_linear_elements(lonlat: tuple[float, float], graph, count: int = 1,
+                                 spatial_index: SpatialIndex = None) -> dict[URIRef:float]:
     """
 
     :param lonlat: longitude and latitude, decimal degrees (WGS84)
     :param graph: graph comprising linear elements and ports
     :param count: max number of linear elements to be returned
+    :param spatial_index: index built over the graph; if None, a new one is built (costly: better pass it along)
     :return: dict with <count> items, key = URIRef of linear element, value = projected distance from coords to element
     """
+    spatial_index = spatial_index or SpatialIndex(TopologyView(graph))
+    return spatial_index.nearest_elements(lonlat, count)
 
-    # Transform input coordinates
-    easting, northing = transformer.transform(*lonlat)
-    point = Point(easting, northing)
-    distances = {}
-
-    for s, p, o in graph.triples((None, RDF.type, URIRef("http://cdm.ovh/rsm/topology/topology#LinearElement"))):
-        ports = list(graph.objects(s, URIRef("http://cdm.ovh/rsm/topology/topology#hasPort")))
-
-        if len(ports) == 2:
-            port_coords = []
-            for port in ports:
-                wkt_literal = graph.value(port, URIRef("http://www.opengis.net/ont/geosparql#asWKT"))
-                if wkt_literal:
-                    lon, lat = wkt_point_to_lon_lat(wkt_literal)
-                    easting, northing = transformer.transform(lon, lat)
-                    port_coords.append((easting, northing))
-
-            if len(port_coords) == 2:
-                start_easting, start_northing = port_coords[0]
-                end_easting, end_northing = port_coords[1]
 
-                # Create a LineString for the segment
-                line = LineString([(start_easting, start_northing), (end_easting, end_northing)])
-
-                # Calculate projected distance from point to the line segment
-                distance = point.distance(line)
-                distances[s] = distance
-
-    # Return the nearest 'count' elements
-    nearest_elements = dict(sorted(distances.items(), key=lambda item: item[1]))
-    if len(nearest_elements) > count:
-        count_nearest_elements = {k: nearest_elements[k] for k in itertools.islice(nearest_elements, count)}
-        return count_nearest_elements
-    return nearest_elements
-
-
-def find_nearest_ports(coords: tuple[float, float], graph, net_element, count: int = 1) -> dict[URIRef:float]:
+def find_nearest_ports(coords: tuple[float, float], graph, net_element, count: int = 1,
+                       spatial_index: SpatialIndex = None) -> dict[URIRef:float]:
     """
     In this version, only linear net elements are considered.
     :param coords: longitude and latitude, decimal degrees (WGS84)
     :param graph: containing linear elements and their ports, with coordinates as WKT literals
     :param net_element: the net element considered
     :param count: max number of ports to be returned (cannot exceed 2 if element is a linear one)
+    :param spatial_index: index built over the graph; if None, a new one is built (costly: better pass it along)
     :return: dict[URIRef:float] where URIRef refers to the port, and float is the value of the distance
     """
-
-    point = Point(transformer.transform(*coords))
-    distances = {}
-
-    # Iterate over ports of the given net element
-    ports = list(graph.objects(net_element, RSM_TOPOLOGY.hasPort))
-    for port in ports:
-        wkt_literal = graph.value(port, GEOSPARQL.asWKT)
-        if wkt_literal:
-            lon, lat = wkt_point_to_lon_lat(wkt_literal)
-            easting, northing = transformer.transform(lon, lat)
-
-            port_point = Point(easting, northing)
-            distance = point.distance(port_point)
-            distances[port] = distance
-
-    # Return the nearest 'count' ports
-    nearest_ports = dict(sorted(distances.items(), key=lambda item: item[1]))
-    if len(nearest_ports) > count:
-        count_nearest_ports = {k: nearest_ports[k] for k in itertools.islice(nearest_ports, count)}
-        return count_nearest_ports
-    return nearest_ports
+    spatial_index = spatial_index or SpatialIndex(TopologyView(graph))
+    return spatial_index.nearest_ports_of_element(coords, net_element, count)
 
 
 def wkt_point_to_lon_lat(wkt_literal: str) -> tuple[float, float]:
@@ -1,18 +1,73 @@
+import gzip
+import os
 from typing import Optional
 
 from rdflib import Graph
 
+from Graph_transformation.graph_store import StoreConfig
+from Graph_transformation.parallel_loader import load_ntriples_parallel, PARALLEL_LOAD_THRESHOLD_MB
+from Graph_transformation.graph_snapshot import save_snapshot, load_snapshot, SNAPSHOT_SUFFIX
+from Graph_transformation.triple_writer import write_graph, GZIP_SUFFIX, NTRIPLES_SUFFIXES
+
 FILE_SAVE_MSG = "All data saved to {}"
 
 
-def load_graph(input_ttl: str) -> Graph:
-    graph = Graph()
-    graph.parse(input_ttl, format="turtle")
+def new_graph(store: Optional[StoreConfig] = None) -> Graph:
+    """
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory
+    """
+    return store.new_graph() if store else Graph()
+
+
+def load_graph(input_ttl: str, store: Optional[StoreConfig] = None) -> Graph:
+    """
+    :param input_ttl: Turtle file; N-Triples if ending with '.nt', gzip-compressed if ending with '.gz';
+    binary snapshot (see graph_snapshot) if ending with SNAPSHOT_SUFFIX.
+    Uncompressed N-Triples files larger than PARALLEL_LOAD_THRESHOLD_MB are parsed in parallel (see parallel_loader).
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory
+    """
+    graph = new_graph(store)
+    if input_ttl.endswith(SNAPSHOT_SUFFIX):
+        return load_snapshot(input_ttl, graph)
+    if input_ttl.endswith(NTRIPLES_SUFFIXES[0]) and \
+            os.path.getsize(input_ttl) > PARALLEL_LOAD_THRESHOLD_MB * 1024 * 1024:
+        return load_ntriples_parallel(input_ttl, graph)
+    rdf_format = 'nt' if input_ttl.endswith(NTRIPLES_SUFFIXES) else 'turtle'
+    if input_ttl.endswith(GZIP_SUFFIX):
+        with gzip.open(input_ttl, 'rb') as source:
+            graph.parse(source, format=rdf_format)
+    else:
+        graph.parse(input_ttl, format=rdf_format)
     return graph
 
 
-def save_graph(graph: Graph, output_ttl: Optional[str]):
-    if output_ttl:
+def read_graph_file(input_path: str) -> str:
+    """
+    :return: content of a graph file, decompressed if ending with '.gz'
+    """
+    if input_path.endswith(GZIP_SUFFIX):
+        with gzip.open(input_path, 'rt', encoding='utf-8') as source:
+            return source.read()
+    with open(input_path, encoding='utf-8') as source:
+        return source.read()
+
+
+def save_graph(graph: Graph, output_ttl: Optional[str], streaming: bool = False):
+    """
+    :param graph:
+    :param output_ttl: if None, the graph is printed
+    :param streaming: if True, the graph is written as it is read (see triple_writer): as flat Turtle, or as
+    N-Triples if the file name ends with '.nt'; gzip-compressed if it ends with '.gz'.
+    Otherwise, rdflib's (pretty) Turtle serializer is used.
+    Whatever the streaming parameter, a binary snapshot is written if the file name ends with SNAPSHOT_SUFFIX.
+    """
+    if output_ttl and output_ttl.endswith(SNAPSHOT_SUFFIX):
+        save_snapshot(graph, output_ttl)
+        print(FILE_SAVE_MSG.format(output_ttl))
+    elif output_ttl and streaming:
+        write_graph(graph, output_ttl)
+        print(FILE_SAVE_MSG.format(output_ttl))
+    elif output_ttl:
         graph.serialize(destination=output_ttl, format='turtle')
         print(FILE_SAVE_MSG.format(output_ttl))
     else:
@@ -0,0 +1,228 @@
+# Compact binary snapshots of graphs, for intermediate results that are only meant to be read again by the pipeline
+# (stage cache entries, or files passed between the file-based steps): much faster to load than Turtle or N-Triples.
+# A snapshot file holds:
+# - a term dictionary: every distinct term is stored once; the triples are an array of integer term ids;
+# - the text of the terms concatenated in a single UTF-8 string, with an array of (character) offsets;
+# - the WKT literals as WKB, read back with a single vectorized shapely call. The WKT text is regenerated with the
+#   same formatting as the original literal (shapely's trimmed form, or the 16-decimal form of shapely.wkt.dumps);
+#   literals in any other formatting are stored as text.
+# The file starts with a JSON header describing the arrays, which follow it, 8-byte aligned: they are memory-mapped
+# when the file is read, without copying (see read_snapshot_arrays).
+import json
+import mmap
+from typing import Optional
+
+import numpy as np
+import shapely
+from rdflib import Graph, Literal, URIRef, BNode
+from rdflib.namespace import Namespace
+
+from Graph_transformation.triple_writer import used_namespaces
+
+SNAPSHOT_SUFFIX = '.rsmsnap'
+SNAPSHOT_MAGIC = b'RSMSNAP1'
+WKT_LITERAL = URIRef("http://www.opengis.net/ont/geosparql#wktLiteral")
+ALIGNMENT = 8
+
+# term kinds
+URIREF, BNODE, LITERAL, GEOMETRY = range(4)
+# WKT formattings that can be regenerated from WKB
+WKT_STYLES = [
+    dict(rounding_precision=-1, trim=True),   # str(geometry)
+    dict(rounding_precision=16, trim=False),  # shapely.wkt.dumps(geometry)
+]
+
+
+def save_snapshot(graph: Graph, output_path: str) -> int:
+    """
+    :param graph:
+    :param output_path: should end with SNAPSHOT_SUFFIX
+    :return: number of triples written
+    """
+    term_ids: dict = {}
+    terms = []
+
+    def term_id(node) -> int:
+        identifier = term_ids.get(node)
+        if identifier is None:
+            identifier = term_ids[node] = len(terms)
+            terms.append(node)
+            if isinstance(node, Literal) and node.datatype is not None:
+                term_id(node.datatype)
+        return identifier
+
+    triples = np.array([(term_id(subj), term_id(pred), term_id(obj)) for subj, pred, obj in graph],
+                       dtype=np.int32).reshape(-1, 3)
+
+    kinds = np.full(len(terms), URIREF, dtype=np.uint8)
+    datatypes = np.full(len(terms), -1, dtype=np.int32)
+    languages = np.full(len(terms), -1, dtype=np.int16)
+    language_tags: list[str] = []
+    texts = []
+    wkt_positions, wkt_texts = [], []
+    for position, node in enumerate(terms):
+        if isinstance(node, Literal):
+            kinds[position] = LITERAL
+            if node.datatype is not None:
+                datatypes[position] = term_ids[node.datatype]
+                if node.datatype == WKT_LITERAL:
+                    wkt_positions.append(position)
+                    wkt_texts.append(str(node))
+            elif node.language:
+                if node.language not in language_tags:
+                    language_tags.append(node.language)
+                languages[position] = language_tags.index(node.language)
+        elif isinstance(node, BNode):
+            kinds[position] = BNODE
+        texts.append(str(node))
+
+    geometries, styles = _encode_wkt(wkt_texts)
+    geometry_positions = np.array(wkt_positions, dtype=np.int64)[styles >= 0]
+    kinds[geometry_positions] = GEOMETRY
+    for position in geometry_positions:
+        texts[position] = ''
+    wkb = shapely.to_wkb(geometries[styles >= 0])
+
+    text_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in texts], out=text_offsets[1:])
+    wkb_offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+    np.cumsum([len(geometry) for geometry in wkb], out=wkb_offsets[1:])
+
+    arrays = {
+        'triples': triples,
+        'kinds': kinds,
+        'datatypes': datatypes,
+        'languages': languages,
+        'text_offsets': text_offsets,
+        'text': np.frombuffer(''.join(texts).encode('utf-8'), dtype=np.uint8),
+        'wkt_styles': styles[styles >= 0].astype(np.uint8),
+        'wkb_offsets': wkb_offsets,
+        'wkb': np.frombuffer(b''.join(wkb), dtype=np.uint8),
+    }
+    used = used_namespaces(graph)
+    header = {
+        'language_tags': language_tags,
+        'namespaces': [[prefix, str(namespace)] for prefix, namespace in graph.namespaces()
+                       if str(namespace) in used],
+        'arrays': {},
+    }
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = [array.dtype.str, list(array.shape), offset]
+        offset += _aligned(array.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes))
+
+    with open(output_path, 'wb') as output:
+        output.write(SNAPSHOT_MAGIC)
+        output.write(np.uint64(len(header_bytes)).tobytes())
+        output.write(header_bytes)
+        output.write(b'\0' * (data_start - output.tell()))
+        for array in arrays.values():
+            data = np.ascontiguousarray(array).tobytes()
+            output.write(data)
+            output.write(b'\0' * (_aligned(len(data)) - len(data)))
+    return len(triples)
+
+
+def read_snapshot_arrays(input_path: str) -> tuple[dict, dict[str, np.ndarray]]:
+    """
+    Memory-maps a snapshot file, without building a graph.
+    :return: header (as described in save_snapshot), arrays (read-only views of the file content)
+    """
+    with open(input_path, 'rb') as source:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError(f"Not a graph snapshot: {input_path}")
+    header_length = int(np.frombuffer(mapped, dtype=np.uint64, count=1, offset=len(SNAPSHOT_MAGIC))[0])
+    header_start = len(SNAPSHOT_MAGIC) + 8
+    header = json.loads(mapped[header_start:header_start + header_length].decode('utf-8'))
+    data_start = _aligned(header_start + header_length)
+    arrays = {}
+    for name, (dtype, shape, offset) in header['arrays'].items():
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(mapped, dtype=np.dtype(dtype), count=count,
+                                     offset=data_start + offset).reshape(shape)
+    return header, arrays
+
+
+def load_snapshot(input_path: str, graph: Optional[Graph] = None) -> Graph:
+    """
+    :param input_path: snapshot file, as written by save_snapshot
+    :param graph: graph the triples are added to; by default, a new graph
+    """
+    header, arrays = read_snapshot_arrays(input_path)
+    graph = Graph() if graph is None else graph
+    for prefix, namespace in header['namespaces']:
+        graph.bind(prefix, Namespace(namespace), replace=True)
+
+    text = arrays['text'].tobytes().decode('utf-8')
+    offsets = arrays['text_offsets'].tolist()
+    kinds = arrays['kinds'].tolist()
+    datatypes = arrays['datatypes'].tolist()
+    languages = arrays['languages'].tolist()
+    language_tags = header['language_tags']
+
+    wkt_texts = iter(_decode_wkt(arrays['wkb'], arrays['wkb_offsets'], arrays['wkt_styles']))
+    terms: list = [None] * len(kinds)
+    # datatypes are URIs, built in the first pass
+    for position, kind in enumerate(kinds):
+        if kind == URIREF:
+            terms[position] = URIRef(text[offsets[position]:offsets[position + 1]])
+        elif kind == BNODE:
+            terms[position] = BNode(text[offsets[position]:offsets[position + 1]])
+    for position, kind in enumerate(kinds):
+        if kind == LITERAL:
+            datatype = datatypes[position]
+            language = languages[position]
+            terms[position] = Literal(text[offsets[position]:offsets[position + 1]],
+                                      lang=language_tags[language] if language >= 0 else None,
+                                      datatype=terms[datatype] if datatype >= 0 else None)
+        elif kind == GEOMETRY:
+            terms[position] = Literal(next(wkt_texts), datatype=WKT_LITERAL)
+
+    # the triples are known to be valid: added to the store directly, skipping Graph.add's checks
+    store = graph.store
+    for subj, pred, obj in arrays['triples'].tolist():
+        store.add((terms[subj], terms[pred], terms[obj]), graph)
+    return graph
+
+
+def _encode_wkt(wkt_texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :return: the geometries, and the index in WKT_STYLES of the formatting of each WKT text (-1 if there is none, the
+    text having then to be stored as such)
+    """
+    styles = np.full(len(wkt_texts), -1, dtype=np.int8)
+    if not wkt_texts:
+        return np.empty(0, dtype=object), styles
+    texts = np.array(wkt_texts, dtype=object)
+    geometries = shapely.from_wkt(texts, on_invalid='ignore')
+    valid = ~shapely.is_missing(geometries)
+    for index, style in enumerate(WKT_STYLES):
+        pending = valid & (styles < 0)
+        if not pending.any():
+            break
+        regenerated = shapely.to_wkt(geometries[pending], **style)
+        styles[np.flatnonzero(pending)[regenerated == texts[pending]]] = index
+    return geometries, styles
+
+
+def _decode_wkt(wkb: np.ndarray, wkb_offsets: np.ndarray, wkt_styles: np.ndarray) -> list[str]:
+    """
+    :return: the WKT texts, in the order of the geometries
+    """
+    data = wkb.tobytes()
+    bounds = wkb_offsets.tolist()
+    geometries = shapely.from_wkb(np.array([data[bounds[index]:bounds[index + 1]]
+                                            for index in range(len(bounds) - 1)], dtype=object))
+    texts = np.empty(len(geometries), dtype=object)
+    for index, style in enumerate(WKT_STYLES):
+        selected = wkt_styles == index
+        if selected.any():
+            texts[selected] = shapely.to_wkt(geometries[selected], **style)
+    return texts.tolist()
+
+
+def _aligned(size: int) -> int:
+    return -(-size // ALIGNMENT) * ALIGNMENT
@@ -0,0 +1,317 @@
+# Store configurations for the graphs built by the pipeline (see graph_file_handing.new_graph).
+# By default, graphs are held in memory by rdflib. For inputs too large for that, SQLiteStore keeps the triples in a
+# local SQLite database on disk, within a fixed page cache:
+# - every distinct term is stored once, in a table of terms; triples are rows of three term ids;
+# - triples are indexed in the three orders SPO, POS and OSP, so that any triple pattern is a range scan;
+# - added triples are buffered and inserted in batches, one transaction per batch; removed triples are deleted
+#   within the current transaction, committed with the next batch (or by commit);
+# - matching triples are read page by page (each page being a separate query), so that the graph can be modified
+#   while its triples are being iterated, as the steps do.
+import os
+import sqlite3
+import tempfile
+import weakref
+from typing import Iterator, Optional
+
+from rdflib import Graph, Literal, URIRef, BNode
+from rdflib.store import Store, VALID_STORE
+
+MEMORY = 'memory'
+SQLITE = 'sqlite'
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_CACHE_SIZE_MB = 64
+PAGE_SIZE = 10000
+TERM_CACHE_SIZE = 100000
+
+# term kinds
+URIREF, BNODE, LITERAL = range(3)
+
+# for each set of bound positions (subject, predicate, object), the index giving the matching triples in a range:
+# its columns, in order
+_INDEX_COLUMNS = {
+    (False, False, False): ('s', 'p', 'o'),
+    (True, False, False): ('s', 'p', 'o'),
+    (True, True, False): ('s', 'p', 'o'),
+    (True, True, True): ('s', 'p', 'o'),
+    (False, True, False): ('p', 'o', 's'),
+    (False, True, True): ('p', 'o', 's'),
+    (False, False, True): ('o', 's', 'p'),
+    (True, False, True): ('o', 's', 'p'),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY, kind INTEGER NOT NULL, value TEXT NOT NULL, datatype TEXT NOT NULL, lang TEXT NOT NULL,
+    UNIQUE (value, kind, datatype, lang));
+CREATE TABLE IF NOT EXISTS triples (
+    s INTEGER NOT NULL, p INTEGER NOT NULL, o INTEGER NOT NULL, PRIMARY KEY (s, p, o)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS triples_pos ON triples (p, o, s);
+CREATE INDEX IF NOT EXISTS triples_osp ON triples (o, s, p);
+CREATE TABLE IF NOT EXISTS namespaces (prefix TEXT PRIMARY KEY, namespace TEXT NOT NULL);
+"""
+
+
+class StoreConfig:
+
+    def __init__(self, kind: str = MEMORY, path: Optional[str] = None, folder: Optional[str] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, cache_size_mb: float = DEFAULT_CACHE_SIZE_MB):
+        """
+        :param kind: MEMORY (rdflib's default store) or SQLITE
+        :param path: SQLITE only: database file, created if needed, and opened with its content if it exists.
+        By default, each graph gets its own temporary database, deleted when the graph is closed or garbage collected.
+        :param folder: SQLITE only: folder of the temporary databases; by default, the system temporary folder
+        :param batch_size: SQLITE only: number of added triples inserted together, in one transaction
+        :param cache_size_mb: SQLITE only: size of the database page cache
+        """
+        if kind not in (MEMORY, SQLITE):
+            raise ValueError(f"Unknown store kind: {kind}")
+        self.kind = kind
+        self.path = path
+        self.folder = folder
+        self.batch_size = batch_size
+        self.cache_size_mb = cache_size_mb
+
+    def new_graph(self) -> Graph:
+        """
+        :return: a graph held by a store as configured (empty, unless opening an existing database)
+        """
+        if self.kind == MEMORY:
+            return Graph()
+        path = self.path
+        if not path:
+            if self.folder:
+                os.makedirs(self.folder, exist_ok=True)
+            file_descriptor, path = tempfile.mkstemp(dir=self.folder, prefix='graph_', suffix='.sqlite')
+            os.close(file_descriptor)
+        store = SQLiteStore(batch_size=self.batch_size, cache_size_mb=self.cache_size_mb,
+                            delete_on_close=not self.path)
+        graph = Graph(store=store)
+        graph.open(path, create=True)
+        return graph
+
+
+class SQLiteStore(Store):
+    context_aware = False
+    formula_aware = False
+    transaction_aware = True
+    graph_aware = False
+
+    def __init__(self, configuration: Optional[str] = None, identifier=None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, cache_size_mb: float = DEFAULT_CACHE_SIZE_MB,
+                 delete_on_close: bool = False):
+        """
+        :param configuration: database file; if given, the store is opened
+        :param batch_size: number of added triples inserted together, in one transaction
+        :param cache_size_mb: size of the database page cache
+        :param delete_on_close: if True, the database file is deleted when the store is closed or garbage collected.
+        Otherwise, the store must be closed for the last added triples to be saved.
+        """
+        self.batch_size = batch_size
+        self.cache_size_mb = cache_size_mb
+        self.path: Optional[str] = None
+        self.delete_on_close = delete_on_close
+        self._connection: Optional[sqlite3.Connection] = None
+        self._finalizer = None
+        self._pending: list = []
+        self._term_ids: dict = {}
+        self._terms: dict = {}
+        self._namespace: dict[str, URIRef] = {}
+        self._prefix: dict[URIRef, str] = {}
+        super().__init__(configuration, identifier)
+
+    def open(self, configuration: str, create: bool = False) -> Optional[int]:
+        if not create and not os.path.exists(configuration):
+            raise FileNotFoundError(configuration)
+        self.path = configuration
+        self._connection = sqlite3.connect(configuration)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute(f"PRAGMA cache_size = {-int(self.cache_size_mb * 1024)}")
+        self._connection.executescript(_SCHEMA)
+        for prefix, namespace in self._connection.execute("SELECT prefix, namespace FROM namespaces"):
+            self._namespace[prefix] = URIRef(namespace)
+            self._prefix[URIRef(namespace)] = prefix
+        self._finalizer = weakref.finalize(self, _close_connection, self._connection, self.path,
+                                          self.delete_on_close)
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction: bool = False) -> None:
+        if self._connection is None:
+            return
+        self.commit()
+        self._finalizer.detach()
+        _close_connection(self._connection, self.path, self.delete_on_close)
+        self._connection = None
+
+    def destroy(self, configuration: str) -> None:
+        self.close()
+        for path in (configuration, configuration + '-wal', configuration + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def commit(self) -> None:
+        self._flush()
+        self._connection.execute("DELETE FROM namespaces")
+        self._connection.executemany("INSERT INTO namespaces VALUES (?, ?)",
+                                     [(prefix, str(namespace)) for prefix, namespace in self._namespace.items()])
+        self._connection.commit()
+
+    def rollback(self) -> None:
+        self._pending.clear()
+        self._connection.rollback()
+        self._term_ids.clear()
+        self._terms.clear()
+
+    def add(self, triple, context, quoted: bool = False) -> None:
+        self._pending.append(triple)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def addN(self, quads) -> None:
+        for subj, pred, obj, context in quads:
+            self.add((subj, pred, obj), context)
+
+    def remove(self, triple_pattern, context=None) -> None:
+        self._flush()
+        conditions = self._conditions(triple_pattern)
+        if conditions is None:
+            return
+        where, parameters = conditions
+        self._connection.execute(f"DELETE FROM triples{where}", parameters)
+
+    def triples(self, triple_pattern, context=None) -> Iterator:
+        self._flush()
+        conditions = self._conditions(triple_pattern)
+        if conditions is None:
+            return
+        where, parameters = conditions
+        columns = _INDEX_COLUMNS[tuple(term is not None for term in triple_pattern)]
+        order = ", ".join(columns)
+        after = f"({order}) > (?, ?, ?)"
+        where = f"{where} AND {after}" if where else f" WHERE {after}"
+        query = f"SELECT s, p, o FROM triples{where} ORDER BY {order} LIMIT {PAGE_SIZE}"
+        last = (-1, -1, -1)
+        while True:
+            rows = self._connection.execute(query, parameters + list(last)).fetchall()
+            for subj, pred, obj in rows:
+                yield (self._term(subj), self._term(pred), self._term(obj)), iter(())
+            if len(rows) < PAGE_SIZE:
+                break
+            row = dict(zip(('s', 'p', 'o'), rows[-1]))
+            last = tuple(row[column] for column in columns)
+
+    def __len__(self, context=None) -> int:
+        self._flush()
+        return self._connection.execute("SELECT COUNT(*) FROM triples").fetchone()[0]
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def bind(self, prefix: str, namespace: URIRef, override: bool = True) -> None:
+        # same behaviour as rdflib's Memory store
+        bound_namespace = self._namespace.get(prefix)
+        bound_prefix = self._prefix.get(namespace)
+        if bound_prefix is None and bound_namespace is not None:
+            bound_prefix = self._prefix.get(bound_namespace)
+        if override:
+            if bound_prefix is not None:
+                del self._namespace[bound_prefix]
+            if bound_namespace is not None:
+                del self._prefix[bound_namespace]
+            self._prefix[namespace] = prefix
+            self._namespace[prefix] = namespace
+        else:
+            namespace = bound_namespace if bound_namespace is not None else namespace
+            prefix = bound_prefix if bound_prefix is not None else prefix
+            self._prefix[namespace] = prefix
+            self._namespace[prefix] = namespace
+
+    def namespace(self, prefix: str) -> Optional[URIRef]:
+        return self._namespace.get(prefix)
+
+    def prefix(self, namespace: URIRef) -> Optional[str]:
+        return self._prefix.get(namespace)
+
+    def namespaces(self) -> Iterator:
+        yield from list(self._namespace.items())
+
+    def _flush(self) -> None:
+        """
+        Inserts the buffered triples, in one transaction.
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        with self._connection:
+            rows = [(self._term_id(subj, True), self._term_id(pred, True), self._term_id(obj, True))
+                    for subj, pred, obj in pending]
+            self._connection.executemany("INSERT OR IGNORE INTO triples VALUES (?, ?, ?)", rows)
+
+    def _conditions(self, triple_pattern) -> Optional[tuple[str, list]]:
+        """
+        :return: WHERE clause and its parameters; None if a term of the pattern is not in the store (no match)
+        """
+        clauses, parameters = [], []
+        for column, term in zip(('s', 'p', 'o'), triple_pattern):
+            if term is not None:
+                term_id = self._term_id(term, False)
+                if term_id is None:
+                    return None
+                clauses.append(f"{column} = ?")
+                parameters.append(term_id)
+        return (" WHERE " + " AND ".join(clauses) if clauses else "", parameters)
+
+    def _term_id(self, term, insert: bool) -> Optional[int]:
+        """
+        :param insert: if True, the term is added to the table of terms if needed
+        :return: id of the term; None if not in the table of terms (and not inserted)
+        """
+        term_id = self._term_ids.get(term)
+        if term_id is not None:
+            return term_id
+        key = _term_key(term)
+        row = self._connection.execute(
+            "SELECT id FROM terms WHERE value = ? AND kind = ? AND datatype = ? AND lang = ?", key).fetchone()
+        if row is not None:
+            term_id = row[0]
+        elif insert:
+            term_id = self._connection.execute(
+                "INSERT INTO terms (value, kind, datatype, lang) VALUES (?, ?, ?, ?)", key).lastrowid
+        else:
+            return None
+        if len(self._term_ids) >= TERM_CACHE_SIZE:
+            self._term_ids.clear()
+        self._term_ids[term] = term_id
+        return term_id
+
+    def _term(self, term_id: int):
+        term = self._terms.get(term_id)
+        if term is None:
+            value, kind, datatype, lang = self._connection.execute(
+                "SELECT value, kind, datatype, lang FROM terms WHERE id = ?", (term_id,)).fetchone()
+            if kind == URIREF:
+                term = URIRef(value)
+            elif kind == BNODE:
+                term = BNode(value)
+            else:
+                term = Literal(value, lang=lang or None, datatype=URIRef(datatype) if datatype else None)
+            if len(self._terms) >= TERM_CACHE_SIZE:
+                self._terms.clear()
+            self._terms[term_id] = term
+        return term
+
+
+def _term_key(term) -> tuple[str, int, str, str]:
+    if isinstance(term, Literal):
+        return str(term), LITERAL, str(term.datatype or ''), term.language or ''
+    if isinstance(term, BNode):
+        return str(term), BNODE, '', ''
+    return str(term), URIREF, '', ''
+
+
+def _close_connection(connection: sqlite3.Connection, path: str, delete: bool) -> None:
+    connection.close()
+    if delete:
+        for file_path in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(file_path):
+                os.remove(file_path)
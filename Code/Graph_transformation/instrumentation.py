@@ -0,0 +1,237 @@
+# Structured instrumentation of the stages of the pipeline (importers and transformation steps).
+# A stage runs within `with Stage(name, graph) as stage:`; when it ends, one event (a dict) is emitted to the
+# registered sinks:
+# - stage: name of the stage; start: time it started (seconds since the epoch); seconds: duration;
+# - triples_in, triples_out: size of the graph at the start and at the end of the stage (None without graph);
+# - linear_elements, ports: numbers of linear elements and ports in the graph at the end of the stage;
+# - triples_per_second: throughput, as triples_out / seconds;
+# - peak_rss_delta_mb: increase of the peak memory (resident set size) of the process during the stage, i.e. how much
+#   higher than all the previous stages the stage went (0 where the resource module is not available, e.g. Windows);
+# - warnings: messages issued with warn() during the stage (printed as well);
+# - error: type and message of the exception that ended the stage, if any.
+# The graph may be unknown when the stage starts (importers create it): it can be assigned to stage.graph within the
+# block. Stages may be nested (e.g. the import within a whole transformation); warnings go to the innermost one.
+# Sinks are registered for the whole process, as logging handlers are (add_sink, remove_sink, or `with sinks(...)`);
+# when none is registered, a stage costs a timer only, and no counts are made. Available sinks:
+# - JsonLinesSink: one JSON object per line, appended to a file;
+# - LoggingSink: one log record per event, and one per warning;
+# - CollectorSink: events kept in memory (e.g. for benchmarks, or comparisons between runs).
+# Progress within a stage is reported separately, to a progress callback passed to the functions that accept one:
+# progress(stage, fraction), with fraction in [0, 1]. Long loops report through a ProgressReporter, which only calls
+# back when the fraction has grown by PROGRESS_STEP at least, so that reporting costs nothing noticeable.
+import contextlib
+import contextvars
+import json
+import logging
+import sys
+import time
+from typing import Callable, Optional
+
+from rdflib import Graph, RDF
+
+from Namespaces import RSM_TOPOLOGY
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+LOGGER_NAME = 'rsm.pipeline'
+PROGRESS_STEP = 0.01
+
+ProgressCallback = Callable[[str, float], None]
+
+_sinks: list = []
+_current_stage: contextvars.ContextVar[Optional['Stage']] = contextvars.ContextVar('current_stage', default=None)
+
+
+class Stage:
+
+    def __init__(self, name: str, graph: Optional[Graph] = None):
+        """
+        :param name: name of the stage, as reported in its event
+        :param graph: graph processed by the stage; may also be assigned within the block
+        """
+        self.name = name
+        self.graph = graph
+        self.linear_elements: Optional[int] = None  # for stages without graph (e.g. GeoJSON output), set by the stage
+        self.warnings: list[str] = []
+        self.event: Optional[dict] = None
+        self._active = False
+
+    def __enter__(self) -> 'Stage':
+        self._active = bool(_sinks)
+        self._token = _current_stage.set(self)
+        if self._active:
+            self._triples_in = len(self.graph) if self.graph is not None else 0
+            self._peak_rss_mb = peak_rss_mb()
+            self._start = time.time()
+        self._timer = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._timer
+        _current_stage.reset(self._token)
+        if not self._active:
+            return False
+        self.event = {'stage': self.name, 'start': self._start, 'seconds': seconds,
+                      'triples_in': None, 'triples_out': None,
+                      'linear_elements': self.linear_elements, 'ports': None, 'triples_per_second': None}
+        if self.graph is not None:
+            self.event['triples_in'] = self._triples_in
+            self.event['triples_out'] = len(self.graph)
+            self.event['linear_elements'] = _count_instances(self.graph, RSM_TOPOLOGY.LinearElement)
+            self.event['ports'] = _count_instances(self.graph, RSM_TOPOLOGY.Port)
+            if seconds > 0:
+                self.event['triples_per_second'] = self.event['triples_out'] / seconds
+        self.event['peak_rss_delta_mb'] = max(0.0, peak_rss_mb() - self._peak_rss_mb)
+        self.event['warnings'] = self.warnings
+        if exc_type is not None:
+            self.event['error'] = f"{exc_type.__name__}: {exc_value}"
+        for sink in list(_sinks):
+            sink.emit(self.event)
+        return False
+
+
+def warn(message: str):
+    """
+    Prints a warning, and records it in the current stage, if any.
+    """
+    print(message)
+    stage = _current_stage.get()
+    if stage is not None:
+        stage.warnings.append(message.strip())
+
+
+def add_sink(sink):
+    """
+    :param sink: any object with an emit(event: dict) method
+    """
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+    if hasattr(sink, 'close'):
+        sink.close()
+
+
+@contextlib.contextmanager
+def sinks(*stage_sinks):
+    """
+    Registers sinks for the duration of a block, e.g. `with sinks(JsonLinesSink(path)): transform_geojson_to_rsm(...)`
+    """
+    for sink in stage_sinks:
+        add_sink(sink)
+    try:
+        yield stage_sinks
+    finally:
+        for sink in stage_sinks:
+            remove_sink(sink)
+
+
+class JsonLinesSink:
+
+    def __init__(self, path: str):
+        """
+        :param path: file the events are appended to, one JSON object per line
+        """
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def emit(self, event: dict):
+        self._file.write(json.dumps(event) + '\n')
+        self._file.flush()  # events are readable while a long conversion is still running
+
+    def close(self):
+        self._file.close()
+
+
+class LoggingSink:
+
+    def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.INFO):
+        """
+        :param logger: by default, the LOGGER_NAME logger
+        :param level: of the event records; warnings are logged at the WARNING level
+        """
+        self.logger = logger or logging.getLogger(LOGGER_NAME)
+        self.level = level
+
+    def emit(self, event: dict):
+        if 'error' in event:
+            self.logger.error("stage %s failed after %.3f s: %s", event['stage'], event['seconds'], event['error'])
+        else:
+            self.logger.log(self.level, "stage %s: %.3f s, %s -> %s triples, %s linear elements, %s ports, "
+                                        "peak memory +%.1f MB", event['stage'], event['seconds'], event['triples_in'],
+                            event['triples_out'], event['linear_elements'], event['ports'],
+                            event['peak_rss_delta_mb'], extra={'stage_event': event})
+        for message in event['warnings']:
+            self.logger.warning("stage %s: %s", event['stage'], message)
+
+
+class CollectorSink:
+
+    def __init__(self):
+        self.events: list[dict] = []
+
+    def emit(self, event: dict):
+        self.events.append(event)
+
+    def by_stage(self) -> dict[str, dict]:
+        """
+        :return: key = stage name, value = its latest event
+        """
+        return {event['stage']: event for event in self.events}
+
+
+class ProgressReporter:
+
+    def __init__(self, progress: Optional[ProgressCallback], stage: str, total: int, start: float = 0.0,
+                 end: float = 1.0):
+        """
+        Reports the progress of a loop over total items, as a fraction from start to end.
+        :param progress: callback; if None, nothing is reported
+        :param stage: name of the stage, passed to the callback
+        """
+        self.progress = progress
+        self.stage = stage
+        self.total = total
+        self.start = start
+        self.end = end
+        self._reported = None
+
+    def update(self, done: int):
+        """
+        :param done: number of items processed so far
+        """
+        if self.progress is None:
+            return
+        fraction = self.start + (self.end - self.start) * (min(done, self.total) / self.total if self.total else 1.0)
+        if self._reported is None or fraction - self._reported >= PROGRESS_STEP or fraction == self.end:
+            if fraction != self._reported:
+                self._reported = fraction
+                self.progress(self.stage, fraction)
+
+    def finish(self):
+        self.update(self.total)
+
+
+def report_progress(progress: Optional[ProgressCallback], stage: str, fraction: float):
+    if progress is not None:
+        progress(stage, fraction)
+
+
+def peak_rss_mb() -> float:
+    """
+    :return: peak resident set size of the current process, since its start; nan if the resource module is not
+    available
+    """
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, kilobytes on Linux
+
+
+def _count_instances(graph: Graph, rdf_class) -> int:
+    return sum(1 for _ in graph.subjects(RDF.type, rdf_class))
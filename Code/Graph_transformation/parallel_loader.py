@@ -0,0 +1,117 @@
+# Parallel loading of large N-Triples files: the file is cut into byte ranges, on line boundaries (an N-Triples line
+# being a triple), which are parsed by a pool of processes. Each process returns its own table of terms (as plain
+# strings) and its triples as an array of term ids; the main process merges the term tables, building each distinct
+# term once, and adds the triples to the graph.
+# Blank nodes keep their labels from the file, so that a blank node appearing in several ranges remains one node.
+# Binary snapshots (see graph_snapshot) need no parsing, and gzip-compressed files cannot be cut into ranges: both are
+# loaded by graph_file_handing.load_graph as usual.
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+from rdflib import Graph, Literal, URIRef, BNode
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+
+PARALLEL_LOAD_THRESHOLD_MB = 64  # smaller files are parsed by a single process, the pool startup not being worth it
+CHUNK_SIZE_MB = 16
+
+# term kinds
+URIREF, BNODE, LITERAL = range(3)
+
+
+def load_ntriples_parallel(input_path: str, graph: Optional[Graph] = None, max_workers: Optional[int] = None,
+                           chunk_size_mb: float = CHUNK_SIZE_MB) -> Graph:
+    """
+    :param input_path: N-Triples file (not compressed)
+    :param graph: graph the triples are added to; by default, a new graph
+    :param max_workers: number of processes; by default, the number of processors
+    :param chunk_size_mb: size of the byte ranges parsed by each task
+    """
+    graph = Graph() if graph is None else graph
+    ranges = chunk_ranges(input_path, int(chunk_size_mb * 1024 * 1024))
+    terms: dict[tuple, object] = {}
+    store = graph.store
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for term_keys, triples in executor.map(parse_chunk, [input_path] * len(ranges), *zip(*ranges)):
+            chunk_terms = []
+            for key in term_keys:
+                term = terms.get(key)
+                if term is None:
+                    term = terms[key] = _term(key)
+                chunk_terms.append(term)
+            # the triples are known to be valid: added to the store directly, skipping Graph.add's checks
+            for subj, pred, obj in triples.tolist():
+                store.add((chunk_terms[subj], chunk_terms[pred], chunk_terms[obj]), graph)
+    return graph
+
+
+def chunk_ranges(input_path: str, chunk_size: int) -> list[tuple[int, int]]:
+    """
+    :return: (start, end) byte offsets of consecutive ranges covering the file, each ending at a line end
+    """
+    file_size = os.path.getsize(input_path)
+    ranges = []
+    start = 0
+    with open(input_path, 'rb') as source:
+        while start < file_size:
+            source.seek(min(start + chunk_size, file_size))
+            source.readline()  # up to the end of the current line
+            end = min(source.tell(), file_size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_chunk(input_path: str, start: int, end: int) -> tuple[list[tuple[int, str, str, str]], np.ndarray]:
+    """
+    Parses a byte range of an N-Triples file (run in a worker process).
+    :return: table of the terms found, as (kind, text, datatype, language) tuples; triples, as an (n, 3) array of
+    indices in the table
+    """
+    with open(input_path, 'rb') as source:
+        source.seek(start)
+        data = source.read(end - start)
+    sink = _ChunkSink()
+    W3CNTriplesParser(sink).parsestring(data, bnode_context=_LabelBNodes())
+    return sink.term_keys, np.array(sink.triples, dtype=np.int64).reshape(-1, 3)
+
+
+class _ChunkSink:
+
+    def __init__(self):
+        self.term_ids: dict[tuple, int] = {}
+        self.term_keys: list[tuple[int, str, str, str]] = []
+        self.triples: list[tuple[int, int, int]] = []
+
+    def triple(self, subj, pred, obj):
+        self.triples.append((self._term_id(subj), self._term_id(pred), self._term_id(obj)))
+
+    def _term_id(self, term) -> int:
+        if isinstance(term, Literal):
+            key = (LITERAL, str(term), str(term.datatype or ''), term.language or '')
+        else:
+            key = (BNODE if isinstance(term, BNode) else URIREF, str(term), '', '')
+        term_id = self.term_ids.get(key)
+        if term_id is None:
+            term_id = self.term_ids[key] = len(self.term_keys)
+            self.term_keys.append(key)
+        return term_id
+
+
+class _LabelBNodes(dict):
+    """
+    Blank node context of the parser, mapping each blank node label to itself.
+    """
+
+    def get(self, label, default=None):
+        return label
+
+
+def _term(key: tuple[int, str, str, str]):
+    kind, text, datatype, language = key
+    if kind == URIREF:
+        return URIRef(text)
+    if kind == BNODE:
+        return BNode(text)
+    return Literal(text, lang=language or None, datatype=URIRef(datatype) if datatype else None)
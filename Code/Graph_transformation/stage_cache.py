@@ -0,0 +1,161 @@
+# On-disk, content-addressed cache of the results of the transformation stages (see full_transformation.py).
+# The key of a stage result is a hash of the key of its input (ultimately, of the content of the source file) and of
+# the stage parameters: an unchanged input, processed with unchanged parameters, is never processed twice.
+# Entries are plain files, named after their key. The total size of the cache is capped; when it is exceeded, the
+# least recently used entries are evicted (the modification time of an entry is updated each time it is used).
+# The sizes and times of the entries are read from the folder once, then kept up to date by the cache; entries stored
+# meanwhile by other processes are only taken into account by the caches created after them.
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+from rdflib import Graph
+
+from Graph_transformation.graph_file_handing import new_graph
+from Graph_transformation.graph_store import StoreConfig
+from Graph_transformation.graph_snapshot import save_snapshot, load_snapshot, SNAPSHOT_SUFFIX
+
+# To be changed whenever a transformation step is modified in a way that changes its output,
+# so that results cached by the previous version are not reused.
+CACHE_VERSION = "2"
+CACHE_FOLDER_NAME = "stage_cache"
+DEFAULT_MAX_SIZE_MB = 1024
+GRAPH_SUFFIX = SNAPSHOT_SUFFIX  # binary snapshots (see graph_snapshot): much faster to write and read than Turtle
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class StageCache:
+
+    def __init__(self, folder: str, max_size_mb: float = DEFAULT_MAX_SIZE_MB):
+        """
+        :param folder: cache directory, created when the first entry is stored
+        :param max_size_mb: total size of the entries, above which the least recently used ones are evicted
+        """
+        self.folder = folder
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._entries: Optional[dict[str, tuple[float, int]]] = None  # path -> (time of last use, size)
+        self._total_size = 0
+
+    @staticmethod
+    def file_key(file_path: str, **parameters) -> str:
+        """
+        Key of a source file: hash of its content and of the parameters it is read with.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            while block := file.read(HASH_BLOCK_SIZE):
+                digest.update(block)
+        return StageCache.stage_key(digest.hexdigest(), "source", **parameters)
+
+    @staticmethod
+    def stage_key(input_key: str, stage: str, **parameters) -> str:
+        """
+        Key of the result of a stage.
+        :param input_key: key of the stage input
+        :param stage: name of the stage
+        :param parameters: stage parameters; their values are taken into account as strings
+        """
+        items = [CACHE_VERSION, input_key, stage] + [f"{name}={parameters[name]}" for name in sorted(parameters)]
+        return hashlib.sha256("\n".join(items).encode('utf-8')).hexdigest()
+
+    def entry_path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.folder, key + suffix)
+
+    def get(self, key: str, suffix: str) -> Optional[str]:
+        """
+        :return: the path to the cached file, or None if not cached
+        """
+        path = self.entry_path(key, suffix)
+        try:
+            os.utime(path)  # marks the entry as recently used
+        except FileNotFoundError:
+            return None
+        if self._entries is not None and path in self._entries:
+            self._entries[path] = (time.time(), self._entries[path][1])
+        return path
+
+    def put_file(self, key: str, suffix: str, source_path: str) -> str:
+        """
+        Stores a copy of a file.
+        :return: the path to the cached file
+        """
+        return self._store(key, suffix, lambda temp_path: shutil.copyfile(source_path, temp_path))
+
+    def put_graph(self, key: str, graph: Graph) -> str:
+        """
+        Stores a graph, as a binary snapshot.
+        :return: the path to the cached file
+        """
+        return self._store(key, GRAPH_SUFFIX, lambda temp_path: save_snapshot(graph, temp_path))
+
+    def load_graph(self, key: str, store: Optional[StoreConfig] = None) -> Optional[Graph]:
+        """
+        :param store: configuration of the store holding the graph (see graph_store); by default, in memory
+        :return: the cached graph, or None if not cached
+        """
+        path = self.get(key, GRAPH_SUFFIX)
+        if path is None:
+            return None
+        return load_snapshot(path, new_graph(store))
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        Removes the least recently used entries until the size cap is respected.
+        :param keep: path to an entry that is not to be removed, even if the cap cannot be respected otherwise
+        :return: number of entries removed
+        """
+        entries = self._index()
+        if self._total_size <= self.max_size:
+            return 0
+        removed = 0
+        for _, path in sorted((used, path) for path, (used, _) in entries.items()):
+            if self._total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # evicted meanwhile by another process
+                pass
+            self._total_size -= entries.pop(path)[1]
+            removed += 1
+        return removed
+
+    def _index(self) -> dict[str, tuple[float, int]]:
+        """
+        :return: time of last use and size of each entry, by path; the folder is only scanned the first time
+        """
+        if self._entries is None:
+            self._entries = {}
+            if os.path.isdir(self.folder):
+                for entry in os.scandir(self.folder):
+                    if entry.is_file() and not entry.name.startswith('.'):
+                        stat = entry.stat()
+                        self._entries[entry.path] = (stat.st_mtime, stat.st_size)
+            self._total_size = sum(size for _, size in self._entries.values())
+        return self._entries
+
+    def _store(self, key: str, suffix: str, write) -> str:
+        """
+        Writes an entry through a temporary file, so that a partially written entry is never visible.
+        :param write: function writing the entry content to the path it is given
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.entry_path(key, suffix)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.folder, prefix='.', suffix=suffix)
+        os.close(file_descriptor)
+        try:
+            write(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        entries = self._index()
+        size = os.path.getsize(path)
+        self._total_size += size - entries.get(path, (0, 0))[1]
+        entries[path] = (time.time(), size)
+        self.evict(keep=path)
+        return path
@@ -1,15 +1,14 @@
 """
 Purpose is to split linear elements (linestrings) where they have an intermediate point that is also present
 in any other linestring.
-The procedure is simplistic, and not optimized for efficiency:
-probably O(Nˆ2), N being the number of coord pairs in linestrings.
-Consider using spatial indexing in an improved version.
+The split is planned by means of an inverted index (coordinate -> occurrences in linestrings), built in a single
+pass over all vertices; linestrings are then cut by index slicing. Cost is linear in the total number of vertices.
 
 Checked for correctness, 9/4/2024: output seems OK as the splits indeed have a common point at some extremity.
 Not thoroughly checked for exhaustiveness, but looks OK too.
 """
 
-from typing import List
+from typing import Optional
 
 import rdflib
 import shapely
@@ -19,38 +18,72 @@ from shapely.geometry import LineString
 from shapely.wkt import dumps
 
 from Code.Namespaces import *
-from Graph_transformation.graph_file_handing import load_graph
+from Graph_transformation.graph_file_handing import load_graph, save_graph
+from Graph_transformation.graph_store import StoreConfig
+from Graph_transformation.instrumentation import ProgressCallback, report_progress
+from Graph_transformation.topology_view import TopologyView
 
+SPLIT_STAGE = "split"  # as reported to progress callbacks
 
-def split_linestrings_in_file(file_path: str, short_name_: str = "", with_kml: bool = False):
+
+def split_linestrings_in_file(file_path: str, short_name_: str = "", with_kml: bool = False,
+                              store: Optional[StoreConfig] = None):
     """
     Splits linestrings where they share a common point (except at extremities).
     :param file_path: input file path
     :param short_name_: will be used for naming the output ttl file
     :param with_kml: if True, a kml representation of the ttl file will be generated.
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory
     :return: None
     """
     print("splitting the Turtle file: ", file_path)
-    linestring_dict = parse_turtle_for_linear_element_geometry(file_path)
-    label_dict = parse_turtle_for_labels(file_path)
-    shared_coords = find_shared_intermediate_points(linestring_dict)
-    modified_linestrings = split_linestrings(linestring_dict, shared_coords)
+    graph = load_graph(file_path, store)
+    split_linestrings_in_graph(graph)
     import os
     output_file_path = os.path.dirname(file_path) + f"/{short_name_}_split.ttl"
-    generate_turtle_from_linestrings(file_path, modified_linestrings[0], modified_linestrings[1],
-                                     output_file_path, label_dict)
+    save_graph(graph, output_file_path, streaming=True)
     if with_kml:
         ttl_to_kml(file_path + f"{short_name_}_split.ttl", file_path + f"{short_name_}_split.kml")
 
 
+def split_linestrings_in_graph(graph: rdflib.Graph, topology: TopologyView = None,
+                               progress: Optional[ProgressCallback] = None) -> rdflib.Graph:
+    """
+    Splits linestrings where they share a common point (except at extremities).
+    The graph is modified in place, and returned for convenience.
+    :param graph: graph with linear elements and their geometries
+    :param topology: view of the graph, if already available; it is refreshed after the split
+    :param progress: called back with SPLIT_STAGE and the fraction done (see instrumentation)
+    :return: the same graph, with split linear elements
+    """
+    topology = topology or TopologyView(graph)
+    linestring_dict = {geometry: shape for geometry in topology.geometries
+                       if (shape := topology.shape_of(geometry)) is not None}
+    label_dict = graph_labels(graph)
+    report_progress(progress, SPLIT_STAGE, 0.2)
+    split_plan = plan_splits(linestring_dict)
+    report_progress(progress, SPLIT_STAGE, 0.4)
+    modified_linestrings = split_linestrings(linestring_dict, split_plan)
+    report_progress(progress, SPLIT_STAGE, 0.6)
+    apply_split_linestrings(graph, modified_linestrings[0], modified_linestrings[1], label_dict, topology)
+    topology.refresh()
+    report_progress(progress, SPLIT_STAGE, 1.0)
+    return graph
+
+
 def parse_turtle_for_linear_element_geometry(file_path: str) -> dict[URIRef, LineString]:
     """
     retrieves WKT strings from file
     :returns dictionary with key = URL, value = WKT string
     """
-    g = rdflib.Graph()
-    g.parse(file_path, format="turtle")
+    return graph_linear_element_geometries(load_graph(file_path))
+
 
+def graph_linear_element_geometries(g: rdflib.Graph) -> dict[URIRef, LineString]:
+    """
+    retrieves WKT strings from graph
+    :returns dictionary with key = URL, value = shapely geometry
+    """
     linestring_dict = {}
     for s, _, o in g.triples((None, RDF.type, RSM_GEOSPARQL_ADAPTER.Geometry)):
         wkt = g.value(s, GEOSPARQL.asWKT)
@@ -61,83 +94,68 @@ def parse_turtle_for_linear_element_geometry(file_path: str) -> dict[URIRef, Lin
 
 
 def parse_turtle_for_labels(file_path: str) -> dict[URIRef, Literal]:
-    g = rdflib.Graph()
-    g.parse(file_path, format="turtle")
+    return graph_labels(load_graph(file_path))
+
+
+def graph_labels(g: rdflib.Graph) -> dict[URIRef, Literal]:
     label_dict = {}
     for s, _, o in g.triples((None, RDFS.label, None)):
         label_dict[s] = o
     return label_dict
 
 
-# checked 1/5/2024
-def find_shared_intermediate_points(elements: dict[URIRef, LineString]) -> dict[str, list[URIRef | str]]:
+def plan_splits(elements: dict[URIRef, LineString]) -> dict[URIRef, list[int]]:
     """
     Identify intermediate points in the linestrings ("ls") that are shared between two or more line strings.
-    The returned dictionary maps points to a list of URIRefs of Linear Elements that share the same point.
-    When the shared point is at an extremity of another element, URIRef is replaced by 'extremity'
-    (since we will not split an element at its extremity...)
+    A single pass over all vertices builds an inverted index: coordinate -> occurrences (URIRef, vertex index).
+    A coordinate is a split point for every element having it at some intermediate place, provided that the
+    coordinate occurs at least twice overall (at the extremity of another element, or elsewhere).
+    (we will not split an element at its extremity...)
+    :param elements: linestrings dictionary
+    :return: split plan: key = URIRef of the element to be split, value = sorted indices of the vertices to split at
     """
-    shared: dict[str, List[URIRef | str]] = {}  # where the first "str" is the POINT WKT coordinate tuple
-
-    # First, scan through all elements and put all coords into the dictionary:
+    occurrences: dict[tuple, list[tuple[URIRef, int | None]]] = {}  # vertex index is None at extremities
 
     for uri, ls in elements.items():
-        max_index = len(list(ls.coords)) - 1
-        for count, coord in enumerate(ls.coords):
-            if coord not in shared:
-                shared[coord] = []
-            if 0 < count < max_index:
-                # append URI of element that has the coord at some intermediate place
-                shared[coord].append(uri)
-            else:
-                shared[coord].append('extremity')
-
-    # Drop those coords that only occur once (and that's a lot)
+        coords = ls.coords
+        max_index = len(coords) - 1
+        for index, coord in enumerate(coords):
+            occurrences.setdefault(coord, []).append((uri, index if 0 < index < max_index else None))
 
-    shared = {coord: uris for coord, uris in shared.items() if len(uris) > 1}
+    split_plan: dict[URIRef, list[int]] = {}
+    for coord_occurrences in occurrences.values():
+        if len(coord_occurrences) < 2:  # coords that only occur once (and that's a lot)
+            continue
+        for uri, index in coord_occurrences:
+            if index is not None:
+                split_plan.setdefault(uri, []).append(index)
 
-    # Then drop the points that correspond to two or more elements joint at their extremities only
-    shared = {coord: uris for coord, uris in shared.items() if set(uris) != {'extremity'}}
+    for indices in split_plan.values():
+        indices.sort()
+    return split_plan
 
-    # Finally, remove the 'extremity' placeholders
-    shared = {coord: [uri for uri in uris if uri != 'extremity'] for coord, uris in shared.items()}
 
-    return shared
-
-
-def split_linestrings(linestrings: dict[URIRef, LineString], shared_coords: dict[str, list[URIRef]],
+def split_linestrings(linestrings: dict[URIRef, LineString], split_plan: dict[URIRef, list[int]],
                       verbose: bool = False) -> (dict[URIRef, LineString], set[URIRef]):
     """
     Split elements at intermediate points in linestrings when these points are shared between two or more elements.
     :param linestrings: original linestrings dictionary
-    :param shared_coords: dict of coordinates shared between two or more linear elements,
-    where the coordinate does not correspond to an extremity in at least one case.
+    :param split_plan: for each element to be split, the sorted indices of the vertices to split at
+    (see plan_splits).
     :param verbose: if True, each split linestring will be reported.
     :return: (modified (split) linestrings dictionary, set of linestrings to be suppressed)
     """
     linestrings_to_remove = set()
     linestrings_to_add = {}
 
-    for uri, ls in linestrings.items():
-        ls_coords = list(ls.coords)
-        ls_split_at = []
-        for coord, uri_list in shared_coords.items():
-            if uri in uri_list:
-                ls_split_at.append(coord)
-        if ls_split_at:  # test for non-empty list
-            part_index: int = 0
-            tail = ls_coords
-            for coord in ls_coords:
-                if coord in ls_split_at:
-                    head = tail[:tail.index(coord) + 1]
-                    new_tail = tail[tail.index(coord):]
-                    linestrings_to_add[URIRef(f"{uri}_part_{part_index}")] = LineString(head)
-                    part_index += 1
-                    tail = new_tail
-            linestrings_to_add[URIRef(f"{uri}_part_{part_index}")] = LineString(tail)
-            linestrings_to_remove.add(URIRef(uri))
-            if verbose:
-                print(f"linestring {uri} was split into {part_index + 1} parts")
+    for uri, split_indices in split_plan.items():
+        ls_coords = list(linestrings[uri].coords)
+        bounds = [0, *split_indices, len(ls_coords) - 1]
+        for part_index, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            linestrings_to_add[URIRef(f"{uri}_part_{part_index}")] = LineString(ls_coords[start:end + 1])
+        linestrings_to_remove.add(URIRef(uri))
+        if verbose:
+            print(f"linestring {uri} was split into {len(bounds) - 1} parts")
 
     # Lastly, remove all split linestrings
     print("Splitting linestrings, to avoid any branches from inside a Linear Element")
@@ -162,6 +180,26 @@ def generate_turtle_from_linestrings(file_path: str, linestrings_to_add: dict[UR
 
     # Load the RDF graph
     graph = load_graph(file_path)
+    apply_split_linestrings(graph, linestrings_to_add, linestrings_to_remove, label_dict)
+
+    # Serialize the graph to the Turtle file (or snapshot, see graph_file_handing)
+    save_graph(graph, output_file_path, streaming=True)
+
+
+def apply_split_linestrings(graph: rdflib.Graph, linestrings_to_add: dict[URIRef, LineString],
+                            linestrings_to_remove: set[URIRef], label_dict: dict = None,
+                            topology: TopologyView = None) -> None:
+    """
+    Modifies the linear elements of the graph (in place) according to the split linestrings.
+    :param graph: graph with linear elements and their geometries
+    :param linestrings_to_add:
+    :param linestrings_to_remove:
+    :param label_dict: dictionary of labels; key = linear element URI ref, value = Literal
+    :param topology: view of the graph before the split; NOT refreshed here
+    :return: None
+    """
+    label_dict = label_dict or {}
+    topology = topology or TopologyView(graph)
 
     # Bind the namespaces
     graph.bind("geo", GEOSPARQL)
@@ -199,7 +237,7 @@ def generate_turtle_from_linestrings(file_path: str, linestrings_to_add: dict[UR
 
     count_lines = 0
     for linestring in linestrings_to_remove:
-        for matching_line in graph.subjects(RSM_GEOSPARQL_ADAPTER.hasNominalGeometry, linestring):
+        if matching_line := topology.element_of_geometry(linestring):
             lines_to_remove.add(matching_line)
             count_lines += 1
     print(f"    Number of linear elements removed (matching the geometries to be removed): {count_lines}")
@@ -217,10 +255,6 @@ def generate_turtle_from_linestrings(file_path: str, linestrings_to_add: dict[UR
         graph.remove((geo_uri, None, None))
         graph.remove((None, None, geo_uri))
 
-    # Serialize the graph to the Turtle file
-    graph.serialize(destination=output_file_path, format='turtle')
-    print(f"Generated Turtle file: {output_file_path}")
-
 
 if __name__ == "__main__":
     from Code.Export.export_ttl_to_kml import ttl_to_kml
@@ -1,17 +1,22 @@
-import copy
 from collections import Counter
 from typing import Dict, List, Optional
 
+import shapely
 import shapely.errors
 from rdflib import Graph, URIRef, Literal
 from rdflib.namespace import RDF, RDFS
-from shapely.geometry import Point
+from shapely.geometry import Point, LineString
 from shapely.ops import linemerge
-from shapely.wkt import loads, dumps
+from shapely.wkt import dumps
 
 from Code.Namespaces import *
-from Code.Varia.calculate_linestring_length import linestring_length
-from Code.Graph_transformation.step01_split_linear_elements import parse_turtle_for_labels
+from Code.Graph_transformation.geometry_metrics import flatten_linestrings, linestring_lengths
+from Graph_transformation.graph_store import StoreConfig
+from Graph_transformation.instrumentation import warn, ProgressCallback, ProgressReporter, report_progress
+from Graph_transformation.topology_view import TopologyView
+from Code.Graph_transformation.step01_split_linear_elements import graph_labels
+
+JOIN_STAGE = "joint"  # as reported to progress callbacks
 
 
 def add_node(nodes: Dict[str, List[URIRef]], point_wkt: str, line: URIRef) -> None:
@@ -21,18 +26,18 @@ def add_node(nodes: Dict[str, List[URIRef]], point_wkt: str, line: URIRef) -> No
         nodes[point_wkt] = [line]
 
 
-def find_nodes(g: Graph) -> Dict[str, List[URIRef]]:
+def find_nodes(g: Graph, topology: TopologyView = None) -> Dict[str, List[URIRef]]:
     """
     Creates a dictionary:
     key = WKT POINT at extremities of linear elements (called "nodes" in the present context)
     values = URIs of those linear elements, based on the provided RDF graph.
     """
+    topology = topology or TopologyView(g)
     nodes: dict[str, List[URIRef]] = {}
-    for line in g.subjects(RDF.type, RSM_TOPOLOGY.LinearElement):
-        for geom in g.objects(line, RSM_GEOSPARQL_ADAPTER.hasNominalGeometry):
-            s_wkt = loads(str(next(g.objects(geom, GEOSPARQL.asWKT))))  # Shapely geometry object
+    for line in topology.linear_elements:
+        if (s_wkt := topology.shape_of(line)) is not None:  # Shapely geometry object
             if isinstance(s_wkt, Point):
-                print('WARNING: a point was found in the topology.ttl graph, where only linestrings are expected.')
+                warn('WARNING: a point was found in the topology.ttl graph, where only linestrings are expected.')
                 continue
             start_point_wkt = dumps(Point(s_wkt.coords[0]))
             end_point_wkt = dumps(Point(s_wkt.coords[-1]))
@@ -75,47 +80,89 @@ def join_uri_refs(*urirefs: URIRef, join_symbol: str = '-') -> (URIRef, URIRef):
 
 
 def merge_labels(linear_elements: List[URIRef], label_dict: dict, separator: str = '_') -> str:
-    assert len(linear_elements) == 2, "ERROR: there are more than 2 track segments to be merged"
-    first_label, second_label = label_dict.get(linear_elements[0], ''), label_dict.get(linear_elements[1], '')
-    if first_label == second_label:
-        combined_label = first_label
-    elif first_label == '' or second_label == '':
-        combined_label = first_label + second_label
-    else:
-        combined_label = first_label + separator + second_label
+    """
+    Labels of consecutive elements are concatenated, except if they are identical.
+    Note: by default, labels are empty strings
+    """
+    combined_label = str(label_dict.get(linear_elements[0], ''))
+    for linear_element in linear_elements[1:]:
+        next_label = str(label_dict.get(linear_element, ''))
+        if combined_label == next_label:
+            continue
+        elif combined_label == '' or next_label == '':
+            combined_label = combined_label + next_label
+        else:
+            combined_label = combined_label + separator + next_label
     return combined_label
 
 
-def perform_joining(g: Graph, nodes_degree_2: Dict[str, List[URIRef]], labels: dict) -> Graph:
+def find_chains(nodes_degree_2: Dict[str, List[URIRef]]) -> List[List[URIRef]]:
     """
-    Performs joining on linear elements that meet at nodes with degree 2 and updates references.
+    Finds the maximal chains of linear elements that are consecutive through nodes of degree 2.
+    Each degree 2 node links two elements, and each element has at most two such nodes (its extremities):
+    chains are therefore either open paths or rings, and can be walked element by element.
+    :return: list of chains, each chain being the list of its elements in walking order
     """
-    # Prepare a set for elements to be removed and a dict for updating node references
+    neighbours: dict[URIRef, list[tuple[str, URIRef]]] = {}  # element -> [(node, element on the other side)]
+    for node_wkt, (element_x, element_y) in nodes_degree_2.items():
+        neighbours.setdefault(element_x, []).append((node_wkt, element_y))
+        neighbours.setdefault(element_y, []).append((node_wkt, element_x))
+
+    chains: list[list[URIRef]] = []
+    visited: set[URIRef] = set()
+    # walk from the ends of open chains first; elements not visited afterwards belong to rings
+    chain_ends = [element for element, element_neighbours in neighbours.items() if len(element_neighbours) == 1]
+    for start in chain_ends + list(neighbours):
+        if start in visited:
+            continue
+        chain, previous_node, current = [start], None, start
+        visited.add(start)
+        while step := next(((node, other) for node, other in neighbours[current]
+                            if node != previous_node and other not in visited), None):
+            previous_node, current = step
+            chain.append(current)
+            visited.add(current)
+        chains.append(chain)
+    return chains
+
+
+def perform_joining(g: Graph, nodes_degree_2: Dict[str, List[URIRef]], labels: dict,
+                    topology: TopologyView = None, progress: Optional[ProgressCallback] = None) -> Graph:
+    """
+    Performs joining on linear elements that meet at nodes with degree 2.
+    Each maximal chain of such elements is merged at once into a single geometry and a single linear element.
+    The topology view, if provided, is refreshed after the joining.
+    :param progress: called back with JOIN_STAGE and the fraction done, as nodes are joined (see instrumentation)
+    """
+    topology = topology or TopologyView(g)
     lines_to_remove: set[URIRef] = set()
     geometries_to_remove: set[URIRef] = set()
-    unprocessed_nodes = copy.deepcopy(nodes_degree_2)
-    processed_nodes_counter, parse_error_count = 0, 0
-
-    for node_wkt, linear_elements in nodes_degree_2.items():
-        x_geom = g.value(linear_elements[0], RSM_GEOSPARQL_ADAPTER.hasNominalGeometry)
-        y_geom = g.value(linear_elements[1], RSM_GEOSPARQL_ADAPTER.hasNominalGeometry)
+    joint_chains_counter, parse_error_count = 0, 0
+    reporter = ProgressReporter(progress, JOIN_STAGE, len(nodes_degree_2), start=0.1, end=0.8)
+    joined_nodes = 0
+
+    for chain in find_chains(nodes_degree_2):
+        joined_nodes += len(chain) - 1
+        reporter.update(joined_nodes)
+        if len(chain) < 2:
+            continue
+        geometries = [topology.geometry_of(linear_element) for linear_element in chain]
         try:
-            x_wkt = loads(str(g.value(x_geom, GEOSPARQL.asWKT)))
-            y_wkt = loads(str(g.value(y_geom, GEOSPARQL.asWKT)))
+            linestrings = [topology.shape_of(geometry) for geometry in geometries]
         except shapely.errors.GEOSException:
-            print(f'WARNING: could not parse geometries surrounding {node_wkt} for WKT data; GEOSException error.')
+            warn(f'WARNING: could not parse geometries of the chain starting with {chain[0]} for WKT data; '
+                 f'GEOSException error.')
             parse_error_count += 1
             continue
 
         # Join the geometries
         # Here, directed should be set to False (the default argument), otherwise multi-linestrings
         # will result when linestrings start of finish with a common point.
-        z_wkt = linemerge([x_wkt, y_wkt], directed=False)
-        del unprocessed_nodes[node_wkt]
+        z_wkt = linemerge(linestrings, directed=False)
 
-        if z_wkt.is_valid:
-            processed_nodes_counter += 1
-            geom_uri_z, line_uri_z = join_uri_refs(x_geom, y_geom)
+        if z_wkt.is_valid and isinstance(z_wkt, LineString):
+            joint_chains_counter += 1
+            geom_uri_z, line_uri_z = join_uri_refs(*geometries)
             # Add the new joint element Z to the graph
             g.add((geom_uri_z, RDF.type, RSM_GEOSPARQL_ADAPTER.Geometry))
             g.add((geom_uri_z, GEOSPARQL.asWKT, Literal(dumps(z_wkt), datatype=GEOSPARQL.wktLiteral)))
@@ -125,29 +172,20 @@ def perform_joining(g: Graph, nodes_degree_2: Dict[str, List[URIRef]], labels: d
             g.add((line_uri_z, RSM_GEOSPARQL_ADAPTER.hasNominalGeometry, geom_uri_z))
 
             # Add the label, obtained by concatenating labels except if they are identical
-            # note: by default, labels are empty strings
-            label_z = merge_labels(linear_elements, labels)
+            label_z = merge_labels(chain, labels)
             g.add((line_uri_z, RDFS.label, Literal(label_z)))
             # update the labels dict
             labels[line_uri_z] = label_z
 
             # Mark linear elements and geometries for removal
-            lines_to_remove.update(linear_elements)
-            geometries_to_remove.update((x_geom, y_geom))
-
-            # Updates references made to X or Y by nodes not yet processed
-            # Note: we are looping through the nodes_degree_2 dict;
-            # here, the values in the nodes_degree_2 dict are altered, but not the keys, which is legal.
-            for joint_element in linear_elements:
-                for n_wkt in unprocessed_nodes:
-                    if joint_element in nodes_degree_2[n_wkt]:
-                        nodes_degree_2[n_wkt].append(line_uri_z)
-                        nodes_degree_2[n_wkt].remove(joint_element)
+            lines_to_remove.update(chain)
+            geometries_to_remove.update(geometries)
         else:
-            print(f"WARNING: strange things happening at {node_wkt}: joining was not successful.")
+            warn(f"WARNING: strange things happening along the chain starting with {chain[0]}: "
+                 f"joining was not successful.")
 
     if parse_error_count > 0:
-        print(f"WARNING: parsing errors around {parse_error_count} nodes")
+        warn(f"WARNING: parsing errors around {parse_error_count} chains")
 
     # Remove the marked original elements from the graph
     for line in lines_to_remove:
@@ -156,28 +194,51 @@ def perform_joining(g: Graph, nodes_degree_2: Dict[str, List[URIRef]], labels: d
         g.remove((geom, None, None))
         g.remove((None, None, geom))
 
-    # Update nodes_degree_2
-    for n_wkt, new_elements in unprocessed_nodes.items():
-        nodes_degree_2[n_wkt] = new_elements
+    topology.refresh()
+    reporter.finish()
 
-    print(f"{processed_nodes_counter} nodes of degree 2 were removed by joining the surrounding linestrings")
-    linear_elements, lengths = compute_nominal_metric_lengths(g)
+    processed_nodes_counter = sum(1 for elements in nodes_degree_2.values() if elements[0] in lines_to_remove)
+    print(f"{processed_nodes_counter} nodes of degree 2 were removed by joining the surrounding linestrings, "
+          f"resulting in {joint_chains_counter} linear elements")
+    linear_elements, lengths = compute_nominal_metric_lengths(g, topology)
     print(f"{lengths} nominal lengths of {linear_elements} linear elements were computed")
+    report_progress(progress, JOIN_STAGE, 1.0)
 
     return g
 
 
-def join_linear_elements(input_ttl: str, output_ttl: Optional[str] = None) -> None:
+def join_linear_elements(input_ttl: str, output_ttl: Optional[str] = None,
+                         store: Optional[StoreConfig] = None) -> None:
     """
     Joins linear elements based on nodes with degree 2. Updates an RDF graph accordingly and
     optionally saves the updated graph to a Turtle file.
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory
     """
     # Create the RDF graph by parsing the input TTL file
-    from Graph_transformation.graph_file_handing import load_graph
-    g = load_graph(input_ttl)
+    from Graph_transformation.graph_file_handing import load_graph, save_graph
+    g = load_graph(input_ttl, store)
+
+    g_joint = join_linear_elements_in_graph(g)
+
+    if g_joint and output_ttl:
+        print(f"RDF graph with joint elements will be saved to: {output_ttl}")
+        save_graph(g_joint, output_ttl, streaming=True)
+    elif output_ttl:
+        print("No joining performed. Original graph will be saved.")
+        save_graph(g, output_ttl, streaming=True)
+
+
+def join_linear_elements_in_graph(g: Graph, topology: TopologyView = None,
+                                  progress: Optional[ProgressCallback] = None) -> Graph:
+    """
+    Joins linear elements based on nodes with degree 2. The graph is modified in place, and returned.
+    The topology view, if provided, is refreshed after the joining.
+    :param progress: called back with JOIN_STAGE and the fraction done (see instrumentation)
+    """
+    topology = topology or TopologyView(g)
 
     # Invoke create_nodes with the RDF graph to generate the mapping of nodes to linear elements
-    nodes = find_nodes(g)
+    nodes = find_nodes(g, topology)
 
     # Report the number of nodes per degree
     report_degrees(nodes)
@@ -186,33 +247,26 @@ def join_linear_elements(input_ttl: str, output_ttl: Optional[str] = None) -> No
     nodes_degree_2 = {k: v for k, v in nodes.items() if len(v) == 2}
 
     # create the label dictionary
-    labels_dict = parse_turtle_for_labels(input_ttl)
+    labels_dict = graph_labels(g)
 
     # Perform the joining
 
     print(
         f'Performing the joining on {len(nodes_degree_2)} nodes of degree 2 (= joining consecutive linear elements):')
-    g_joint = perform_joining(g, nodes_degree_2, labels_dict)
-
-    if g_joint and output_ttl:
-        print(f"RDF graph with joint elements will be saved to: {output_ttl}")
-        g_joint.serialize(destination=output_ttl, format='turtle')
-    elif output_ttl:
-        print("No joining performed. Original graph will be saved.")
-        g.serialize(destination=output_ttl, format='turtle')
+    return perform_joining(g, nodes_degree_2, labels_dict, topology, progress)
 
 
-def compute_nominal_metric_lengths(g: Graph) -> [int, int]:
-    """Uses the linestrings to determine the nominal length of each linear element, in meter
+def compute_nominal_metric_lengths(g: Graph, topology: TopologyView = None) -> [int, int]:
+    """Uses the linestrings to determine the nominal length of each linear element, in meter.
+    All lengths are computed at once (see geometry_metrics).
     """
-    count_line, count_length = 0, 0
-    for line in g.subjects(RDF.type, RSM_TOPOLOGY.LinearElement):
-        count_line += 1
-        for geom in g.objects(line, RSM_GEOSPARQL_ADAPTER.hasNominalGeometry):
-            length = linestring_length(next(g.objects(geom, GEOSPARQL.asWKT)))
-            g.add((line, RSM_GEOSPARQL_ADAPTER.hasNominalMetricLength, Literal(length)))
-            count_length += 1
-    return count_line, count_length
+    topology = topology or TopologyView(g)
+    lines = [line for line in topology.linear_elements if topology.wkt_of(line) is not None]
+    wkts = [topology.wkt_of(line) for line in lines]
+    lengths = linestring_lengths(*flatten_linestrings(shapely.from_wkt(wkts)))
+    for line, length in zip(lines, lengths):
+        g.add((line, RSM_GEOSPARQL_ADAPTER.hasNominalMetricLength, Literal(float(length))))
+    return len(topology.linear_elements), len(lines)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,14 @@
 from typing import Optional
-from pyproj import Geod
 from rdflib import Graph, URIRef, Literal
 from rdflib.namespace import RDF, RDFS
 from shapely.geometry import Point
-from shapely.wkt import loads
 from Code.Namespaces import *
+from Code.Graph_transformation.geometry_metrics import flatten_linestrings, end_azimuths
+from Graph_transformation.graph_store import StoreConfig
+from Graph_transformation.instrumentation import warn, ProgressCallback, ProgressReporter
+from Graph_transformation.topology_view import TopologyView
 
-wgs84_geod = Geod(ellps='WGS84')
-
+PORTS_STAGE = "with_ports"  # as reported to progress callbacks
 PORT_SUFFIX_0 = '_port_0'
 PORT_SUFFIX_1 = '_port_1'
 
@@ -25,37 +26,64 @@ def create_port(graph: Graph, linear_element: URIRef, extremity: Point, azimuth:
 
 
 def add_ports_to_linear_elements(input_ttl: str, output_ttl: Optional[str] = None,
-                                 with_inverse_properties: bool = True) -> None:
+                                 with_inverse_properties: bool = True,
+                                 store: Optional[StoreConfig] = None) -> None:
+    """
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory
+    """
     from Graph_transformation.graph_file_handing import load_graph, save_graph
-    graph = load_graph(input_ttl)
-    linear_element_count = len(list(graph.subjects(RDF.type, RSM_TOPOLOGY.LinearElement)))
+    graph = load_graph(input_ttl, store)
+    add_ports_in_graph(graph, with_inverse_properties)
+    save_graph(graph, output_ttl, streaming=True)
+
+
+def add_ports_in_graph(graph: Graph, with_inverse_properties: bool = True, topology: TopologyView = None,
+                       progress: Optional[ProgressCallback] = None) -> Graph:
+    """
+    Creates ports at the extremities of all linear elements (those with fewer than two vertices are skipped, with a
+    warning). The graph is modified in place, and returned.
+    The new ports are registered in the topology view, if provided.
+    :param progress: called back with PORTS_STAGE and the fraction of linear elements processed (see instrumentation)
+    """
+    topology = topology or TopologyView(graph)
+    linear_elements, linestrings = [], []
+    for linear_element in topology.linear_elements:
+        linestring = topology.shape_of(linear_element)
+        if len(linestring.coords) < 2:  # e.g. a point: it has no extremities to put ports at
+            warn(f"WARNING: linear element {linear_element} has fewer than two vertices; it is given no ports.")
+            continue
+        linear_elements.append(linear_element)
+        linestrings.append(linestring)
+    linear_element_count = len(linear_elements)
     print(f"\nCreating ports at the extremities of {linear_element_count} linear elements:")
     counter = 0
 
-    for linear_element in graph.subjects(RDF.type, RSM_TOPOLOGY.LinearElement):
-        geometry = graph.value(linear_element, RSM_GEOSPARQL_ADAPTER.hasNominalGeometry)
-        wkt = loads(str(graph.value(geometry, GEOSPARQL.asWKT)))
-        extremity0, extremity1 = Point(wkt.coords[0]), Point(wkt.coords[-1])
-        neighbor0, neighbor1 = Point(wkt.coords[1]), Point(wkt.coords[-2])
+    # azimuths of all linear elements are computed at once
+    azimuths0, azimuths1 = end_azimuths(*flatten_linestrings(linestrings))
+    reporter = ProgressReporter(progress, PORTS_STAGE, linear_element_count, start=0.1)
 
-        azimuth0 = wgs84_geod.inv(neighbor0.x, neighbor0.y, extremity0.x, extremity0.y)[0]
-        azimuth1 = wgs84_geod.inv(neighbor1.x, neighbor1.y, extremity1.x, extremity1.y)[0]
+    for linear_element, wkt, azimuth0, azimuth1 in zip(linear_elements, linestrings, azimuths0.tolist(),
+                                                       azimuths1.tolist()):
+        extremity0, extremity1 = Point(wkt.coords[0]), Point(wkt.coords[-1])
 
         port_uri0 = create_port(graph, linear_element, extremity0, azimuth0, PORT_SUFFIX_0, '')
         port_uri1 = create_port(graph, linear_element, extremity1, azimuth1, PORT_SUFFIX_1, '')
 
-        if comment := graph.value(linear_element, RDFS.comment):
+        if comment := topology.comment_of(linear_element):
             graph.add((port_uri0, RDFS.comment, comment))
             graph.add((port_uri1, RDFS.comment, comment))
+        topology.register_port(linear_element, port_uri0, str(extremity0), azimuth0, comment)
+        topology.register_port(linear_element, port_uri1, str(extremity1), azimuth1, comment)
 
         if with_inverse_properties:
             graph.add((port_uri0, RSM_TOPOLOGY.onElement, linear_element))
             graph.add((port_uri1, RSM_TOPOLOGY.onElement, linear_element))
 
         counter += 1
+        reporter.update(counter)
 
+    reporter.finish()
     print(f"    {counter} pairs of ports were created.")
     if linear_element_count != counter:
-        print("    WARNING: there seems to be a mismatch above.")
-
-    save_graph(graph, output_ttl)
+        warn("    WARNING: there seems to be a mismatch above.")
+    return graph
@@ -1,17 +1,28 @@
+import math
 from typing import Optional
 
-from rdflib import Graph
+import numpy as np
+
+from rdflib import Graph, URIRef
 from rdflib.namespace import RDF
 from rdflib.term import Node
 
 from Code.Namespaces import *
-from Graph_transformation.geometry_stuff import deviation_angle, possible_navigability, \
-    NAVIGABILITY_ANGULAR_THRESHOLD
+from Graph_transformation.geometry_stuff import deviation_angles, NAVIGABILITY_ANGULAR_THRESHOLD, transformer, \
+    wkt_point_to_lon_lat
 from Graph_transformation.graph_file_handing import load_graph, save_graph
+from Graph_transformation.graph_store import StoreConfig
+from Graph_transformation.instrumentation import warn, ProgressCallback, ProgressReporter, report_progress
+from Graph_transformation.step03_add_ports import PORT_SUFFIX_0, PORT_SUFFIX_1
+from Graph_transformation.topology_view import TopologyView
 
 DIRECT_CONNECTION_WARNING_THRESHOLD = 1
 DOUBLE_SLIP_CROSSINGS_THRESHOLD = 3
 NON_NAVIGABLE_AZIMUTH = 180
+PORT_CONNECTION_TOLERANCE = 0.005  # meters. Ports closer than this are deemed coincident (absorbs float noise).
+NEIGHBOURING_CELLS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+CONNECTIONS_STAGE = "with_connected_ports"  # as reported to progress callbacks
+NAVIGABILITIES_STAGE = "with_navigabilities"
 
 
 def get_ports(graph: Graph) -> list[Node]:
@@ -27,77 +38,161 @@ def _print_ports_count(ports):
     print(f"    {display_count} port{plural} found")
 
 
-def connect_matching_ports(graph: Graph, ports):
+def connect_matching_ports(graph: Graph, ports, tolerance: float = PORT_CONNECTION_TOLERANCE,
+                           topology: TopologyView = None,
+                           progress: Optional[ProgressCallback] = None) -> tuple[int, int]:
     """
-    Connects ports, basing one geometric coincidence.
+    Connects ports, basing on geometric coincidence within the given tolerance.
+    Port coordinates are projected (EPSG:3034) and hashed into square cells, the side of which equals the tolerance;
+    a port may only coincide with ports lying in the same cell or in the 8 neighbouring cells. With a tolerance of 0,
+    the cells are the projected coordinates themselves (exact match).
     :param graph:
     :param ports:
-    :return: number of connections made
+    :param tolerance: max distance between coincident ports, in meters (0 or more)
+    :param topology: view of the graph; the connections are registered in it
+    :param progress: called back with CONNECTIONS_STAGE and the fraction of ports processed (see instrumentation)
+    :return: number of connections made, and number of those made only thanks to the tolerance
+    (i.e. between ports whose WKT literals differ)
     """
-    connections_count = 0
-    for index, port1 in enumerate(ports[:-2]):
-        coordinates1 = graph.value(port1, GEOSPARQL.asWKT)
-        for port2 in ports[index + 1:]:
-            coordinates2 = graph.value(port2, GEOSPARQL.asWKT)
-            if coordinates1 == coordinates2:
-                graph.add((port1, RSM_TOPOLOGY.connectedWith, port2))
-                connections_count += 1
-    return connections_count
-
-
-def set_port_connections(input_ttl: str, output_ttl: Optional[str] = None):
+    if tolerance < 0:
+        raise ValueError(f"The tolerance for port connections must not be negative: {tolerance}")
+    topology = topology or TopologyView(graph)
+    located_ports = [(port, wkt) for port in ports if (wkt := topology.wkt_of(port)) is not None]
+    if not located_ports:
+        return 0, 0
+    lon_lat = [wkt_point_to_lon_lat(wkt) for _, wkt in located_ports]
+    eastings, northings = transformer.transform([lon for lon, _ in lon_lat], [lat for _, lat in lon_lat])
+
+    exact = tolerance == 0
+    neighbouring_cells = [(0, 0)] if exact else NEIGHBOURING_CELLS
+    grid: dict[tuple, list[int]] = {}
+    for index, (easting, northing) in enumerate(zip(eastings, northings)):
+        cell = (easting, northing) if exact else (math.floor(easting / tolerance), math.floor(northing / tolerance))
+        grid.setdefault(cell, []).append(index)
+
+    connections_count, tolerance_count = 0, 0
+    reporter = ProgressReporter(progress, CONNECTIONS_STAGE, len(located_ports), start=0.2)
+    processed_ports = 0
+    for (cell_x, cell_y), indices in grid.items():
+        processed_ports += len(indices)
+        reporter.update(processed_ports)
+        for index1 in indices:
+            port1, coordinates1 = located_ports[index1]
+            for dx, dy in neighbouring_cells:
+                for index2 in grid.get((cell_x + dx, cell_y + dy), ()):
+                    if index2 <= index1:  # each pair is considered once, in the order of the ports list
+                        continue
+                    distance = math.hypot(eastings[index1] - eastings[index2], northings[index1] - northings[index2])
+                    if distance > tolerance:
+                        continue
+                    port2, coordinates2 = located_ports[index2]
+                    topology.add_connection(port1, port2)
+                    connections_count += 1
+                    if coordinates1 != coordinates2:
+                        tolerance_count += 1
+    return connections_count, tolerance_count
+
+
+def set_port_connections(input_ttl: str, output_ttl: Optional[str] = None,
+                         tolerance: float = PORT_CONNECTION_TOLERANCE, store: Optional[StoreConfig] = None):
     """
     Yields a new file, with connectedWith properties added.
     :param input_ttl: original RDF file describing the network
     :param output_ttl: new file, with connection properties added
+    :param tolerance: max distance between coincident ports, in meters
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory
     :return: None
     """
-    graph = load_graph(input_ttl)
+    graph = load_graph(input_ttl, store)
+    set_port_connections_in_graph(graph, tolerance)
+
+    # Output
+    save_graph(graph, output_ttl=output_ttl, streaming=True)
+
 
+def set_port_connections_in_graph(graph: Graph, tolerance: float = PORT_CONNECTION_TOLERANCE,
+                                  topology: TopologyView = None, progress: Optional[ProgressCallback] = None) -> Graph:
+    """
+    Adds connectedWith properties between coinciding ports. The graph is modified in place, and returned.
+    :param graph:
+    :param tolerance: max distance between coincident ports, in meters
+    :param topology: view of the graph, if already available; the connections are registered in it
+    :param progress: called back with CONNECTIONS_STAGE and the fraction done (see instrumentation)
+    """
     print("Setting the connections between ports")
+    topology = topology or TopologyView(graph)
 
     # Get all the ports in the graph
-    ports = get_ports(graph)
+    ports = topology.ports
+    _print_ports_count(ports)
 
     # Iterate over each port
-    connections_count = connect_matching_ports(graph, ports)
+    connections_count, tolerance_count = connect_matching_ports(graph, ports, tolerance, topology, progress)
+    report_progress(progress, CONNECTIONS_STAGE, 1.0)
     print(f"    {connections_count} ports connected")
-
-    # Output
-    save_graph(graph, output_ttl=output_ttl)
+    if tolerance_count:
+        print(f"    of which {tolerance_count} only within the tolerance of {tolerance} m")
+    return graph
 
 
-def get_opposite_port(graph: Graph, port: Node) -> Node | None:
+def set_port_connections_by_node_in_graph(graph: Graph, element_end_nodes: dict[Node, tuple],
+                                          topology: TopologyView = None,
+                                          progress: Optional[ProgressCallback] = None) -> Graph:
     """
-    Looks for the opposite port 0n a linear element.
-    If the given port is not a linear element, returns None (and issues a warning).
+    Adds connectedWith properties between the ports lying at a same node of the source data, when the source data
+    identify the nodes (e.g. native OSM data, see Import/OSM_import/osm_native_import.py): no geometric matching is
+    needed. The graph is modified in place, and returned.
+    :param element_end_nodes: key = linear element, value = (node of its port 0, node of its port 1)
+    :param topology: view of the graph, if already available; the connections are registered in it
+    :param progress: called back with CONNECTIONS_STAGE and the fraction done (see instrumentation)
+    """
+    print("Setting the connections between ports, from the nodes they lie at")
+    topology = topology or TopologyView(graph)
+    node_ports: dict[object, list[Node]] = {}
+    for element, (node0, node1) in element_end_nodes.items():
+        node_ports.setdefault(node0, []).append(URIRef(str(element) + PORT_SUFFIX_0))
+        node_ports.setdefault(node1, []).append(URIRef(str(element) + PORT_SUFFIX_1))
 
-    :param graph the RDF graph
-    :param port a port node in the graph that is supposed to belong to a single linear element
-    :returns the opposite port, or None if the element is not a Linear Element
+    connections_count = 0
+    reporter = ProgressReporter(progress, CONNECTIONS_STAGE, len(node_ports))
+    for count, ports in enumerate(node_ports.values()):
+        reporter.update(count)
+        for index, port1 in enumerate(ports):
+            for port2 in ports[index + 1:]:
+                topology.add_connection(port1, port2)
+                connections_count += 1
+    reporter.finish()
+    print(f"    {connections_count} ports connected")
+    return graph
+
+
+def set_navigabilities(input_ttl: str, output_ttl: Optional[str] = None, double_slip_crossings: bool = False,
+                       store: Optional[StoreConfig] = None):
     """
-    elements = list(graph.objects(port, RSM_TOPOLOGY.onElement))  # only one element is expected; better check:
-    assert len(elements) == 1, "ERROR: port {} belongs to more than one element, namely {} ".format(port,
-                                                                                                    elements)
-    element = elements[0]
-    if graph.value(element, RDF.type) == RSM_TOPOLOGY.LinearElement:
-        other_ports = [x for x in graph.subjects(RSM_TOPOLOGY.onElement, element) if x != port]
-        return other_ports[0] if other_ports else None
-    else:
-        print(f"**** WARNING: looking for an opposite port on non-linear element {element}")
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory
+    """
+    graph = load_graph(input_ttl, store)
+    set_navigabilities_in_graph(graph, double_slip_crossings)
+    save_graph(graph, output_ttl=output_ttl, streaming=True)
 
 
-def set_navigabilities(input_ttl: str, output_ttl: Optional[str] = None, double_slip_crossings: bool = False):
-    graph = load_graph(input_ttl)
+def set_navigabilities_in_graph(graph: Graph, double_slip_crossings: bool = False,
+                                topology: TopologyView = None, progress: Optional[ProgressCallback] = None) -> Graph:
+    """
+    Adds navigableTo / nonNavigableTo properties between ports. The graph is modified in place, and returned.
+    :param progress: called back with NAVIGABILITIES_STAGE and the fraction done (see instrumentation)
+    """
     print("Setting the navigabilities between ports.")
     print_crossing_information(double_slip_crossings)
 
-    ports = list(graph.subjects(RDF.type, RSM_TOPOLOGY.Port))  # Convert generator to list
-    for port in ports:
-        connected_ports, connected_ports_list = get_connected_ports(graph, port)
-        handle_port_navigability(graph, port, connected_ports_list, double_slip_crossings)
-
-    save_graph(graph, output_ttl=output_ttl)
+    port_table = PortTable(topology or TopologyView(graph))
+    report_progress(progress, NAVIGABILITIES_STAGE, 0.4)
+    triples = classify_junctions(port_table, double_slip_crossings)
+    report_progress(progress, NAVIGABILITIES_STAGE, 0.7)
+    graph.addN((subj, predicate, obj, graph) for subj, predicate, obj in triples)
+    report_progress(progress, NAVIGABILITIES_STAGE, 1.0)
+    print(f"    {len(triples)} navigability properties generated")
+    return graph
 
 
 def print_crossing_information(double_slip_crossings: bool):
@@ -108,68 +203,80 @@ def print_crossing_information(double_slip_crossings: bool):
             "All crossings are deemed to be diamond crossings, by default. Additional navigabilities may be added, if such information is provided by the source file.")
 
 
-def get_connected_ports(graph: Graph, port: Node):
-    directly_connected_ports = set(graph.objects(port, RSM_TOPOLOGY.connectedWith))
-    inverse_connected_ports = set(graph.subjects(RSM_TOPOLOGY.connectedWith, port))
-    connected_ports_list = list(directly_connected_ports.union(inverse_connected_ports))
-    return directly_connected_ports, connected_ports_list
-
-
-def handle_port_navigability(graph: Graph, port: Node, connected_ports_list: list, double_slip_crossings: bool):
-    case = len(connected_ports_list)
-    if case == DIRECT_CONNECTION_WARNING_THRESHOLD:
-        print(f"**** WARNING: Port {port} has exactly 1 other port connected; should be 0 or >= 2.")
-    elif case == DOUBLE_SLIP_CROSSINGS_THRESHOLD - 1 or (
-            case == DOUBLE_SLIP_CROSSINGS_THRESHOLD and double_slip_crossings):
-        process_double_slip_crossing(graph, port, connected_ports_list)
-    elif case == DOUBLE_SLIP_CROSSINGS_THRESHOLD and not double_slip_crossings:
-        process_diamond_crossing(graph, port, connected_ports_list)
-    elif case == 0:  # dead-end
-        pass
-    else:
-        print(f"Unexpected case: {case} ports connected to port {port}")
-
-
-def process_double_slip_crossing(graph: Graph, port: Node, connected_ports_list: list):
-    for other_port in connected_ports_list:
-        opposite = get_opposite_port(graph, other_port)
-        if opposite:
-            azimuth1 = float(graph.value(port, RSM_TOPOLOGY.azimuth))
-            azimuth2 = float(graph.value(other_port, RSM_TOPOLOGY.azimuth))
-            if possible_navigability(azimuth1, azimuth2):
-                predicate = RSM_TOPOLOGY.navigableTo
-            else:
-                predicate = RSM_TOPOLOGY.nonNavigableTo
-            graph.add((port, predicate, opposite))
-            other_opposite = get_opposite_port(graph, port)
-            if other_opposite:
-                graph.add((other_port, predicate, other_opposite))
-            else:
-                print(f'**** ERROR: Port {port} has no navigable port on navigable element it belongs to.')
-        else:
-            print(f'**** ERROR: Port {other_port} has no opposite port on linear element it belongs to.')
-
-
-def process_diamond_crossing(graph: Graph, port: Node, connected_ports_list: list):
-    deviation_angles = []
-    for other_port in connected_ports_list:
-        opposite = get_opposite_port(graph, other_port)
-        if opposite:
-            port_azimuth = float(graph.value(port, RSM_TOPOLOGY.azimuth))
-            other_port_azimuth = float(graph.value(other_port, RSM_TOPOLOGY.azimuth))
-            deviation_angles.append(abs(deviation_angle(port_azimuth, other_port_azimuth)))
-        else:
-            deviation_angles.append(NON_NAVIGABLE_AZIMUTH)
-            print(f'**** ERROR: no opposite port to {other_port} on same linear element')
-
-    smallest_deviation_index = deviation_angles.index(min(deviation_angles))
-    smallest_deviation_angle = deviation_angles[smallest_deviation_index]
-    for index, other_port in enumerate(connected_ports_list):
-        opposite = get_opposite_port(graph, other_port)
-        other_opposite = get_opposite_port(graph, port)
-        if index == smallest_deviation_index and smallest_deviation_angle < NAVIGABILITY_ANGULAR_THRESHOLD:
-            predicate = RSM_TOPOLOGY.navigableTo
-        else:
-            predicate = RSM_TOPOLOGY.nonNavigableTo
-        graph.add((port, predicate, opposite))
-        graph.add((other_port, predicate, other_opposite))
+class PortTable:
+    """
+    Ports of a topology view, extracted once into arrays: azimuths, opposite ports, and connections
+    (in both directions). Ports are referred to by their position in the ports list; -1 stands for "no port".
+    """
+
+    def __init__(self, topology: TopologyView):
+        self.ports = list(topology.ports)
+        port_index = {port: index for index, port in enumerate(self.ports)}
+        self.azimuths = np.array([azimuth if (azimuth := topology.azimuth_of(port)) is not None else np.nan
+                                  for port in self.ports])
+
+        # opposite ports, on the same linear element
+        self.opposites = np.full(len(self.ports), -1, dtype=np.int64)
+        for index, port in enumerate(self.ports):
+            element = topology.element_of(port)
+            if element is not None and not topology.is_linear_element(element):
+                warn(f"**** WARNING: looking for an opposite port on non-linear element {element}")
+            elif (opposite := topology.opposite_port(port)) in port_index:
+                self.opposites[index] = port_index[opposite]
+
+        # connectedWith is symmetric, but only stated in one direction
+        connections = sorted((index, port_index[other_port]) for index, port in enumerate(self.ports)
+                             for other_port in topology.connected_ports(port) if other_port in port_index)
+        connections = np.array(connections, dtype=np.int64).reshape(-1, 2)
+        self.sources, self.targets = connections[:, 0], connections[:, 1]
+        self.degrees = np.bincount(self.sources, minlength=len(self.ports))
+
+
+def classify_junctions(port_table: PortTable, double_slip_crossings: bool = False) -> list[tuple[Node, Node, Node]]:
+    """
+    Determines the navigabilities at all junctions at once, for each pair (port, other port connected to it):
+    - if 2 other ports are connected (switch), or 3 in the case of double slip crossings, navigability from the port
+    to the opposite of the other port is possible if the deviation angle is small;
+    - if 3 other ports are connected (diamond crossing), only the other port with the smallest deviation angle
+    is navigable, provided the angle is small.
+    In both cases, the same navigability applies from the other port to the opposite of the port.
+    :return: navigableTo and nonNavigableTo triples
+    """
+    ports, degrees, opposites = port_table.ports, port_table.degrees, port_table.opposites
+    sources, targets = port_table.sources, port_table.targets
+
+    for index in np.flatnonzero(degrees == DIRECT_CONNECTION_WARNING_THRESHOLD):
+        warn(f"**** WARNING: Port {ports[index]} has exactly 1 other port connected; should be 0 or >= 2.")
+    for index in np.flatnonzero(degrees > DOUBLE_SLIP_CROSSINGS_THRESHOLD):
+        warn(f"Unexpected case: {degrees[index]} ports connected to port {ports[index]}")
+
+    source_degrees = degrees[sources]
+    double_slip = (source_degrees == DOUBLE_SLIP_CROSSINGS_THRESHOLD - 1) | (
+            (source_degrees == DOUBLE_SLIP_CROSSINGS_THRESHOLD) & double_slip_crossings)
+    diamond = (source_degrees == DOUBLE_SLIP_CROSSINGS_THRESHOLD) & (not double_slip_crossings)
+    source_opposites, target_opposites = opposites[sources], opposites[targets]
+    deviations = np.abs(deviation_angles(port_table.azimuths[sources], port_table.azimuths[targets]))
+
+    navigable = double_slip & (deviations < NAVIGABILITY_ANGULAR_THRESHOLD)
+
+    # diamond crossings: pairs are sorted by port, then by deviation; the first pair of each port is the candidate
+    diamond_deviations = np.where(target_opposites >= 0, deviations, NON_NAVIGABLE_AZIMUTH)
+    candidates = np.flatnonzero(diamond)
+    candidates = candidates[np.lexsort((diamond_deviations[candidates], sources[candidates]))]
+    smallest = candidates[np.r_[True, sources[candidates][1:] != sources[candidates][:-1]]] if len(candidates) else []
+    navigable[smallest] = diamond_deviations[smallest] < NAVIGABILITY_ANGULAR_THRESHOLD
+
+    handled = double_slip | diamond
+    for index in np.unique(np.r_[targets[handled & (target_opposites < 0)], sources[handled & (source_opposites < 0)]]):
+        warn(f'**** ERROR: Port {ports[index]} has no opposite port on linear element it belongs to.')
+
+    predicates = (RSM_TOPOLOGY.nonNavigableTo, RSM_TOPOLOGY.navigableTo)
+    from_source = handled & (target_opposites >= 0)
+    from_target = ((double_slip & (target_opposites >= 0)) | diamond) & (source_opposites >= 0)
+    triples = [(ports[source], predicates[is_navigable], ports[opposite]) for source, is_navigable, opposite in
+               zip(sources[from_source].tolist(), navigable[from_source].tolist(),
+                   target_opposites[from_source].tolist())]
+    triples += [(ports[target], predicates[is_navigable], ports[opposite]) for target, is_navigable, opposite in
+                zip(targets[from_target].tolist(), navigable[from_target].tolist(),
+                    source_opposites[from_target].tolist())]
+    return triples
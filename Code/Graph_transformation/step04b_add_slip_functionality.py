@@ -4,30 +4,57 @@
 # The effect of the module is to
 # 1 - add navigabilities corresponding to the slip switch function;
 # 2 - remove the artificial linear elements used to express this function.
+from typing import Optional
+
 from rdflib import Literal, Graph
 from rdflib.namespace import RDF, RDFS
 
 from Import.drawIO_import.drawio_parameters import SLIP_SWITCH_KEY
-from Namespaces import GEOSPARQL, RSM_TOPOLOGY, RSM_GEOSPARQL_ADAPTER
-from Graph_transformation.graph_file_handing import load_graph, save_graph
-from Graph_transformation.geometry_stuff import find_nearest_linear_elements, wkt_point_to_lon_lat, find_nearest_ports
-from Graph_transformation.step04a_add_port_properties import get_opposite_port
+from Namespaces import RSM_TOPOLOGY, RSM_GEOSPARQL_ADAPTER
+from Graph_transformation.graph_file_handing import load_graph, save_graph, read_graph_file
+from Graph_transformation.graph_store import StoreConfig
+from Graph_transformation.geometry_stuff import find_nearest_linear_elements, find_nearest_ports, SpatialIndex
+from Graph_transformation.instrumentation import ProgressCallback, report_progress
+from Graph_transformation.topology_view import TopologyView
+
+SLIP_STAGE = "with_slip_functionality"  # as reported to progress callbacks
 
 
-def add_slip_functionality(input_ttl, output_ttl) -> str:
+def add_slip_functionality(input_ttl, output_ttl, store: StoreConfig = None) -> str:
     """updates the ttl file by adding switch slip functionality.
     :param output_ttl:
     :param input_ttl:
+    :param store: configuration of the store holding the graph (see graph_store); by default, in memory
     :return: file content as string
     """
-    graph = load_graph(input_ttl)
-    _add_slip_navigabilities(graph)
+    graph = load_graph(input_ttl, store)
+    add_slip_functionality_in_graph(graph)
+    if not output_ttl:
+        content = graph.serialize(format='turtle')
+        print(content)
+        return content
+    save_graph(graph, output_ttl, streaming=True)
+    return read_graph_file(output_ttl)
+
+
+def add_slip_functionality_in_graph(graph: Graph, topology: TopologyView = None,
+                                    progress: Optional[ProgressCallback] = None) -> Graph:
+    """adds switch slip functionality and removes the slip switch artefacts. The graph is modified in place.
+    :param graph:
+    :param topology: view of the graph, if already available; it is refreshed once the artefacts are removed
+    :param progress: called back with SLIP_STAGE and the fraction done (see instrumentation)
+    :return: the same graph
+    """
+    topology = topology or TopologyView(graph)
+    _add_slip_navigabilities(graph, topology)
+    report_progress(progress, SLIP_STAGE, 0.5)
     _remove_artefacts(graph)
-    save_graph(graph, output_ttl)
-    return graph.serialize(format='turtle')
+    topology.refresh()
+    report_progress(progress, SLIP_STAGE, 1.0)
+    return graph
 
 
-def _add_slip_navigabilities(graph: Graph):
+def _add_slip_navigabilities(graph: Graph, topology: TopologyView):
     """
     slip switches are encoded, in the graph, as individuals of type LinearElement annotated with rdfs:comment "slip switch".
     Create a list of these individuals and extract the coordinates of their ports (property asWKT).
@@ -35,6 +62,7 @@ def _add_slip_navigabilities(graph: Graph):
     For each port of each slip switch, find the linear element that is closest, using the function find_nearest_linear_elements(coords, graph, count: int = 2),
     and then the closest port of this linear element.
     :param graph: the RDF graph to be processed, which already includes ports and usual navigabilities.
+    :param topology: view of the graph
     :return: None
     """
 
@@ -43,34 +71,35 @@ def _add_slip_navigabilities(graph: Graph):
     genuine_elements = []
 
     # Find and categorize LinearElements
-    for subj, _, _ in graph.triples((None, RDF.type, RSM_TOPOLOGY.LinearElement)):
-        if (subj, RDFS.comment, Literal(SLIP_SWITCH_KEY)) in graph:
+    for subj in topology.linear_elements:
+        if topology.comment_of(subj) == Literal(SLIP_SWITCH_KEY):
             slip_switches.append(subj)
         else:
             genuine_elements.append(subj)
 
     slip_switch_count = 0
     slip_switch_pairs = []
+    spatial_index = SpatialIndex(topology) if slip_switches else None
 
     # Process each slip switch
     for slip_switch in slip_switches:
         # Extract coordinates of the ports (property asWKT)
-        slip_switch_port_points = [triple[2] for hasPort_triple in
-                                   graph.triples((slip_switch, RSM_TOPOLOGY.hasPort, None))
-                                   for triple in graph.triples((hasPort_triple[2], GEOSPARQL.asWKT, None))]
-        slip_switch_port_coords = list(map(wkt_point_to_lon_lat, map(str, slip_switch_port_points)))
+        slip_switch_port_coords = [coords for port in topology.ports_of(slip_switch)
+                                   if (coords := topology.lon_lat_of(port)) is not None]
 
         # Find the nearest linear elements for each coordinate
         nearest_ports = []
         for slip_switch_port_coord in slip_switch_port_coords:
             # here, the nearest element is the slip switch element itself, so we take the second nearest
-            nearest_element = list(find_nearest_linear_elements(slip_switch_port_coord, graph, count=2).keys())[1]
-            nearest_ports.append(list(find_nearest_ports(slip_switch_port_coord, graph, nearest_element).keys())[0])
+            nearest_element = list(find_nearest_linear_elements(slip_switch_port_coord, graph, count=2,
+                                                                spatial_index=spatial_index).keys())[1]
+            nearest_ports.append(list(find_nearest_ports(slip_switch_port_coord, graph, nearest_element,
+                                                         spatial_index=spatial_index).keys())[0])
 
         # create the 2 navigabilities resulting from the slip switch
         predicate = RSM_TOPOLOGY.navigableTo
-        graph.add((nearest_ports[0], predicate, get_opposite_port(graph, nearest_ports[1])))
-        graph.add((nearest_ports[1], predicate, get_opposite_port(graph, nearest_ports[0])))
+        graph.add((nearest_ports[0], predicate, topology.opposite_port(nearest_ports[1])))
+        graph.add((nearest_ports[1], predicate, topology.opposite_port(nearest_ports[0])))
 
     print(f"Generated {slip_switch_count} slip switches between the following linear element pairs: {slip_switch_pairs}")
 
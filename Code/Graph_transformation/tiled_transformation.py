@@ -0,0 +1,292 @@
+# Tiled, process-parallel variant of transform_geojson_to_rsm (see full_transformation.py), meant for large extracts
+# such as a whole country.
+# The tracks are partitioned into square tiles (in degrees), each track being owned by the tile of the south-west
+# corner of its bounding box. Each tile is processed in a separate process, together with a context: the tracks of
+# the other tiles lying within a margin of the tile's own tracks. The context makes the results exact for the tracks
+# of the tile, and is dropped afterwards. The process runs in two phases:
+# 1 - split, and join of the chains of linear elements lying entirely within a tile. Linear elements that meet a
+#     linear element of another tile at a node of degree 2 ("seam" elements) are then joined across tiles by the main
+#     process, as in step02.
+# 2 - ports, connections, navigabilities and slip functionality. Each tile keeps the properties of its own linear
+#     elements and ports; a connection between ports of different tiles is kept by one of them only. A slip switch
+#     artefact adds navigabilities to the ports of the linear elements it joins, possibly owned by other tiles: the
+#     context of a tile therefore includes the artefacts touching its linear elements, and the linear elements that
+#     these artefacts join.
+# The results are the same as those of a single-process run, except for the naming and the orientation of linear
+# elements joined across seams. The output is written as N-Triples (which is valid Turtle) by concatenating the
+# outputs of the tiles, so that the whole graph is never held by a single process.
+import io
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+import shapely
+from rdflib import Graph, URIRef, Literal
+from rdflib.namespace import RDFS
+from rdflib.term import Node
+from shapely.strtree import STRtree
+
+from Code.Export.export_ttl_to_kml import linestrings_to_kml
+from Code.Namespaces import *
+from Import.drawIO_import.drawio_parameters import SLIP_SWITCH_KEY
+from Graph_transformation.full_transformation import OUTPUT_FOLDER, SLIP_FUNCTIONALITY_SUFFIX, generate_file_path, \
+    generate_kml_path
+from Graph_transformation.graph_file_handing import FILE_SAVE_MSG
+from Graph_transformation.instrumentation import Stage
+from Graph_transformation.step01_split_linear_elements import split_linestrings_in_graph, graph_labels
+from Graph_transformation.step02_join_linear_elements import find_nodes, perform_joining
+from Graph_transformation.step03_add_ports import add_ports_in_graph
+from Graph_transformation.step04a_add_port_properties import set_port_connections_in_graph, \
+    set_navigabilities_in_graph
+from Graph_transformation.step04b_add_slip_functionality import add_slip_functionality_in_graph
+from Graph_transformation.topology_view import TopologyView
+from Graph_transformation.triple_writer import write_ntriples
+
+TILE_SIZE = 0.25  # degrees
+TILE_MARGIN = 1e-4  # degrees (about 10 m). Must exceed the port connection tolerance, and the distance between
+# slip switch artefacts and the linear elements they join.
+SPLIT_PART_MARKER = '_part_'
+
+Tile = tuple[int, int]
+# Linear element records: key = URI of the linear element, value = (triples about the element and its geometry, WKT)
+ElementRecords = dict[URIRef, tuple[list[tuple[Node, Node, Node]], str]]
+
+
+def transform_geojson_to_rsm_tiled(geojson_path, short_name, output_folder=OUTPUT_FOLDER,
+                                   all_double_slip: bool = False, tile_size: float = TILE_SIZE,
+                                   margin: float = TILE_MARGIN, max_workers: Optional[int] = None) -> str:
+    """
+    Same as transform_geojson_to_rsm, with the processing distributed over tiles and processes.
+
+    :param geojson_path: source data (OSM data are preprocessed in memory, see osm_to_graph)
+    :param short_name: will be used in the name of generated files
+    :param output_folder: folder for the ttl file
+    :param all_double_slip: if True, all crossings will default to double slip
+    :param tile_size: side of the tiles, in degrees
+    :param margin: context of the tiles, in degrees
+    :param max_workers: number of processes; by default, the number of processors
+    :return: resulting ttl file (in N-Triples syntax) as string
+    """
+    from Code.Import.OSM_import.osm_geojson_to_ttl import read_osm_railways, add_ontology_header, \
+        initialize_rdf_graph
+
+    print()
+    print("Preparing the tiled transformation of an OSM file (GeoJSON format) into a sRSM file (TTL format)")
+    print(f"Reading the OSM file: {geojson_path}")
+    with Stage("geojson_import") as stage:
+        railways = read_osm_railways(geojson_path)
+        stage.linear_elements = len(railways)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Phase 1: split, and join within tiles
+        with Stage("split_and_join_tiles") as stage:
+            partitions = partition_into_tiles(railways.geometry.values, tile_size, margin)
+            print(f"Splitting and joining linear elements in {len(partitions)} tiles")
+            futures = [executor.submit(split_and_join_tile, railways.iloc[owned], railways.iloc[context])
+                       for owned, context in partitions.values()]
+            records: ElementRecords = {}
+            seam_records: ElementRecords = {}
+            seam_nodes: set[str] = set()
+            other_triples = []
+            for future in futures:
+                tile_records, tile_seam_records, tile_seam_nodes, tile_other_triples = future.result()
+                records.update(tile_records)
+                seam_records.update(tile_seam_records)
+                seam_nodes.update(tile_seam_nodes)
+                other_triples += tile_other_triples
+
+            records.update(join_across_seams(seam_records, seam_nodes))
+            stage.linear_elements = len(records)
+
+        # Phase 2: ports, connections, navigabilities, slip functionality
+        with Stage("port_properties_tiles") as stage:
+            elements = list(records)
+            stage.linear_elements = len(elements)
+            linestrings = shapely.from_wkt([wkt for _, wkt in records.values()])
+            linestrings_to_kml(dict(zip(elements, linestrings)), generate_kml_path(short_name, output_folder))
+            slip_switch_comment = (RDFS.comment, Literal(SLIP_SWITCH_KEY))
+            slip_switches = np.array([position for position, element in enumerate(elements)
+                                      if any((pred, obj) == slip_switch_comment
+                                             for subj, pred, obj in records[element][0] if subj == element)],
+                                     dtype=np.int64)
+            partitions = partition_into_tiles(linestrings, tile_size, margin, slip_switches)
+            owners = {element: tile for tile, (owned, _) in partitions.items() for element in
+                      (elements[index] for index in owned)}
+            print(f"Setting ports and their properties in {len(partitions)} tiles")
+            futures = [executor.submit(add_port_properties_tile, tile,
+                                       {elements[index]: records[elements[index]] for index in owned},
+                                       {elements[index]: (records[elements[index]], owners[elements[index]])
+                                        for index in context},
+                                       all_double_slip)
+                       for tile, (owned, context) in partitions.items()]
+
+            header_graph = initialize_rdf_graph()
+            add_ontology_header(header_graph, short_name)
+            header_graph.addN((subj, pred, obj, header_graph) for subj, pred, obj in other_triples)
+            output_path = generate_file_path(short_name, SLIP_FUNCTIONALITY_SUFFIX, output_folder)
+            # written through a temporary file, so that a failed tile does not leave a truncated output
+            file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or None, prefix='.',
+                                                          suffix='.ttl')
+            os.close(file_descriptor)
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as output_file:
+                    write_ntriples(header_graph, output_file)
+                    for future in futures:
+                        output_file.write(future.result())
+                os.replace(temp_path, output_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+    print(FILE_SAVE_MSG.format(output_path))
+
+    with open(output_path, encoding='utf-8') as output_file:
+        return output_file.read()
+
+
+def partition_into_tiles(geometries, tile_size: float, margin: float,
+                         slip_switches: Optional[np.ndarray] = None) -> dict[Tile, tuple[np.ndarray, np.ndarray]]:
+    """
+    Assigns each geometry to the tile of the south-west corner of its bounding box, and determines the context of
+    each tile: the geometries of other tiles lying within the margin of the tile's own geometries.
+    :param geometries: array of shapely geometries, longitude first
+    :param tile_size: in degrees
+    :param margin: in degrees
+    :param slip_switches: positions of the slip switch artefacts; the context of a tile also includes the geometries
+    lying within the margin of the extremities of the artefacts found in the tile or its context
+    :return: dict, key = tile, value = (positions of the tile's own geometries, positions of its context geometries)
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    bounds = shapely.bounds(geometries)
+    tiles = np.floor(bounds[:, :2] / tile_size).astype(np.int64)
+    tree = STRtree(geometries)
+
+    partitions = {}
+    for tile in np.unique(tiles, axis=0):
+        owned = np.flatnonzero((tiles[:, 0] == tile[0]) & (tiles[:, 1] == tile[1]))
+        _, neighbours = tree.query(geometries[owned], predicate='dwithin', distance=margin)
+        if slip_switches is not None and len(slip_switches):
+            reached = geometries[np.intersect1d(np.union1d(neighbours, owned), slip_switches)]
+            extremities = np.concatenate((shapely.get_point(reached, 0), shapely.get_point(reached, -1)))
+            _, joined = tree.query(extremities, predicate='dwithin', distance=margin)
+            neighbours = np.union1d(neighbours, joined)
+        context = np.setdiff1d(neighbours, owned)
+        partitions[(int(tile[0]), int(tile[1]))] = owned, context
+    return partitions
+
+
+def split_and_join_tile(owned_railways, context_railways) -> tuple[ElementRecords, ElementRecords, set[str], list]:
+    """
+    Phase 1, run in a worker process: builds the raw graph of the tile and its context, splits the linear elements,
+    and joins the chains of linear elements of the tile.
+    :param owned_railways: features of the tile (see read_railways)
+    :param context_railways: features of the context
+    :return: records of the tile's linear elements that do not meet another tile at a node of degree 2,
+    records of those that do (seam elements), the nodes of degree 2 between tiles (as WKT), and the other triples
+    of the tile (e.g. spot locations)
+    """
+    from Code.Import.OSM_import.osm_geojson_to_ttl import add_railways_to_graph
+
+    graph = Graph()
+    add_railways_to_graph(graph, owned_railways)
+    context_graph = Graph()
+    add_railways_to_graph(context_graph, context_railways)
+    context_subjects = set(context_graph.subjects())
+    graph += context_graph
+
+    topology = TopologyView(graph)
+    split_linestrings_in_graph(graph, topology)
+
+    # split parts of a context element belong to the context too
+    context_elements = {element for element in topology.linear_elements
+                        if _split_origin(topology.geometry_of(element)) in context_subjects}
+
+    nodes = find_nodes(graph, topology)
+    inner_nodes = {node: elements for node, elements in nodes.items()
+                   if len(elements) == 2 and not context_elements.intersection(elements)}
+    seam_nodes = {node for node, elements in nodes.items()
+                  if len(elements) == 2 and len(context_elements.intersection(elements)) == 1}
+    perform_joining(graph, inner_nodes, graph_labels(graph), topology)
+
+    seam_elements = {element for node, elements in find_nodes(graph, topology).items() if node in seam_nodes
+                     for element in elements if element not in context_elements}
+    owned_elements = [element for element in topology.linear_elements if element not in context_elements]
+    records = element_records(graph, topology, owned_elements)
+    seam_records = {element: records.pop(element) for element in seam_elements}
+
+    # spot locations, etc.
+    topology_subjects = {subj for element in topology.linear_elements for subj in
+                         (element, topology.geometry_of(element))}
+    other_triples = [(subj, pred, obj) for subj, pred, obj in graph
+                     if subj not in topology_subjects and subj not in context_subjects]
+    return records, seam_records, seam_nodes, other_triples
+
+
+def join_across_seams(seam_records: ElementRecords, seam_nodes: set[str]) -> ElementRecords:
+    """
+    Joins the chains of linear elements that span several tiles.
+    :param seam_records: records of the linear elements meeting another tile at a node of degree 2
+    :param seam_nodes: these nodes, as WKT
+    :return: records of the resulting linear elements
+    """
+    graph = Graph()
+    graph.addN((subj, pred, obj, graph) for triples, _ in seam_records.values() for subj, pred, obj in triples)
+    topology = TopologyView(graph)
+    nodes = {node: elements for node, elements in find_nodes(graph, topology).items()
+             if node in seam_nodes and len(elements) == 2}
+    print(f"Joining linear elements across tiles, at {len(nodes)} nodes")
+    perform_joining(graph, nodes, graph_labels(graph), topology)
+    return element_records(graph, topology, topology.linear_elements)
+
+
+def add_port_properties_tile(tile: Tile, owned_records: ElementRecords,
+                             context_records: dict[URIRef, tuple[tuple[list, str], Tile]],
+                             all_double_slip: bool = False) -> str:
+    """
+    Phase 2, run in a worker process: adds ports, connections, navigabilities and slip functionality.
+    :param tile:
+    :param owned_records: records of the tile's linear elements
+    :param context_records: records of the context linear elements, with the tile they belong to
+    :param all_double_slip: if True, all crossings will default to double slip
+    :return: the triples of the tile, as N-Triples
+    """
+    graph = Graph()
+    for triples, _ in list(owned_records.values()) + [record for record, _ in context_records.values()]:
+        graph.addN((subj, pred, obj, graph) for subj, pred, obj in triples)
+    topology = TopologyView(graph)
+    owners = {element: tile for element in owned_records}
+    owners.update({element: element_tile for element, (_, element_tile) in context_records.items()})
+    owners.update({geometry: owner for element, owner in list(owners.items())
+                   if (geometry := topology.geometry_of(element)) is not None})
+
+    add_ports_in_graph(graph, topology=topology)
+    set_port_connections_in_graph(graph, topology=topology)
+    set_navigabilities_in_graph(graph, double_slip_crossings=all_double_slip, topology=topology)
+    add_slip_functionality_in_graph(graph, topology=topology)
+    owners.update({port: owners[element] for port in topology.ports if (element := topology.element_of(port))})
+
+    def kept(subj, pred, obj) -> bool:
+        if pred == RSM_TOPOLOGY.connectedWith:  # kept by one of the tiles of the ports only
+            return min(owners[subj], owners[obj]) == tile
+        return owners.get(subj) == tile
+
+    output = io.StringIO()
+    write_ntriples((triple for triple in graph if kept(*triple)), output)
+    return output.getvalue()
+
+
+def element_records(graph: Graph, topology: TopologyView, elements) -> ElementRecords:
+    records = {}
+    for element in elements:
+        geometry = topology.geometry_of(element)
+        triples = list(graph.triples((element, None, None))) + list(graph.triples((geometry, None, None)))
+        records[element] = triples, topology.wkt_of(element)
+    return records
+
+
+def _split_origin(geometry: Node) -> Optional[URIRef]:
+    """Geometry a split part results from (see step01), or the geometry itself if not a split part."""
+    if geometry is None:
+        return None
+    return URIRef(str(geometry).rsplit(SPLIT_PART_MARKER, 1)[0])
@@ -0,0 +1,142 @@
+# Dictionary-backed view of the topology held by an RDF graph.
+# The relationships used over and over by the transformation steps (port <-> element <-> opposite port, connections,
+# geometries and their WKT) are read from the graph once, so that accessing them costs O(1) instead of a
+# triple-pattern query.
+# The view does not follow the graph by itself: when the graph is modified, either use the update methods below
+# (which modify the graph and the view alike), or call refresh().
+from typing import Optional
+
+import shapely
+from rdflib import Graph, Literal
+from rdflib.namespace import RDF, RDFS
+from rdflib.term import Node
+
+from Namespaces import RSM_TOPOLOGY, GEOSPARQL, RSM_GEOSPARQL_ADAPTER
+
+
+class TopologyView:
+
+    def __init__(self, graph: Graph):
+        self.graph = graph
+        self.refresh()
+
+    def refresh(self) -> None:
+        """(Re)reads the graph. To be called after the graph was modified other than through the view."""
+        graph = self.graph
+        self.linear_elements: list[Node] = list(graph.subjects(RDF.type, RSM_TOPOLOGY.LinearElement))
+        self._linear_elements = set(self.linear_elements)
+        self.ports: list[Node] = list(graph.subjects(RDF.type, RSM_TOPOLOGY.Port))
+        self.geometries: list[Node] = list(graph.subjects(RDF.type, RSM_GEOSPARQL_ADAPTER.Geometry))
+
+        self._element_ports: dict[Node, list[Node]] = {}
+        self._port_element: dict[Node, Node] = {}
+        for element, port in graph.subject_objects(RSM_TOPOLOGY.hasPort):
+            self._register_port(element, port)
+        for port, element in graph.subject_objects(RSM_TOPOLOGY.onElement):
+            self._register_port(element, port)
+
+        self._element_geometry: dict[Node, Node] = {}
+        self._geometry_element: dict[Node, Node] = {}
+        for element, geometry in graph.subject_objects(RSM_GEOSPARQL_ADAPTER.hasNominalGeometry):
+            self._element_geometry.setdefault(element, geometry)
+            self._geometry_element.setdefault(geometry, element)
+
+        self._wkt: dict[Node, str] = {subj: str(wkt) for subj, wkt in graph.subject_objects(GEOSPARQL.asWKT)}
+        self._shapes: dict[Node, object] = {}  # parsed WKT, filled in lazily
+        self._azimuths: dict[Node, float] = {port: float(azimuth) for port, azimuth in
+                                             graph.subject_objects(RSM_TOPOLOGY.azimuth)}
+        self._labels: dict[Node, Literal] = dict(graph.subject_objects(RDFS.label))
+        self._comments: dict[Node, Literal] = dict(graph.subject_objects(RDFS.comment))
+
+        self._connections: dict[Node, set[Node]] = {}
+        for port1, port2 in graph.subject_objects(RSM_TOPOLOGY.connectedWith):
+            self._register_connection(port1, port2)
+
+    # Accessors
+
+    def is_linear_element(self, element: Node) -> bool:
+        return element in self._linear_elements
+
+    def ports_of(self, element: Node) -> list[Node]:
+        return self._element_ports.get(element, [])
+
+    def element_of(self, port: Node) -> Optional[Node]:
+        return self._port_element.get(port)
+
+    def opposite_port(self, port: Node) -> Optional[Node]:
+        """
+        The other port of the linear element the port belongs to.
+        :returns the opposite port, or None if there is none or if the element is not a Linear Element
+        """
+        element = self._port_element.get(port)
+        if element is None or element not in self._linear_elements:
+            return None
+        other_ports = [other_port for other_port in self._element_ports[element] if other_port != port]
+        return other_ports[0] if other_ports else None
+
+    def connected_ports(self, port: Node) -> set[Node]:
+        """Ports connected to the given one, whatever the direction in which connectedWith was stated."""
+        return self._connections.get(port, set())
+
+    def geometry_of(self, element: Node) -> Optional[Node]:
+        return self._element_geometry.get(element)
+
+    def element_of_geometry(self, geometry: Node) -> Optional[Node]:
+        return self._geometry_element.get(geometry)
+
+    def wkt_of(self, subject: Node) -> Optional[str]:
+        """WKT of a port or of a geometry; for an element, the WKT of its nominal geometry."""
+        if subject in self._element_geometry:
+            subject = self._element_geometry[subject]
+        return self._wkt.get(subject)
+
+    def shape_of(self, subject: Node):
+        """Same as wkt_of, but as a shapely geometry. Parsing is done once, on first access."""
+        if subject in self._element_geometry:
+            subject = self._element_geometry[subject]
+        if subject not in self._shapes:
+            wkt = self._wkt.get(subject)
+            self._shapes[subject] = shapely.from_wkt(wkt) if wkt is not None else None
+        return self._shapes[subject]
+
+    def lon_lat_of(self, port: Node) -> Optional[tuple[float, float]]:
+        point = self.shape_of(port)
+        return (point.x, point.y) if point is not None else None
+
+    def azimuth_of(self, port: Node) -> Optional[float]:
+        return self._azimuths.get(port)
+
+    def label_of(self, subject: Node) -> Optional[Literal]:
+        return self._labels.get(subject)
+
+    def comment_of(self, subject: Node) -> Optional[Literal]:
+        return self._comments.get(subject)
+
+    # Updates: the graph and the view are modified alike
+
+    def add_connection(self, port1: Node, port2: Node) -> None:
+        self.graph.add((port1, RSM_TOPOLOGY.connectedWith, port2))
+        self._register_connection(port1, port2)
+
+    # Registration of items that were already added to the graph
+
+    def register_port(self, element: Node, port: Node, wkt: str, azimuth: float,
+                      comment: Optional[Literal] = None) -> None:
+        self.ports.append(port)
+        self._register_port(element, port)
+        self._wkt[port] = wkt
+        self._azimuths[port] = azimuth
+        if comment is not None:
+            self._comments.setdefault(port, comment)
+
+    # Internals
+
+    def _register_port(self, element: Node, port: Node) -> None:
+        element_ports = self._element_ports.setdefault(element, [])
+        if port not in element_ports:
+            element_ports.append(port)
+        self._port_element.setdefault(port, element)
+
+    def _register_connection(self, port1: Node, port2: Node) -> None:
+        self._connections.setdefault(port1, set()).add(port2)
+        self._connections.setdefault(port2, set()).add(port1)
@@ -0,0 +1,136 @@
+# Streaming output of RDF graphs: triples are written to the output as they are read from the graph, one line each,
+# so that memory use does not depend on the size of the graph (unlike rdflib's Turtle serializer, which sorts the
+# subjects and builds the whole document in memory first).
+# Two formats are available:
+# - N-Triples: full URIs, one triple per line;
+# - flat Turtle: the graph prefixes are declared first and used to shorten URIs; consecutive triples with the same
+#   subject are grouped with ';'. No other pretty-printing.
+# Output files whose name ends with '.gz' are gzip-compressed.
+import gzip
+import re
+from typing import IO, Iterable, Optional
+
+from rdflib import Graph, Literal, URIRef, BNode
+from rdflib.namespace import RDF
+from rdflib.term import Node
+
+NTRIPLES = 'nt'
+FLAT_TURTLE = 'turtle'
+GZIP_SUFFIX = '.gz'
+NTRIPLES_SUFFIXES = ('.nt', '.nt' + GZIP_SUFFIX)
+
+# Conservative subset of the Turtle local names; other URIs are written in full
+_LOCAL_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_-]*')
+
+
+def write_graph(graph: Graph, output_path: str, rdf_format: Optional[str] = None) -> int:
+    """
+    Writes the graph to a file, streaming.
+    :param graph:
+    :param output_path: gzip-compressed if ending with '.gz'
+    :param rdf_format: NTRIPLES or FLAT_TURTLE; by default, deduced from the file name (N-Triples for '.nt' files,
+    flat Turtle otherwise)
+    :return: number of triples written
+    """
+    rdf_format = rdf_format or (NTRIPLES if output_path.endswith(NTRIPLES_SUFFIXES) else FLAT_TURTLE)
+    with open_output(output_path) as stream:
+        if rdf_format == NTRIPLES:
+            return write_ntriples(graph, stream)
+        used = used_namespaces(graph)
+        return write_flat_turtle(graph, stream, ((prefix, namespace) for prefix, namespace in graph.namespaces()
+                                                 if str(namespace) in used))
+
+
+def open_output(output_path: str) -> IO[str]:
+    if output_path.endswith(GZIP_SUFFIX):
+        return gzip.open(output_path, 'wt', encoding='utf-8')
+    return open(output_path, 'w', encoding='utf-8')
+
+
+def write_ntriples(triples: Iterable[tuple[Node, Node, Node]], stream: IO[str]) -> int:
+    """
+    :param triples: a graph, or any iterable of triples
+    :param stream: text stream
+    :return: number of triples written
+    """
+    count = 0
+    for subj, pred, obj in triples:
+        stream.write(f"{ntriples_term(subj)} {ntriples_term(pred)} {ntriples_term(obj)} .\n")
+        count += 1
+    return count
+
+
+def write_flat_turtle(triples: Iterable[tuple[Node, Node, Node]], stream: IO[str],
+                      namespaces: Iterable[tuple[str, URIRef]] = ()) -> int:
+    """
+    :param triples: a graph, or any iterable of triples
+    :param stream: text stream
+    :param namespaces: (prefix, namespace) pairs, e.g. graph.namespaces()
+    :return: number of triples written
+    """
+    prefixes: dict[str, str] = {}
+    for prefix, namespace in namespaces:
+        # a namespace bound to several prefixes is written with the first one
+        if str(namespace).endswith(('#', '/')) and str(namespace) not in prefixes:
+            prefixes[str(namespace)] = prefix
+            stream.write(f"@prefix {prefix}: <{namespace}> .\n")
+    stream.write("\n")
+
+    def term(node: Node) -> str:
+        if isinstance(node, URIRef):
+            uri = str(node)
+            split = max(uri.rfind('#'), uri.rfind('/')) + 1
+            prefix = prefixes.get(uri[:split])
+            if prefix is not None and (split == len(uri) or _LOCAL_NAME.fullmatch(uri, split)):
+                return f"{prefix}:{uri[split:]}"
+        elif isinstance(node, Literal) and node.datatype is not None:
+            return f"{_quote(node)}^^{term(node.datatype)}"
+        return ntriples_term(node)
+
+    count = 0
+    previous_subj = None
+    for subj, pred, obj in triples:
+        predicate = 'a' if pred == RDF.type else term(pred)
+        if subj == previous_subj:
+            stream.write(f" ;\n    {predicate} {term(obj)}")
+        else:
+            if previous_subj is not None:
+                stream.write(" .\n")
+            stream.write(f"{term(subj)} {predicate} {term(obj)}")
+            previous_subj = subj
+        count += 1
+    if previous_subj is not None:
+        stream.write(" .\n")
+    return count
+
+
+def used_namespaces(triples: Iterable[tuple[Node, Node, Node]]) -> set[str]:
+    """
+    Namespaces of the URIs found in the triples (URIs being split after their last '#' or '/'), so that only the
+    prefixes actually used are declared. Requires an extra pass over the triples.
+    """
+    used = set()
+    for triple in triples:
+        for node in triple:
+            if isinstance(node, URIRef):
+                used.add(node[:max(node.rfind('#'), node.rfind('/')) + 1])
+            elif isinstance(node, Literal) and node.datatype is not None:
+                used.add(node.datatype[:max(node.datatype.rfind('#'), node.datatype.rfind('/')) + 1])
+    return used
+
+
+def ntriples_term(node: Node) -> str:
+    if isinstance(node, Literal):
+        if node.language:
+            return f"{_quote(node)}@{node.language}"
+        if node.datatype is not None:
+            return f"{_quote(node)}^^<{node.datatype}>"
+        return _quote(node)
+    if isinstance(node, BNode):
+        return f"_:{node}"
+    return f"<{node}>"
+
+
+def _quote(literal: Literal) -> str:
+    return '"' + (str(literal).replace('\\', '\\\\').replace('"', '\\"')
+                  .replace('\n', '\\n').replace('\r', '\\r')) + '"'
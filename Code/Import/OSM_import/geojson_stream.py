@@ -0,0 +1,151 @@
+# Streaming reader of GeoJSON feature collections, for extracts too large to be loaded at once by gpd.read_file (e.g.
+# an Overpass export of a whole country, whose features mostly carry tags that the import does not use).
+# The file is read by chunks of CHUNK_SIZE bytes, and the features are decoded one by one from the "features" array.
+# Each feature is filtered as soon as it is decoded: features rejected by the filter, or not intersecting the bounding
+# box (if any), are dropped, and so are the properties that are not asked for. The features kept are yielded as
+# GeoDataFrames of at most batch_size features, indexed by the position of the features in the file (as gpd.read_file
+# does), so that memory use depends on the batch size, not on the size of the file.
+# Features intersecting the bounding box are kept whole (as with gpd.read_file(bbox=...)): clipping them would create
+# track ends that do not exist.
+# Other top-level arrays are read alike, e.g. the elements of Overpass JSON files (see osm_native_import.py).
+import codecs
+import json
+from typing import Callable, Iterator, Optional
+
+import geopandas as gpd
+import shapely
+from shapely.geometry import shape
+
+CHUNK_SIZE = 1024 * 1024  # bytes
+BATCH_SIZE = 10000  # features
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+def read_geojson_batches(geojson_file_path: str, properties: list[str], keep: Optional[Callable[[dict], bool]] = None,
+                         bbox: Optional[tuple[float, float, float, float]] = None, batch_size: int = BATCH_SIZE,
+                         on_read: Optional[Callable[[int], None]] = None) -> Iterator[gpd.GeoDataFrame]:
+    """
+    :param geojson_file_path: GeoJSON FeatureCollection
+    :param properties: properties kept, as columns of the batches (None where a feature lacks one)
+    :param keep: called with the properties of each feature; the feature is dropped if it returns False
+    :param bbox: (min x, min y, max x, max y); if given, the features that do not intersect it are dropped
+    :param batch_size: maximal number of features in a batch
+    :param on_read: called with the number of bytes of the file read so far, e.g. to report progress
+    :return: batches of features, in file order, with the columns properties and geometry
+    """
+    area = shapely.box(*bbox) if bbox is not None else None
+    positions, rows, geometries = [], [], []
+
+    def batch() -> gpd.GeoDataFrame:
+        frame = gpd.GeoDataFrame({name: [row.get(name) for row in rows] for name in properties},
+                                 geometry=geometries, index=positions, crs='EPSG:4326')
+        if area is not None:
+            frame = frame[shapely.intersects(frame.geometry.values, area)]
+        return frame
+
+    for position, feature in enumerate(iterate_features(geojson_file_path, on_read)):
+        feature_properties = feature.get('properties') or {}
+        if keep is not None and not keep(feature_properties):
+            continue
+        positions.append(position)
+        rows.append({name: feature_properties.get(name) for name in properties})
+        geometries.append(shape(feature['geometry']) if feature.get('geometry') else None)
+        if len(positions) == batch_size:
+            yield batch()
+            positions, rows, geometries = [], [], []
+    if positions:
+        yield batch()
+
+
+def iterate_features(geojson_file_path: str, on_read: Optional[Callable[[int], None]] = None,
+                     member: str = 'features') -> Iterator[dict]:
+    """
+    :param on_read: see read_geojson_batches
+    :param member: member of the top-level JSON object holding the array to be iterated; by default, the features of
+    a GeoJSON FeatureCollection (e.g. 'elements' for the nodes and ways of an Overpass JSON file)
+    :return: the items of the array, decoded one by one
+    """
+    with open(geojson_file_path, 'rb') as source:
+        reader = _JsonReader(source, on_read)
+        reader.expect('{')
+        while reader.next_char() != '}':
+            key = reader.decode()
+            reader.expect(':')
+            if key != member:
+                reader.decode()  # other members (type, metadata) are small
+            else:
+                reader.expect('[')
+                if reader.next_char() != ']':
+                    while True:
+                        yield reader.decode()
+                        if reader.next_char() == ']':
+                            break
+                        reader.expect(',')
+                reader.expect(']')
+            if reader.next_char() == ',':
+                reader.expect(',')
+
+
+class _JsonReader:
+    """
+    Decodes JSON values one by one from a binary file, holding only the part of the file not decoded yet.
+    """
+
+    def __init__(self, source, on_read: Optional[Callable[[int], None]] = None):
+        self.source = source
+        self.on_read = on_read
+        self.bytes_read = 0
+        self.text = ''
+        self.position = 0
+        self.end_of_file = False
+        self._utf8 = codecs.getincrementaldecoder('utf-8-sig')()
+
+    def next_char(self) -> str:
+        """
+        :return: next character that is not whitespace, not consumed
+        """
+        while True:
+            while self.position < len(self.text) and self.text[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self.text):
+                return self.text[self.position]
+            if not self._read():
+                raise ValueError(f"Unexpected end of GeoJSON file, after {self.bytes_read} bytes")
+
+    def expect(self, char: str):
+        if self.next_char() != char:
+            raise ValueError(f"Invalid GeoJSON file: '{char}' expected, found '{self.text[self.position]}', "
+                             f"about {self.bytes_read} bytes into the file")
+        self.position += 1
+
+    def decode(self):
+        """
+        :return: next JSON value, consumed
+        """
+        self.next_char()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.position)
+                if end < len(self.text) or self.end_of_file:  # a number may go on in the next chunk
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.end_of_file:
+                    raise
+            self._read()
+
+    def _read(self) -> bool:
+        """
+        Appends the next chunk of the file to the text not decoded yet.
+        :return: False at the end of the file
+        """
+        chunk = self.source.read(CHUNK_SIZE)
+        self.end_of_file = not chunk
+        self.bytes_read += len(chunk)
+        self.text = self.text[self.position:] + self._utf8.decode(chunk, final=self.end_of_file)
+        self.position = 0
+        if self.on_read is not None:
+            self.on_read(self.bytes_read)
+        return not self.end_of_file
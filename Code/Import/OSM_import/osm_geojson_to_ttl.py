@@ -4,20 +4,37 @@
 import datetime
 import json
 import os.path
+from typing import Iterator, Optional
 
 import geopandas as gpd
+import numpy as np
+import pandas as pd
 import rdflib
-from rdflib import RDF, Literal, RDFS, OWL, DC
-from shapely.geometry import LineString, Point
+import shapely
+from rdflib import RDF, Literal, RDFS, OWL, DC, URIRef
 
 from Code.Namespaces import *
 from Graph_transformation.full_transformation import OUTPUT_FOLDER
+from Graph_transformation.graph_file_handing import new_graph
+from Graph_transformation.graph_store import StoreConfig
+from Graph_transformation.instrumentation import Stage, ProgressCallback, ProgressReporter, report_progress
+from Import.OSM_import.geojson_stream import read_geojson_batches, BATCH_SIZE
 
 PREPROCESSED = 'preprocessed_for_sRSM_conversion'
+IMPORT_STAGE = "import"  # as reported to progress callbacks
+RAILWAY_BATCH_SIZE = 10000  # features turned into triples at once, between two progress reports
+# TODO: replace by proper URIRefs
+LOCATION_SPOT_LOCATION = URIRef('http://cdm.ovh/rsm/location#SpotLocation')
+LOCATION_LOCATION_ON_NET_ELEMENT = URIRef('http://cdm.ovh/rsm/location#LocationOnNetElement')
+LOCATION_ASSOCIATED_NET_ELEMENT = URIRef('http://cdm.ovh/rsm/location#associatedNetElement')
+LOCATION_BOUND = URIRef('http://cdm.ovh/rsm/location#bound')
+RAILWAY_PROPERTIES = ['railway', 'rsm_class', 'label', 'annotations']  # properties used by railway_triples
 
+BoundingBox = tuple[float, float, float, float]  # min longitude, min latitude, max longitude, max latitude
 
-def initialize_rdf_graph():
-    g = rdflib.Graph()
+
+def initialize_rdf_graph(store: Optional[StoreConfig] = None):
+    g = new_graph(store)
     g.bind("geo", GEOSPARQL)
     g.bind("rsm", RSM_TOPOLOGY)
     g.bind("rdf", RDF)
@@ -33,52 +50,90 @@ def preprocess_osm_geojson(osm_file_path: str, short_name: str = "", base_path:
     then saves the result to a specified directory.
 
     The function reads the provided GeoJSON file into a GeoDataFrame, modifies it to classify 'rail'
-    railway attributes as 'LinearElement', adds metadata about the preprocessing time, and saves it to
-    a new GeoJSON file.
+    railway attributes as 'LinearElement' (see read_osm_geojson), adds metadata about the preprocessing time, and
+    saves it to a new GeoJSON file.
 
     :param osm_file_path: Full file path to the input OSM GeoJSON file
     :param short_name: Optional short name to be included in the output file name for better identification
     :param base_path: Directory path where the processed GeoJSON file will be saved
     :return: The full path to the preprocessed GeoJSON output file
     """
+    return save_preprocessed_geojson(read_osm_geojson(osm_file_path), short_name, base_path)
+
 
-    gdf = gpd.read_file(osm_file_path)
+def read_osm_geojson(osm_file_path: str, bbox: Optional[BoundingBox] = None) -> gpd.GeoDataFrame:
+    """
+    Reads an OSM GeoJSON file, and classifies its features in memory: 'rail' railways are linear elements.
+    The classification being idempotent, files already preprocessed (see preprocess_osm_geojson) are read alike.
+    :param bbox: if given, only the features intersecting it are read
+    :return: all the features of the file, with all their properties
+    """
+    gdf = gpd.read_file(osm_file_path, bbox=bbox)
     gdf.loc[gdf['railway'] == 'rail', 'rsm_class'] = 'LinearElement'
+    return gdf
+
+
+def stream_osm_railways(osm_file_path: str, bbox: Optional[BoundingBox] = None, batch_size: int = BATCH_SIZE,
+                        on_read=None) -> Iterator[gpd.GeoDataFrame]:
+    """
+    Reads the tracks of an OSM GeoJSON file by batches, with the RAILWAY_PROPERTIES only, classified as
+    read_osm_geojson does (see geojson_stream.py): memory use does not depend on the size of the file.
+    :param bbox: if given, only the tracks intersecting it are read
+    :param batch_size: maximal number of tracks in a batch
+    :param on_read: called with the number of bytes read so far
+    :return: batches of tracks, indexed by their position in the file
+    """
+    for railways in read_geojson_batches(osm_file_path, RAILWAY_PROPERTIES,
+                                         lambda properties: properties.get('railway') == 'rail',
+                                         bbox, batch_size, on_read):
+        railways['rsm_class'] = 'LinearElement'
+        yield railways
+
 
-    # add metadata
-    # Convert GeoDataFrame to GeoJSON format
-    geojson_dict = gdf.to_json()
-    geojson_dict = json.loads(geojson_dict)
+def read_osm_railways(osm_file_path: str, bbox: Optional[BoundingBox] = None) -> gpd.GeoDataFrame:
+    """
+    :return: all the tracks of an OSM GeoJSON file, as select_railways(read_osm_geojson(...)) would return them, but
+    with the RAILWAY_PROPERTIES only (see stream_osm_railways)
+    """
+    batches = list(stream_osm_railways(osm_file_path, bbox))
+    if not batches:
+        return gpd.GeoDataFrame(columns=RAILWAY_PROPERTIES, geometry=[], crs='EPSG:4326')
+    return pd.concat(batches)
+
+
+def save_preprocessed_geojson(gdf: gpd.GeoDataFrame, short_name: str = "", base_path: str = OUTPUT_FOLDER) -> str:
+    """
+    Saves features classified by read_osm_geojson as a GeoJSON file, with the PREPROCESSED metadata.
+    :return: The full path to the preprocessed GeoJSON output file
+    """
+    geojson_dict = json.loads(gdf.to_json())
     geojson_dict[PREPROCESSED] = f"{datetime.datetime.now()}"
 
-    # Set output file path
     output_file_path = os.path.join(base_path, f'{short_name}_preprocessed.geojson')
-
-    # Save the modified GeoDataFrame back to a GeoJSON file
+    print(f'Preprocessed GeoJSON file is about to be saved to {base_path}')
     with open(output_file_path, 'w') as f:
         json.dump(geojson_dict, f)
-    print(f'Preprocessed GeoJSON file is about to be saved to {base_path}')
     return output_file_path
 
 
-def process_geometry(row):
-    if isinstance(row.geometry, (LineString, Point)):
-        return row.geometry.wkt
-    return str(row.geometry)
+def geometries_to_wkt(geometries: gpd.GeoSeries) -> list[str]:
+    """
+    :return: WKT of the geometries, computed at once by shapely, in full precision ('nan' for missing geometries, as
+    pandas reports them)
+    """
+    return [wkt if wkt is not None else 'nan' for wkt in shapely.to_wkt(geometries.values, rounding_precision=-1)]
 
 
 def osm_to_ttl(osm_file_path: str, short_name: str = "", base_path: str = OUTPUT_FOLDER,
                linear_element_prefix: str = 'linear_element',
-               geometry_prefix: str = 'geom', with_geometry: bool = True):
+               geometry_prefix: str = 'geom', with_geometry: bool = True, save_preprocessed: bool = False,
+               bbox: Optional[BoundingBox] = None):
     """
     Converts an OpenStreetMap (OSM) file to RDF Turtle (*.ttl) format for RDF representation.
     The RDF file is RAW, i.e. uses only a few concepts from RSM topology and geometry. For instance, it contains
     no connections or navigabilities.
 
-    First, checks whether the input file has a PREPROCESSED key in its GeoJSON metadata.
-    If so, geojson_to_ttl is called with the appropriate parameters.
-    If not, preprocess_osm_geojson is called and the output file is placed into the base_path folder, then
-    geojson_to_ttl is called with this pre-processed file path as geojson_file_path argument.
+    See osm_to_graph for the preprocessing.
 
     :param osm_file_path: Path to the OSM file to be converted
     :param short_name: Optional short name for the output file, defaults to an empty string
@@ -88,43 +143,59 @@ def osm_to_ttl(osm_file_path: str, short_name: str = "", base_path: str = OUTPUT
     :param geometry_prefix: Prefix for geometry elements in the TTL file, defaults to 'geom'
     :param with_geometry: Flag to indicate whether to include geometry information in
                           the TTL file, defaults to True
+    :param save_preprocessed: if True, the preprocessed GeoJSON file is saved as well
+    :param bbox: if given, only the tracks intersecting it are converted
     :return: None
     """
+    graph = osm_to_graph(osm_file_path, short_name, base_path, linear_element_prefix, geometry_prefix, with_geometry,
+                         save_preprocessed=save_preprocessed, bbox=bbox)
+    save_raw_graph(graph, short_name, base_path)
 
-    # Read the OSM file into a GeoDataFrame
-    gdf = gpd.read_file(osm_file_path)
-
-    # Convert GeoDataFrame to GeoJSON format
-    geojson_dict = gdf.to_json()
-    geojson_dict = json.loads(geojson_dict)
-
-    # Check if the input OSM file has a "PREPROCESSED" key in its metadata
-    if PREPROCESSED in geojson_dict:
-        # Call geojson_to_ttl with the input file
-        geojson_to_ttl(
-            geojson_file_path=osm_file_path,
-            short_name=short_name,
-            base_path=base_path,
-            linear_element_prefix=linear_element_prefix,
-            geometry_prefix=geometry_prefix,
-            with_geometry=with_geometry
-        )
-    else:
-        # Preprocess the OSM GeoJSON file and save it to the base directory
-        preprocessed_file_path = preprocess_osm_geojson(
-            osm_file_path=osm_file_path,
-            short_name=short_name,
-            base_path=base_path
-        )
-        # Call geojson_to_ttl with the preprocessed file
-        geojson_to_ttl(
-            geojson_file_path=preprocessed_file_path,
-            short_name=short_name,
-            base_path=base_path,
-            linear_element_prefix=linear_element_prefix,
-            geometry_prefix=geometry_prefix,
-            with_geometry=with_geometry
-        )
+
+def osm_to_graph(osm_file_path: str, short_name: str = "", base_path: str = OUTPUT_FOLDER,
+                 linear_element_prefix: str = 'linear_element',
+                 geometry_prefix: str = 'geom', with_geometry: bool = True,
+                 store: Optional[StoreConfig] = None, progress: Optional[ProgressCallback] = None,
+                 save_preprocessed: bool = False, bbox: Optional[BoundingBox] = None) -> rdflib.Graph:
+    """
+    Converts an OpenStreetMap (OSM) file into a RAW RDF graph, kept in memory.
+
+    The file is read once: its tracks are streamed by batches (see stream_osm_railways), preprocessed (classified)
+    on the fly, whether they were already preprocessed or not, and each batch is turned into triples as soon as read.
+    The preprocessed GeoJSON file (see preprocess_osm_geojson) is only written on demand, as an artefact: all the
+    features of the file are then read at once (see read_osm_geojson).
+
+    :param osm_file_path: Path to the OSM file to be converted
+    :param short_name: Optional short name, used as ontology label and for the preprocessed file name
+    :param base_path: Base directory path for the preprocessed GeoJSON file, defaults to OUTPUT_FOLDER
+    :param linear_element_prefix: Prefix for linear elements, defaults to 'linear_element'
+    :param geometry_prefix: Prefix for geometry elements, defaults to 'geom'
+    :param with_geometry: Flag to indicate whether to include geometry information, defaults to True
+    :param store: configuration of the store holding the graph (see Graph_transformation/graph_store); by default,
+    in memory
+    :param progress: called back with IMPORT_STAGE and the fraction done (see Graph_transformation/instrumentation)
+    :param save_preprocessed: if True, the preprocessed GeoJSON file is saved into base_path
+    :param bbox: if given, only the tracks intersecting it are converted
+    :return: the raw graph
+    """
+
+    report_progress(progress, IMPORT_STAGE, 0.0)
+    if save_preprocessed:
+        with Stage("osm_preprocessing"):
+            features = read_osm_geojson(osm_file_path, bbox)
+            save_preprocessed_geojson(features, short_name, base_path)
+        report_progress(progress, IMPORT_STAGE, 0.3)
+        return railways_to_graph(select_railways(features), short_name, linear_element_prefix, geometry_prefix,
+                                 with_geometry, store, progress)
+
+    with Stage("geojson_import") as stage:
+        graph = stage.graph = initialize_rdf_graph(store)
+        add_ontology_header(graph, short_name)
+        reporter = ProgressReporter(progress, IMPORT_STAGE, os.path.getsize(osm_file_path))
+        for railways in stream_osm_railways(osm_file_path, bbox, on_read=reporter.update):
+            add_railways_to_graph(graph, railways, linear_element_prefix, geometry_prefix, with_geometry)
+        reporter.finish()
+    return graph
 
 
 def geojson_to_ttl(geojson_file_path: str, short_name: str = "", base_path: str = OUTPUT_FOLDER,
@@ -142,62 +213,167 @@ def geojson_to_ttl(geojson_file_path: str, short_name: str = "", base_path: str
     In such case, only the URIs will tell which linear element matches which geometry.
     :return: None (a file is created)
     """
-    from rdflib import URIRef
+    graph = geojson_to_graph(geojson_file_path, short_name, linear_element_prefix, geometry_prefix, with_geometry)
+    save_raw_graph(graph, short_name, base_path)
+
+
+def save_raw_graph(graph: rdflib.Graph, short_name: str = "", base_path: str = OUTPUT_FOLDER):
+    # Serialize the graph to a Turtle file
+
+    print(f'Raw ttl file is about to be saved to {base_path}')
+    output_file_path = os.path.join(base_path, f'{short_name}_raw.ttl')
+    graph.serialize(destination=output_file_path, format='turtle')
 
-    # Initialize RDF graph
-    graph = initialize_rdf_graph()
 
+def geojson_to_graph(geojson_file_path: str, short_name: str = "",
+                     linear_element_prefix: str = 'linear_element', geometry_prefix: str = 'geom',
+                     with_geometry: bool = True, store: Optional[StoreConfig] = None,
+                     progress: Optional[ProgressCallback] = None) -> rdflib.Graph:
+    """
+    Takes the GeoJSON file (OpenStreetMap-style) and turns it into a raw RDF graph.
+    :param geometry_prefix:
+    :param linear_element_prefix: used to build URIRefs
+    :param geojson_file_path:
+    :param short_name: used as ontology label
+    :param with_geometry: see geojson_to_ttl
+    :param store: configuration of the store holding the graph (see Graph_transformation/graph_store); by default,
+    in memory
+    :param progress: called back with IMPORT_STAGE and the fraction done (see Graph_transformation/instrumentation)
+    :return: the raw graph
+    """
+    railways = read_railways(geojson_file_path)
+    report_progress(progress, IMPORT_STAGE, 0.3)
+    return railways_to_graph(railways, short_name, linear_element_prefix, geometry_prefix, with_geometry, store,
+                             progress)
+
+
+def railways_to_graph(railways: gpd.GeoDataFrame, short_name: str = "",
+                      linear_element_prefix: str = 'linear_element', geometry_prefix: str = 'geom',
+                      with_geometry: bool = True, store: Optional[StoreConfig] = None,
+                      progress: Optional[ProgressCallback] = None) -> rdflib.Graph:
+    """
+    Turns features already in memory into a raw RDF graph.
+    :param railways: as returned by read_railways or select_railways
+    :param progress: called back with IMPORT_STAGE and the fraction done, from 0.3 on (the features being read)
+    :return: the raw graph (see geojson_to_graph)
+    """
+    with Stage("geojson_import") as stage:
+        # Initialize RDF graph
+        graph = stage.graph = initialize_rdf_graph(store)
+
+        add_ontology_header(graph, short_name)
+        add_railways_to_graph(graph, railways, linear_element_prefix, geometry_prefix, with_geometry,
+                              ProgressReporter(progress, IMPORT_STAGE, len(railways), start=0.3))
+
+    return graph
+
+
+def read_railways(geojson_file_path: str) -> gpd.GeoDataFrame:
+    """
+    :return: the features of the GeoJSON file that are tracks, indexed by their position in the file
+    """
     # Load OSM data (assumed to be in GeoJSON format) with GeoPandas
-    gdf = gpd.read_file(geojson_file_path)
+    return select_railways(gpd.read_file(geojson_file_path))
 
+
+def select_railways(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    :return: the features that are tracks, keeping their index
+    """
     # Assuming the 'railway' attribute is within the properties field, filter for railway lines
-    railways = gdf[gdf['railway'] == 'rail']  # tagged value 'rail' designates a track
+    return gdf[gdf['railway'] == 'rail']  # tagged value 'rail' designates a track
+
 
+def add_ontology_header(graph: rdflib.Graph, short_name: str = "") -> None:
     # Add ontology name and other annotations
     graph.add((WORK[''], RDF.type, OWL.Ontology))
     graph.add((WORK[''], RDFS.label, Literal(short_name, lang='en')))
     graph.add((WORK[''], DC.creator, Literal("sRSM Flask App")))
 
-    # Process elements
-    for index, row in railways.iterrows():
-        if rsm_class := row.get('rsm_class'):
-            if rsm_class == 'LinearElement':
-                line_uri = WORK[f"{linear_element_prefix}_{index}"]
-                geom_uri = WORK[f"{geometry_prefix}_{index}"]
-                # Convert geometry to WKT
-                wkt = process_geometry(row)
-
-                graph.add((line_uri, RDF.type, RSM_TOPOLOGY.LinearElement))
-
-                if label := row.get('label'):
-                    graph.add((line_uri, RDFS.label, Literal(label)))
-                if with_geometry:
-                    graph.add((line_uri, RSM_GEOSPARQL_ADAPTER.hasNominalGeometry, geom_uri))
-                    graph.add((geom_uri, RDF.type, RSM_GEOSPARQL_ADAPTER.Geometry))
-                    graph.add((geom_uri, GEOSPARQL.asWKT, Literal(wkt, datatype=GEOSPARQL.wktLiteral)))
-                if annotations := row.get('annotations'):
-                    graph.add((line_uri, RDFS.comment, Literal(annotations)))
-                    graph.add((geom_uri, RDFS.comment, Literal(annotations)))
-            elif rsm_class == 'SpotLocation':
-                spot_uri = WORK[f"spot_location_{index}"]
-                geom_uri = WORK[f"spot_{index}"]
-                asso_uri = WORK[f"location_on_net_element_{index}"]
-                wkt = process_geometry(row)
-                # TODO: replace object by proper URIRef
-                graph.add((spot_uri, RDF.type, URIRef('http://cdm.ovh/rsm/location#SpotLocation')))
-                graph.add((geom_uri, RDF.type, RSM_GEOSPARQL_ADAPTER.Geometry))
-                graph.add((geom_uri, GEOSPARQL.asWKT, Literal(wkt, datatype=GEOSPARQL.wktLiteral)))
-                graph.add((spot_uri, RSM_GEOSPARQL_ADAPTER.hasNominalGeometry, geom_uri))
-                graph.add((asso_uri, RDF.type, URIRef('http://cdm.ovh/rsm/location#LocationOnNetElement')))
-                graph.add((spot_uri, URIRef('http://cdm.ovh/rsm/location#associatedNetElement'), asso_uri))
-                graph.add((asso_uri, URIRef('http://cdm.ovh/rsm/location#bound'), Literal(0.123)))
-                graph.add((asso_uri, RSM_TOPOLOGY.onElement, OWL.Nothing))
 
-    # Serialize the graph to a Turtle file
+def add_railways_to_graph(graph: rdflib.Graph, railways: gpd.GeoDataFrame,
+                          linear_element_prefix: str = 'linear_element', geometry_prefix: str = 'geom',
+                          with_geometry: bool = True, reporter: Optional[ProgressReporter] = None) -> None:
+    """
+    Adds the linear elements and spot locations described by the features to the graph, by batches of
+    RAILWAY_BATCH_SIZE features (see railway_triples).
+    URIs are built from the index of the features, which must therefore be unique.
+    :param graph:
+    :param railways: as returned by read_railways, or a subset of it
+    :param linear_element_prefix: used to build URIRefs
+    :param geometry_prefix:
+    :param with_geometry: see geojson_to_ttl
+    :param reporter: reports the number of features processed
+    """
+    for start in range(0, len(railways), RAILWAY_BATCH_SIZE):
+        if reporter:
+            reporter.update(start)
+        triples = railway_triples(railways.iloc[start:start + RAILWAY_BATCH_SIZE], linear_element_prefix,
+                                  geometry_prefix, with_geometry)
+        graph.addN((subj, pred, obj, graph) for subj, pred, obj in triples)
+    if reporter:
+        reporter.finish()
+
+
+def railway_triples(railways: gpd.GeoDataFrame, linear_element_prefix: str = 'linear_element',
+                    geometry_prefix: str = 'geom', with_geometry: bool = True) -> Iterator[tuple]:
+    """
+    Triples describing the features that are linear elements or spot locations (according to their rsm_class),
+    e.g. for add_railways_to_graph or a triple writer. The features of each class are selected by a mask, and their
+    URIs, WKT and labels are computed column by column.
+    :param railways: see add_railways_to_graph
+    :return: the triples, feature by feature
+    """
+    rsm_classes = _column(railways, 'rsm_class')
+    labels = _column(railways, 'label')
+    annotations = _column(railways, 'annotations')
+
+    linear_elements = rsm_classes == 'LinearElement'
+    indexes = railways.index[linear_elements]
+    for line_uri, geom_uri, wkt, label, annotation in zip(_uris(linear_element_prefix, indexes),
+                                                          _uris(geometry_prefix, indexes),
+                                                          geometries_to_wkt(railways.geometry[linear_elements]),
+                                                          labels[linear_elements], annotations[linear_elements]):
+        yield line_uri, RDF.type, RSM_TOPOLOGY.LinearElement
+        if label:
+            yield line_uri, RDFS.label, Literal(label)
+        if with_geometry:
+            yield line_uri, RSM_GEOSPARQL_ADAPTER.hasNominalGeometry, geom_uri
+            yield geom_uri, RDF.type, RSM_GEOSPARQL_ADAPTER.Geometry
+            yield geom_uri, GEOSPARQL.asWKT, Literal(wkt, datatype=GEOSPARQL.wktLiteral)
+        if annotation:
+            yield line_uri, RDFS.comment, Literal(annotation)
+            yield geom_uri, RDFS.comment, Literal(annotation)
+
+    spot_locations = rsm_classes == 'SpotLocation'
+    indexes = railways.index[spot_locations]
+    for spot_uri, geom_uri, asso_uri, wkt in zip(_uris('spot_location', indexes), _uris('spot', indexes),
+                                                 _uris('location_on_net_element', indexes),
+                                                 geometries_to_wkt(railways.geometry[spot_locations])):
+        yield spot_uri, RDF.type, LOCATION_SPOT_LOCATION
+        yield geom_uri, RDF.type, RSM_GEOSPARQL_ADAPTER.Geometry
+        yield geom_uri, GEOSPARQL.asWKT, Literal(wkt, datatype=GEOSPARQL.wktLiteral)
+        yield spot_uri, RSM_GEOSPARQL_ADAPTER.hasNominalGeometry, geom_uri
+        yield asso_uri, RDF.type, LOCATION_LOCATION_ON_NET_ELEMENT
+        yield spot_uri, LOCATION_ASSOCIATED_NET_ELEMENT, asso_uri
+        yield asso_uri, LOCATION_BOUND, Literal(0.123)
+        yield asso_uri, RSM_TOPOLOGY.onElement, OWL.Nothing
+
+
+def _column(railways: gpd.GeoDataFrame, name: str) -> np.ndarray:
+    """
+    :return: values of a property of the features, None if the property is absent from the file
+    """
+    if name in railways.columns:
+        return railways[name].to_numpy(dtype=object)
+    return np.full(len(railways), None, dtype=object)
 
-    print(f'Raw ttl file is about to be saved to {base_path}')
-    output_file_path = os.path.join(base_path, f'{short_name}_raw.ttl')
-    graph.serialize(destination=output_file_path, format='turtle')
+
+def _uris(prefix: str, indexes: pd.Index) -> list[URIRef]:
+    """
+    :return: URIRefs WORK[prefix_index], one per index
+    """
+    return [URIRef(name) for name in f"{WORK}{prefix}_" + indexes.astype(str)]
 
 
 if __name__ == '__main__':
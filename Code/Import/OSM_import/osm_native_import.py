@@ -0,0 +1,278 @@
+# Import of native OpenStreetMap data, as opposed to the GeoJSON exports imported by osm_geojson_to_ttl.py: OSM XML
+# files (.osm), Overpass JSON files (.json), and PBF files (.osm.pbf) if pyosmium is installed.
+# Native data identify the nodes of the ways: two tracks (railway=rail ways) are connected where they share a node.
+# The topology is therefore built from the node identifiers, in one pass over the tracks, instead of being
+# rediscovered from coordinates by steps 01, 02 and 04a (see full_transformation.transform_osm_to_rsm):
+# - a track is split at each of its intermediate nodes that is used more than once (by another track, or by the track
+#   itself), as step01 splits at shared coordinates;
+# - the resulting segments are joined into chains at the nodes where exactly two segment ends meet, as step02 does;
+# - the end nodes of the resulting linear elements are returned with the graph, so that the ports lying at a same node
+#   can be connected (see step04a.set_port_connections_by_node_in_graph).
+# Linear elements are named as by steps 01 and 02, OSM way identifiers being the indexes: linear_element_<way>,
+# split_line_<way>_part_<n>, jointline_<...>.
+# The file is read as a stream, twice: the tracks first, then the coordinates of their nodes only. Nothing else is
+# kept, so that a whole country extract (mostly roads and buildings) can be read.
+import os
+import xml.etree.ElementTree as ElementTree
+from collections import Counter
+from typing import Callable, Optional
+
+import rdflib
+from rdflib import RDF, RDFS, Literal, URIRef
+from shapely.geometry import LineString
+from shapely.wkt import dumps
+
+from Code.Namespaces import *
+from Code.Graph_transformation.step02_join_linear_elements import find_chains, join_uri_refs
+from Code.Import.OSM_import.osm_geojson_to_ttl import initialize_rdf_graph, add_ontology_header, IMPORT_STAGE
+from Graph_transformation.graph_store import StoreConfig
+from Graph_transformation.instrumentation import Stage, ProgressCallback, ProgressReporter, report_progress, warn
+from Import.OSM_import.geojson_stream import iterate_features
+
+OSM_XML_EXTENSION = '.osm'
+OSM_PBF_EXTENSION = '.osm.pbf'
+OVERPASS_JSON_EXTENSION = '.json'
+
+Way = tuple[int, list[int]]  # OSM identifier of a way, and identifiers of its nodes
+Coordinates = dict[int, tuple[float, float]]  # key = node identifier, value = (longitude, latitude)
+Element = tuple[URIRef, URIRef, list[int]]  # linear element, its geometry, and the identifiers of its nodes
+
+
+def osm_native_to_graph(osm_file_path: str, short_name: str = "", store: Optional[StoreConfig] = None,
+                        progress: Optional[ProgressCallback] = None) -> tuple[rdflib.Graph, dict[URIRef, tuple]]:
+    """
+    Converts a native OSM file into a graph of linear elements, already split and joined.
+    :param osm_file_path: .osm, .json (Overpass) or .osm.pbf file
+    :param short_name: used as ontology label
+    :param store: configuration of the store holding the graph (see Graph_transformation/graph_store); by default,
+    in memory
+    :param progress: called back with IMPORT_STAGE and the fraction done (see Graph_transformation/instrumentation)
+    :return: the graph, and the end nodes of its linear elements: key = linear element, value = (identifier of its
+    first node, identifier of its last node)
+    """
+    report_progress(progress, IMPORT_STAGE, 0.0)
+    with Stage("osm_native_import") as stage:
+        reporter = ProgressReporter(progress, IMPORT_STAGE, os.path.getsize(osm_file_path), end=0.7)
+        ways, coordinates = read_osm_tracks(osm_file_path, reporter.update)
+        ways = locate_ways(ways, coordinates)
+        segments = split_ways(ways)
+        elements, joint_elements = join_segments(segments)
+        print(f"{len(ways)} tracks read, split into {len(segments)} segments, resulting in {len(elements)} linear "
+              f"elements")
+        report_progress(progress, IMPORT_STAGE, 0.8)
+
+        graph = stage.graph = initialize_rdf_graph(store)
+        add_ontology_header(graph, short_name)
+        graph.addN((subj, pred, obj, graph) for subj, pred, obj in
+                   element_triples(elements, joint_elements, coordinates))
+        report_progress(progress, IMPORT_STAGE, 1.0)
+    return graph, {line_uri: (nodes[0], nodes[-1]) for line_uri, _, nodes in elements}
+
+
+def read_osm_tracks(osm_file_path: str, on_read: Optional[Callable[[int], None]] = None) \
+        -> tuple[list[Way], Coordinates]:
+    """
+    Reads the tracks (railway=rail ways) of a native OSM file, then the coordinates of their nodes.
+    :param on_read: called with the number of bytes read so far, counting each of the two passes over the file for
+    half of its size (not for PBF files)
+    :return: tracks, in file order, and coordinates of their nodes
+    """
+    if osm_file_path.endswith(OSM_PBF_EXTENSION):
+        return _read_osm_pbf(osm_file_path)
+    if osm_file_path.endswith(OVERPASS_JSON_EXTENSION):
+        return _read_overpass_json(osm_file_path, on_read)
+    return _read_osm_xml(osm_file_path, on_read)
+
+
+def locate_ways(ways: list[Way], coordinates: Coordinates) -> list[Way]:
+    """
+    :return: the ways, without their nodes of unknown coordinates (e.g. out of an extract); ways left with fewer than
+    two nodes are dropped
+    """
+    located_ways = []
+    for way_id, nodes in ways:
+        located_nodes = [node for node in nodes if node in coordinates]
+        if len(located_nodes) < len(nodes):
+            warn(f"WARNING: way {way_id} has {len(nodes) - len(located_nodes)} nodes of unknown coordinates")
+        if len(located_nodes) >= 2:
+            located_ways.append((way_id, located_nodes))
+    return located_ways
+
+
+def split_ways(ways: list[Way]) -> list[Element]:
+    """
+    Splits the ways at their intermediate nodes that are used more than once (by any way, this one included).
+    :return: segments, i.e. the ways that need no split, and the parts of the others
+    """
+    usage = Counter(node for _, nodes in ways for node in nodes)
+    segments = []
+    for way_id, nodes in ways:
+        bounds = [0, *(index for index in range(1, len(nodes) - 1) if usage[nodes[index]] > 1), len(nodes) - 1]
+        if len(bounds) == 2:
+            segments.append((WORK[f"linear_element_{way_id}"], WORK[f"geom_{way_id}"], nodes))
+            continue
+        for part_index, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            segments.append((WORK[f"split_line_{way_id}_part_{part_index}"], WORK[f"geom_{way_id}_part_{part_index}"],
+                             nodes[start:end + 1]))
+    return segments
+
+
+def join_segments(segments: list[Element]) -> tuple[list[Element], set[URIRef]]:
+    """
+    Joins the chains of segments that are consecutive through nodes where exactly two segment ends meet.
+    :return: linear elements (joint ones, and segments that were not joined), and the set of the joint ones
+    """
+    ends: dict[int, list[int]] = {}  # key = node, value = positions of the segments ending there
+    for position, (_, _, nodes) in enumerate(segments):
+        ends.setdefault(nodes[0], []).append(position)
+        if nodes[-1] != nodes[0]:  # a loop ends once at its node
+            ends.setdefault(nodes[-1], []).append(position)
+
+    links = {node: positions for node, positions in ends.items() if len(positions) == 2}
+    elements, joint_elements, joint_positions = [], set(), set()
+    for chain in find_chains(links):
+        if len(chain) < 2:
+            continue
+        chain_links = [_link_node(segments[position][2], {position, next_position}, links)
+                       for position, next_position in zip(chain, chain[1:])]
+        nodes = _chain_nodes([segments[position][2] for position in chain], chain_links)
+        if nodes is None:
+            warn(f"WARNING: strange things happening along the chain starting with {segments[chain[0]][0]}: "
+                 f"joining was not successful.")
+            continue
+        geom_uri, line_uri = join_uri_refs(*(segments[position][1] for position in chain))
+        elements.append((line_uri, geom_uri, nodes))
+        joint_elements.add(line_uri)
+        joint_positions.update(chain)
+    elements += [segment for position, segment in enumerate(segments) if position not in joint_positions]
+    return elements, joint_elements
+
+
+def element_triples(elements: list[Element], joint_elements: set[URIRef], coordinates: Coordinates) -> list[tuple]:
+    """
+    :return: triples of the linear elements and their geometries; joint elements are given an (empty) label, as by
+    step02
+    """
+    triples = []
+    for line_uri, geom_uri, nodes in elements:
+        wkt = dumps(LineString([coordinates[node] for node in nodes]))
+        triples += [(line_uri, RDF.type, RSM_TOPOLOGY.LinearElement),
+                    (line_uri, RSM_GEOSPARQL_ADAPTER.hasNominalGeometry, geom_uri),
+                    (geom_uri, RDF.type, RSM_GEOSPARQL_ADAPTER.Geometry),
+                    (geom_uri, GEOSPARQL.asWKT, Literal(wkt, datatype=GEOSPARQL.wktLiteral))]
+        if line_uri in joint_elements:
+            triples.append((line_uri, RDFS.label, Literal('')))
+    return triples
+
+
+def _link_node(nodes: list[int], positions: set[int], links: dict[int, list[int]]) -> Optional[int]:
+    """
+    :return: the end of a segment (given by its nodes) where it is linked to the segments at the given positions, if
+    any (its last node, preferably)
+    """
+    return next((node for node in (nodes[-1], nodes[0]) if set(links.get(node, ())) == positions), None)
+
+
+def _chain_nodes(chain: list[list[int]], links: list[Optional[int]]) -> Optional[list[int]]:
+    """
+    :param chain: nodes of consecutive segments, in chain order, each segment being oriented either way
+    :param links: node shared by each segment and the next one (the segments of a ring share both their ends)
+    :return: nodes of the whole chain, or None if consecutive segments are not linked
+    """
+    nodes = list(chain[0]) if chain[0][-1] == links[0] else chain[0][::-1]
+    for segment_nodes, link in zip(chain[1:], links):
+        if segment_nodes[0] != link:
+            segment_nodes = segment_nodes[::-1]
+        if nodes[-1] != link or segment_nodes[0] != link:
+            return None
+        nodes += segment_nodes[1:]
+    return nodes
+
+
+def _is_track(tags) -> bool:
+    return tags.get('railway') == 'rail'  # tagged value 'rail' designates a track
+
+
+def _read_osm_xml(osm_file_path: str, on_read: Optional[Callable[[int], None]]) -> tuple[list[Way], Coordinates]:
+    ways = []
+    for element in _iterate_osm_xml(osm_file_path, 'way', _pass_progress(osm_file_path, on_read, 0)):
+        if _is_track({tag.get('k'): tag.get('v') for tag in element.iter('tag')}):
+            ways.append((int(element.get('id')), [int(node.get('ref')) for node in element.iter('nd')]))
+    track_nodes = _track_nodes(ways)
+    coordinates = {}
+    for element in _iterate_osm_xml(osm_file_path, 'node', _pass_progress(osm_file_path, on_read, 1)):
+        node_id = int(element.get('id'))
+        if node_id in track_nodes:
+            coordinates[node_id] = (float(element.get('lon')), float(element.get('lat')))
+    return ways, coordinates
+
+
+def _iterate_osm_xml(osm_file_path: str, tag: str, on_read: Optional[Callable[[int], None]]):
+    """
+    :return: the elements of an OSM XML file with this tag, each of them being dropped once the next one is read
+    """
+    with open(osm_file_path, 'rb') as source:
+        events = ElementTree.iterparse(source, events=('start', 'end'))
+        _, root = next(events)
+        for event, element in events:
+            if event != 'end' or element.tag not in ('node', 'way', 'relation'):
+                continue
+            if element.tag == tag:
+                yield element
+            root.clear()
+            if on_read is not None:
+                on_read(source.tell())
+
+
+def _read_overpass_json(osm_file_path: str, on_read: Optional[Callable[[int], None]]) \
+        -> tuple[list[Way], Coordinates]:
+    ways = [(element['id'], element['nodes'])
+            for element in iterate_features(osm_file_path, _pass_progress(osm_file_path, on_read, 0), member='elements')
+            if element.get('type') == 'way' and _is_track(element.get('tags') or {})]
+    track_nodes = _track_nodes(ways)
+    coordinates = {}
+    for element in iterate_features(osm_file_path, _pass_progress(osm_file_path, on_read, 1), member='elements'):
+        if element.get('type') == 'node' and element['id'] in track_nodes:
+            coordinates[element['id']] = (element['lon'], element['lat'])
+    return ways, coordinates
+
+
+def _read_osm_pbf(osm_file_path: str) -> tuple[list[Way], Coordinates]:
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Reading .osm.pbf files requires pyosmium (pip install osmium)") from None
+    ways, coordinates = [], {}
+
+    # pyosmium only decodes the kinds of objects its handler has a method for: ways, then nodes
+    class TrackHandler(osmium.SimpleHandler):
+
+        def way(self, way):
+            if _is_track(way.tags):
+                ways.append((way.id, [node.ref for node in way.nodes]))
+
+    class NodeHandler(osmium.SimpleHandler):
+
+        def node(self, node):
+            if node.id in track_nodes:
+                coordinates[node.id] = (node.location.lon, node.location.lat)
+
+    TrackHandler().apply_file(osm_file_path)
+    track_nodes = _track_nodes(ways)
+    NodeHandler().apply_file(osm_file_path)
+    return ways, coordinates
+
+
+def _track_nodes(ways: list[Way]) -> set[int]:
+    return {node for _, nodes in ways for node in nodes}
+
+
+def _pass_progress(osm_file_path: str, on_read: Optional[Callable[[int], None]], pass_index: int) \
+        -> Optional[Callable[[int], None]]:
+    """
+    :return: on_read, called with the bytes read by the pass (first or second over the file) counted for half
+    """
+    if on_read is None:
+        return None
+    size = os.path.getsize(osm_file_path)
+    return lambda done: on_read((pass_index * size + done) // 2)
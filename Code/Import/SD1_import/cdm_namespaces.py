@@ -11,7 +11,7 @@ RSM_TOPOLOGY_NAMESPACE = Namespace('http://cdm.ovh/rsm/topology/topology#')
 
 # Other ontologies used by CDM
 
-UNIT_REPRESENTATION = Enum('ucum', 'qudt', 'none')
+UNIT_REPRESENTATION = Enum('UNIT_REPRESENTATION', ['ucum', 'qudt', 'none'])
 QUDT_NAMESPACE = Namespace('http://qudt.org/schema/qudt/')
 UNIT_NAMESPACE = Namespace('https://qudt.org/2.1/vocab/unit/')
 GEOSPARQL_NAMESPACE = Namespace('http://www.opengis.net/ont/geosparql')
@@ -6,6 +6,7 @@ from rdflib import Graph
 
 # from Export.export_ifcAlignment_to_kml import alignment_to_kml
 # from Export.export_wkt_to_kml import wkt_to_kml
+from Graph_transformation.instrumentation import Stage
 from Import.SD1_import.cdm_namespaces import SD1_NAMESPACE, IFC_ADAPTER_NAMESPACE
 from Import.SD1_import.sd1_alignment_import import AlignmentGraph
 from Source_data.data_folders import data_root
@@ -116,23 +117,36 @@ def generate_navigabilities_at_simple_points(infra_dict: dict, topology_graph: T
 #######################################################################################################################
 
 
-def import_sd1_infra_data(infrastructure_path: str, map_path: str):
-    sd1_infra_dict = get_infra_dict_from_xml(infrastructure_path)
-    sd1_map_dict = get_map_dict_from_xml(map_path)
+def import_sd1_infra_data(infrastructure_path: str, map_path: str, sd1_graph: Graph = None) -> Graph:
+    """
+    :param infrastructure_path: SD1 infrastructure file (xml)
+    :param map_path: SD1 map file (xml)
+    :param sd1_graph: graph the data is added to; by default, a new graph with the SD1 bindings
+    :return: the graph
+    """
+    if sd1_graph is None:
+        sd1_graph = Graph()
+        create_bindings(sd1_graph)
+    with Stage("sd1_read"):
+        sd1_infra_dict = get_infra_dict_from_xml(infrastructure_path)
+        sd1_map_dict = get_map_dict_from_xml(map_path)
 
     # RSM import statement; not used
     # sd1_graph.add((URIRef(SD1_NAMESPACE), OWL.imports, URIRef(RSM_TOPOLOGY_NAMESPACE)))
 
     # TODO: grid reference system should be in the signature too. For the time being, we assume EPSG:25833 to be always valid.
 
-    topology_graph = TopologyGraph(sd1_graph)
-    generate_linear_elements_from_track_edges(sd1_infra_dict, topology_graph)
-    generate_connections_from_track_edge_links(sd1_infra_dict, topology_graph)
-    generate_navigabilities_at_simple_points(sd1_infra_dict, topology_graph)
+    with Stage("sd1_topology", sd1_graph):
+        topology_graph = TopologyGraph(sd1_graph)
+        generate_linear_elements_from_track_edges(sd1_infra_dict, topology_graph)
+        generate_connections_from_track_edge_links(sd1_infra_dict, topology_graph)
+        generate_navigabilities_at_simple_points(sd1_infra_dict, topology_graph)
 
-    alignment_graph = AlignmentGraph(sd1_graph, sd1_infra_dict, sd1_map_dict)
-    alignment_graph.get_context_info()
-    alignment_graph.generate_alignments()
+    with Stage("sd1_alignments", sd1_graph):
+        alignment_graph = AlignmentGraph(sd1_graph, sd1_infra_dict, sd1_map_dict)
+        alignment_graph.get_context_info()
+        alignment_graph.generate_alignments()
+    return sd1_graph
 
 
 if __name__ == '__main__':
@@ -141,7 +155,7 @@ if __name__ == '__main__':
     infra_path = data_root + "/scheibenberg/infra_v0.4.2.xml"
     map_path = data_root + "/scheibenberg/map_v0.4.2.xml"
     # SD1 seems to use EPSG:31468 (a Gauss-Krüger projection, based on Bessel 1841 ellipsoid)
-    import_sd1_infra_data(infra_path, map_path)
+    import_sd1_infra_data(infra_path, map_path, sd1_graph)
     sd1_graph.serialize('scheibenberg.ttl')
  #   wkt_to_kml('scheibenberg.ttl', 'scheibenberg_from_wkt.kml')
  #   alignment_to_kml('scheibenberg.ttl', 'scheibenberg_alignment_export_from_CDM_IFC.kml')
@@ -6,8 +6,9 @@ from pprint import pprint
 import geojson
 import xmltodict
 
+from Graph_transformation.instrumentation import Stage, warn
 from Import.drawIO_import.drawio_parameters import DRAWIO_XML_EXTENSION, classify_artefact_by_style
-from Import.drawIO_import.geojson_helpers import create_geojson_linestring, create_geojson_point
+from Import.drawIO_import.geojson_helpers import convert_canvas_coords_array_to_lonlat
 
 # to transform cartesian coords on the canvas to geographic ones, we use an arbitrary transformation.
 # Canvas scale: one pixel = one meter
@@ -26,7 +27,8 @@ class GeojsonGenerator:
     def __init__(self):
         self._input_file_extension = DRAWIO_XML_EXTENSION
         self._output_folder = None
-        self.node_index = {}  # key= autoincrement node ID, value=(lat,lon)
+        self.node_index = {}  # key= autoincrement node ID, value=(x,y) on canvas, or dict for spot locations
+        self.node_ids = {}  # key=(x,y) on canvas, value=node ID; reverse of node_index, for the extremities of ways
         self.way_index = {}  # key=way (edge) id, value={'source'=<node ID>, 'target'=<node ID>, 'waypoint'= (<node ID, ...>)}
         self.label_index = {}  # key=way (edge) id, value=label string (value of connectable in the XML file)
         self.target = ''
@@ -54,7 +56,10 @@ class GeojsonGenerator:
             print("\nData dictionary derived from drawio.xml file:\n")
             (pprint(network_data, width=80))
             self._output_folder = output_folder
-            self.process_dict(network_data, input_file_path)
+            with Stage("drawio_import") as stage:
+                self.process_dict(network_data, input_file_path)
+                stage.linear_elements = sum(1 for feature in self.geojson_doc
+                                            if feature['properties']['rsm_class'] == 'LinearElement')
         else:
             print("No network data found. Exiting.")
 
@@ -105,7 +110,7 @@ class GeojsonGenerator:
             if related_way not in self.label_index.keys():
                 self.label_index[item['@parent']] = item.get('@value')
             else:
-                print(f"WARNING: way {related_way} has two labels")
+                warn(f"WARNING: way {related_way} has two labels")
 
     def process_vertex(self, element):
         # exclude connectables
@@ -123,18 +128,15 @@ class GeojsonGenerator:
                 self.node_index[node_id] = {'id': this_id, 'coords': coords, 'label': label, 'rsm_type': 'SpotLocation'}
         pass
 
-    def add_ways_from_index(self):
+    def add_ways_from_index(self, lonlat_index: dict):
         """
         Also handles waypoints
+        :param lonlat_index: key=node ID, value=(lon,lat) (see project_nodes)
         """
         for way_id, node_ids in self.way_index.items():
-            source_coords = self.node_index[node_ids['source']]
-            target_coords = self.node_index[node_ids['target']]
-            waypoints = ()
-            if waypoint_id_list := node_ids.get('waypoints'):
-                waypoints = tuple(self.node_index[waypoint_id] for waypoint_id in waypoint_id_list)
-
-            linestring = create_geojson_linestring(source_coords, target_coords, *waypoints)
+            waypoint_ids = node_ids.get('waypoints') or ()
+            linestring = geojson.LineString([lonlat_index[node_id] for node_id in
+                                             (node_ids['source'], *waypoint_ids, node_ids['target'])])
             cleaned_label = self.cleanup_label(self.label_index.get(way_id, ''))
             tags = {'label': cleaned_label, 'rsm_class': 'LinearElement',
                     **OSM_RAILWAY_TAG}  # empty string as default label
@@ -142,36 +144,44 @@ class GeojsonGenerator:
                 tags['annotations'] = annotations
             self.geojson_doc.append(geojson.Feature(type="Feature", geometry=linestring, properties=tags))
 
-    def add_nodes_from_index(self):
+    def add_nodes_from_index(self, lonlat_index: dict):
         """Adds nodes collected in node_index to the GeoJSON file
         except those denoting linear element extremities
+        :param lonlat_index: key=node ID, value=(lon,lat) (see project_nodes)
         """
         for node_id, node_value in self.node_index.items():
             if isinstance(node_value, dict):
                 if node_value.get('rsm_type') == 'SpotLocation':
                     tags = {'label': node_value.get('label'), 'rsm_class': 'SpotLocation', **OSM_RAILWAY_TAG}
                     self.geojson_doc.append(
-                        geojson.Feature(type="Feature", geometry=create_geojson_point(*node_value['coords']),
+                        geojson.Feature(type="Feature", geometry=geojson.Point(lonlat_index[node_id]),
                                         properties=tags))
 
+    def project_nodes(self) -> dict:
+        """
+        Converts the canvas coordinates of all nodes to geographic ones, in a single batch.
+        :return: key=node ID, value=(lon,lat)
+        """
+        node_ids = list(self.node_index)
+        canvas_coords = [value['coords'] if isinstance(value, dict) else value for value in self.node_index.values()]
+        return dict(zip(node_ids, convert_canvas_coords_array_to_lonlat(canvas_coords)))
+
     def generate_nodes_and_ways_from_index(self):
-        self.add_nodes_from_index()
-        self.add_ways_from_index()
+        lonlat_index = self.project_nodes()
+        self.add_nodes_from_index(lonlat_index)
+        self.add_ways_from_index(lonlat_index)
         feature_collection = geojson.FeatureCollection(self.geojson_doc)
         return geojson.dumps(feature_collection, indent=2)
 
     def get_or_create_node_id(self, coords) -> int:
-        if coords not in self.node_index.values():
+        if (node_id := self.node_ids.get(coords)) is None:
             node_id = len(self.node_index) + 1
             self.node_index[node_id] = coords
-            return node_id
-        else:
-            return self.find_node_key(coords)
+            self.node_ids[coords] = node_id
+        return node_id
 
     def find_node_key(self, value):
-        for key, val in self.node_index.items():
-            if val == value:
-                return key
+        return self.node_ids.get(value)
 
     def save_to_file(self, out_path: str, new_extension: str = GEOJSON_EXTENSION):
         geojson_string = self.generate_nodes_and_ways_from_index()
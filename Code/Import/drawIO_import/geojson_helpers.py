@@ -1,4 +1,7 @@
+from typing import Sequence
+
 import geojson
+import numpy as np
 from fastkml.geometry import LineString
 from pyproj import Transformer
 
@@ -21,7 +24,24 @@ def convert_multiple_canvas_coords_to_lonlat(*coords: tuple[str | float, str | f
     :param coords: array of coordinate pairs (X,Y) [, (X1, Y1)...] on some canvas
     :return: Tuple of longitude and latitude pairs.
     """
-    return tuple(_convert_canvas_coords_to_lonlat(coord) for coord in coords)
+    return tuple(convert_canvas_coords_array_to_lonlat(coords))
+
+
+def convert_canvas_coords_array_to_lonlat(coords: Sequence[tuple[str | float, str | float]]) \
+        -> list[tuple[float, float]]:
+    """
+    Convert coordinate pairs from Cartesian (on canvas) to longitude and latitude, all at once: the transformer is
+    called once, on arrays (much faster than pair by pair, for large diagrams).
+
+    :param coords: coordinate pairs (X, Y) on canvas
+    :return: converted coordinate pairs (longitude, latitude), in the same order
+    """
+    if len(coords) == 0:
+        return []
+    canvas_coords = np.array(coords, dtype=float)
+    longitudes, latitudes = transformer.transform(canvas_coords[:, 0] + DEFAULT_CENTER_COORDS[0],
+                                                  CANVAS_ORIENTATION * canvas_coords[:, 1] + DEFAULT_CENTER_COORDS[1])
+    return list(zip(longitudes.tolist(), latitudes.tolist()))
 
 
 def _convert_canvas_coords_to_lonlat(coord: tuple[str | float, str | float]) -> tuple[float, float]:
@@ -3,6 +3,7 @@ import os
 from lxml import etree
 from rdflib import RDF, BNode, Literal, URIRef, XSD, Graph, RDFS
 
+from Graph_transformation.instrumentation import Stage, warn
 from Namespaces import RSM_TOPOLOGY, RSM_GEOSPARQL_ADAPTER, RSM_POSITIONING, LIST, GEOSPARQL
 
 OUTPUT_NAMESPACE = 'http://example.org/railML3.2_import#'
@@ -45,11 +46,13 @@ class Railml32ToRsm:
         self._graph.bind('', OUTPUT_NAMESPACE)
 
         # Processing
-        self._process_net_elements()
-        self._process_net_relations()
+        with Stage("railml_import", self._graph):
+            self._process_net_elements()
+            self._process_net_relations()
 
         # Saving
-        self._save_graph_to_file()
+        with Stage("output", self._graph):
+            self._save_graph_to_file()
 
     def _load_source(self, path: str) -> str:
         """
@@ -179,7 +182,7 @@ class Railml32ToRsm:
             valid_elements.append(element_uri)
 
         for warning in warnings:
-            print(warning)
+            warn(warning)
 
         return f"INFO: processed {len(valid_elements)} linear net elements with 'length' attribute."
 
@@ -272,7 +275,7 @@ class Railml32ToRsm:
         infrastructureVisualization = infrastructureVisualizations.xpath(
             "*[local-name()='infrastructureVisualization']")
         if (length := len(infrastructureVisualization)) > 1:
-            print(f"WARNING: {length} infrastructure visualizations found. Only the first one will be processed.")
+            warn(f"WARNING: {length} infrastructure visualizations found. Only the first one will be processed.")
         infrastructureVisualization = infrastructureVisualization[0]
         # id = infrastructureVisualization.attrib["id"]
         self._spotElementProjectionsPositioningSystemRef = infrastructureVisualization.attrib[
@@ -6,12 +6,13 @@ def linestring_length(ls) -> float:
     """
     Linestring length calculation, assuming WGS84 coordinates.
     Note that this is the length of the 2D projection. geopy does not handle 3D calculations.
+    Note also that geopy expects (latitude, longitude) pairs, whereas WKT provides longitude first.
 
     :param ls a WKT linestring
     :return: length of linestring, in meter
     """
     line = wkt.loads(ls)
-    return sum(geodesic(line.coords[i], line.coords[i + 1]).m for i in range(len(line.coords) - 1))
+    return sum(geodesic(line.coords[i][1::-1], line.coords[i + 1][1::-1]).m for i in range(len(line.coords) - 1))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,65 @@
+# Conversions run as jobs (see jobs.py), in worker processes. Each of them works in the workspace of its job only:
+# the generated files are named after the uploaded file. The results are compressed as well, for the downloads (see
+# output_files.py).
+import os
+import time
+
+from Graph_transformation.full_transformation import transform_geojson_to_rsm, transform_osm_to_rsm, \
+    generate_file_path, generate_kml_path, SLIP_FUNCTIONALITY_SUFFIX
+from Import.drawIO_import.drawIO_XML_to_geojson import GeojsonGenerator, GEOJSON_EXTENSION
+from Import.drawIO_import.drawio_parameters import DRAWIO_XML_EXTENSION
+from Import.OSM_import.osm_native_import import OSM_XML_EXTENSION, OSM_PBF_EXTENSION, OVERPASS_JSON_EXTENSION
+from output_files import compress_file
+
+
+def convert_osm(workspace: str, source_name: str, progress, all_double_slip: bool = False) -> dict:
+    """
+    :param source_name: GeoJSON file, or native OSM file (.osm, Overpass .json, .osm.pbf), in the workspace
+    :return: result of the job (see _result)
+    """
+    start_time = time.time()
+    short_name = short_name_of(source_name)
+    source_path = os.path.join(workspace, source_name)
+    if source_name.endswith((OSM_XML_EXTENSION, OSM_PBF_EXTENSION, OVERPASS_JSON_EXTENSION)):
+        transform_osm_to_rsm(source_path, short_name, workspace, all_double_slip=all_double_slip, progress=progress)
+    else:
+        transform_geojson_to_rsm(source_path, short_name, workspace, all_double_slip=all_double_slip,
+                                 use_cache=False, progress=progress)
+    return _result(workspace, source_name, short_name, time.time() - start_time)
+
+
+def convert_drawio(workspace: str, source_name: str, progress) -> dict:
+    """
+    :param source_name: drawIO file exported as XML (.drawio.xml), in the workspace
+    :return: result of the job (see _result)
+    """
+    start_time = time.time()
+    short_name = short_name_of(source_name)
+    GeojsonGenerator().drawio_to_geojson(os.path.join(workspace, source_name), workspace)
+    geojson_path = os.path.join(workspace, source_name.replace(DRAWIO_XML_EXTENSION, GEOJSON_EXTENSION))
+    transform_geojson_to_rsm(geojson_path, short_name, workspace, use_cache=False, progress=progress)
+    return _result(workspace, source_name, short_name, time.time() - start_time)
+
+
+def short_name_of(source_name: str) -> str:
+    """
+    :return: file name without its extensions (e.g. "Alnabru" for "Alnabru.drawio.xml")
+    """
+    return source_name.split('.')[0] or 'network'
+
+
+def _result(workspace: str, source_name: str, short_name: str, seconds: float) -> dict:
+    """
+    :return: names of the resulting ttl file and KML file (None if there is none) in the workspace, processing time,
+    and sizes of the source file and of the ttl file in MB
+    """
+    output_path = generate_file_path(short_name, SLIP_FUNCTIONALITY_SUFFIX, workspace)
+    kml_path = generate_kml_path(short_name, workspace)
+    compress_file(output_path)
+    if os.path.exists(kml_path):
+        compress_file(kml_path)
+    return {'output': os.path.basename(output_path),
+            'kml': os.path.basename(kml_path) if os.path.exists(kml_path) else None,
+            'seconds': seconds,
+            'input_size_mb': os.path.getsize(os.path.join(workspace, source_name)) / (1024 * 1024),
+            'output_size_mb': os.path.getsize(output_path) / (1024 * 1024)}
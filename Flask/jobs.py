@@ -0,0 +1,212 @@
+# Conversion jobs of the site. Each upload creates a job, with its own workspace folder (named after the job id), where
+# the uploaded file, the intermediate files and the results are written: simultaneous users never share a file.
+# Conversions run in a bounded pool of worker processes (the work being CPU-bound), one process per processor by
+# default; the request that submits a job returns at once, and the browser follows the job by its id.
+# A worker process reports the progress of its conversion (see Code/Graph_transformation/instrumentation.py) by
+# rewriting the progress file of the job workspace; the status of a job combines it with the state of the job in the
+# pool. Finished jobs are forgotten, and their workspaces deleted, after JOB_EXPIRY seconds.
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Iterator, Optional
+
+from werkzeug.utils import secure_filename
+
+JOBS_FOLDER = os.path.join(os.path.dirname(__file__), 'job_workspaces')
+PROGRESS_FILE_NAME = 'progress.json'
+JOB_EXPIRY = 24 * 3600  # seconds
+EVENT_INTERVAL = 0.5  # seconds between two checks for new progress, when streaming
+
+# job statuses
+CREATED, QUEUED, RUNNING, DONE, FAILED = 'created', 'queued', 'running', 'done', 'failed'
+
+
+class Job:
+
+    def __init__(self, kind: str, workspace: str, source_name: str):
+        """
+        :param kind: type of conversion (e.g. 'osm', 'drawio'), for display
+        :param workspace: folder of the job
+        :param source_name: name of the uploaded file, in the workspace
+        """
+        self.id = os.path.basename(workspace)
+        self.kind = kind
+        self.workspace = workspace
+        self.source_name = source_name
+        self.status = CREATED
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.future: Optional[Future] = None
+
+    @property
+    def source_path(self) -> str:
+        return os.path.join(self.workspace, self.source_name)
+
+    def progress(self) -> dict:
+        """
+        :return: stage and fraction of the conversion done, as last reported by the worker process
+        """
+        if self.status == DONE:
+            return {'stage': 'done', 'fraction': 1.0}
+        try:
+            with open(os.path.join(self.workspace, PROGRESS_FILE_NAME), encoding='utf-8') as progress_file:
+                return json.load(progress_file)
+        except (OSError, ValueError):  # not reported yet, or being replaced
+            return {'stage': self.status, 'fraction': 0.0}
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'kind': self.kind, 'source': self.source_name, 'status': self.status,
+                'done': self.status in (DONE, FAILED), **self.progress(), 'error': self.error, 'result': self.result}
+
+
+class JobManager:
+
+    def __init__(self, jobs_folder: str = JOBS_FOLDER, max_workers: Optional[int] = None):
+        """
+        :param jobs_folder: parent folder of the job workspaces
+        :param max_workers: number of worker processes; by default, the number of processors
+        """
+        self.jobs_folder = jobs_folder
+        self.max_workers = max_workers
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def create_job(self, kind: str, uploaded_file, source_name: Optional[str] = None) -> Job:
+        """
+        Creates a job, with a new workspace holding the uploaded file.
+        :param uploaded_file: werkzeug FileStorage, as found in request.files
+        :param source_name: name to be given to the file in the workspace; by default, its (sanitized) upload name
+        """
+        self._forget_expired()
+        workspace = os.path.join(self.jobs_folder, uuid.uuid4().hex)
+        os.makedirs(workspace)
+        job = Job(kind, workspace, source_name or secure_filename(uploaded_file.filename) or 'upload')
+        uploaded_file.save(job.source_path)
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def submit(self, job: Job, function, *args) -> Job:
+        """
+        Queues the conversion of a job, run by a worker process as function(workspace, source_name, progress, *args),
+        progress being a progress callback (stage, fraction).
+        :param function: module-level function, returning a picklable result (the job result)
+        """
+        job.status = QUEUED
+        job.future = self._pool().submit(_run_job, function, job.workspace, job.source_name, *args)
+        job.future.add_done_callback(lambda future: self._finish(job, future))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and job.status == QUEUED and os.path.exists(os.path.join(job.workspace,
+                                                                                   PROGRESS_FILE_NAME)):
+            job.status = RUNNING
+        return job
+
+    def file_path(self, job_id: str, file_name: str) -> Optional[str]:
+        """
+        :return: path to a file of the job workspace, or None if the job or the file does not exist
+        """
+        job = self.get(job_id)
+        if job is None or os.path.basename(file_name) != file_name or file_name.startswith('.'):
+            return None
+        path = os.path.join(job.workspace, file_name)
+        return path if os.path.isfile(path) else None
+
+    def events(self, job_id: str) -> Iterator[str]:
+        """
+        :return: server-sent events, one for each change of the job status or progress, until the job is finished
+        """
+        last_status = None
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                yield _event({'error': 'unknown job', 'done': True})
+                return
+            status = job.to_dict()
+            if status != last_status:
+                yield _event(status)
+                last_status = status
+            if status['done'] or job.status == CREATED:
+                return
+            time.sleep(EVENT_INTERVAL)
+
+    def erase_all(self):
+        """
+        Cancels the pending jobs, and deletes all workspaces (running conversions are left to finish).
+        """
+        with self._lock:
+            jobs, self._jobs = list(self._jobs.values()), {}
+        for job in jobs:
+            if job.future is not None:
+                job.future.cancel()
+            shutil.rmtree(job.workspace, ignore_errors=True)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawned rather than forked: the web server process runs several threads
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _finish(self, job: Job, future: Future):
+        job.finished = time.time()
+        if future.cancelled():
+            job.status, job.error = FAILED, "cancelled"
+            return
+        try:
+            job.result = future.result()
+            job.status = DONE
+        except Exception as error:
+            job.status, job.error = FAILED, str(error) or type(error).__name__
+
+    def _forget_expired(self):
+        expiry = time.time() - JOB_EXPIRY
+        with self._lock:
+            expired = [job for job in self._jobs.values() if (job.finished or job.created) < expiry
+                       and job.status != RUNNING and job.status != QUEUED]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            shutil.rmtree(job.workspace, ignore_errors=True)
+
+
+def _run_job(function, workspace: str, source_name: str, *args):
+    """
+    Runs a conversion in a worker process.
+    """
+    def report_progress(stage: str, fraction: float):
+        write_progress(workspace, {'stage': stage, 'fraction': fraction})
+
+    report_progress('starting', 0.0)
+    try:
+        return function(workspace, source_name, report_progress, *args)
+    except Exception as error:
+        traceback.print_exc()
+        raise RuntimeError(f"{type(error).__name__}: {error}") from None  # the traceback may not be picklable
+
+
+def write_progress(workspace: str, progress: dict):
+    """
+    Replaces the progress file of a workspace (atomically, so that it is never read half-written).
+    """
+    temporary_path = os.path.join(workspace, PROGRESS_FILE_NAME + '.tmp')
+    with open(temporary_path, 'w', encoding='utf-8') as progress_file:
+        json.dump(progress, progress_file)
+    os.replace(temporary_path, os.path.join(workspace, PROGRESS_FILE_NAME))
+
+
+def _event(data: dict) -> str:
+    return f"data: {json.dumps(data)}\n\n"
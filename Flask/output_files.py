@@ -0,0 +1,82 @@
+# Serving of the files produced by the conversions (see jobs.py), whatever their size:
+# - result pages only show a preview (the first PREVIEW_LINES lines), read from the file, instead of the whole file;
+# - the viewer shows the file page by page: a page is a byte range of PAGE_SIZE bytes, extended to whole lines, so that
+#   any page is read directly, by seeking to its start;
+# - downloads are streamed from the file, with support of HTTP range requests (e.g. for resuming a download). The
+#   files are compressed once, when the conversion ends (compress_file); clients accepting gzip are sent the
+#   compressed file, with gzip content-encoding (ranges then apply to the compressed file, as HTTP specifies).
+import gzip
+import math
+import os
+import shutil
+
+from flask import send_file, Response
+
+PREVIEW_LINES = 200
+PAGE_SIZE = 64 * 1024  # bytes
+COMPRESSED_SUFFIX = '.gz'
+MIME_TYPES = {'.ttl': 'text/turtle', '.nt': 'application/n-triples', '.kml': 'application/vnd.google-earth.kml+xml'}
+
+
+def compress_file(path: str) -> str:
+    """
+    Writes a gzip-compressed copy of a file, next to it.
+    :return: path to the compressed copy
+    """
+    compressed_path = path + COMPRESSED_SUFFIX
+    with open(path, 'rb') as source, gzip.open(compressed_path, 'wb', compresslevel=6) as output:
+        shutil.copyfileobj(source, output)
+    return compressed_path
+
+
+def read_preview(path: str, line_count: int = PREVIEW_LINES) -> tuple[str, bool]:
+    """
+    :return: the first lines of a text file, and whether the file has more
+    """
+    lines = []
+    with open(path, encoding='utf-8') as source:
+        for line in source:
+            if len(lines) == line_count:
+                return ''.join(lines), True
+            lines.append(line)
+    return ''.join(lines), False
+
+
+def page_count(path: str, page_size: int = PAGE_SIZE) -> int:
+    return max(1, math.ceil(os.path.getsize(path) / page_size))
+
+
+def read_page(path: str, page: int, page_size: int = PAGE_SIZE) -> str:
+    """
+    :param page: from 0
+    :return: the lines of a text file starting within the byte range of the page
+    """
+    start, end = page * page_size, (page + 1) * page_size
+    with open(path, 'rb') as source:
+        if start > 0:
+            source.seek(start - 1)
+            source.readline()  # the line under way at the start of the page belongs to the previous page
+        data = source.read(max(0, end - source.tell()))
+        if data and not data.endswith(b'\n'):
+            data += source.readline()  # up to the end of the last line of the page
+    return data.decode('utf-8', errors='replace')
+
+
+def send_output_file(path: str, accept_encoding: str) -> Response:
+    """
+    :param accept_encoding: Accept-Encoding header of the request
+    :return: response streaming the file as an attachment, compressed if the client accepts gzip and a compressed copy
+    exists; range requests are supported in both cases
+    """
+    download_name = os.path.basename(path)
+    mime_type = MIME_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream')
+    compressed_path = path + COMPRESSED_SUFFIX
+    if 'gzip' in accept_encoding and os.path.isfile(compressed_path):
+        response = send_file(compressed_path, mimetype=mime_type, as_attachment=True, download_name=download_name,
+                             conditional=True)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_file(path, mimetype=mime_type, as_attachment=True, download_name=download_name,
+                             conditional=True)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
@@ -2,18 +2,19 @@ import os
 from html import escape
 
 import markdown2
-from flask import Blueprint, render_template_string, send_from_directory, request
+from flask import Blueprint, render_template_string, request, Response, jsonify, abort, redirect
+from werkzeug.utils import secure_filename
 
-from Graph_transformation.full_transformation import transform_geojson_to_rsm
-from Import.drawIO_import.drawIO_XML_to_geojson import GEOJSON_EXTENSION
+from Import.drawIO_import.drawio_parameters import DRAWIO_XML_EXTENSION
+from conversions import convert_osm, convert_drawio, short_name_of
+from jobs import JobManager, DONE, FAILED
+from output_files import read_preview, read_page, page_count, send_output_file, PREVIEW_LINES
 
 # Constants
 LOCAL_FOLDER = os.path.dirname(__file__)
-OUTPUT_FOLDER = os.path.join(LOCAL_FOLDER, 'output')
 bp = Blueprint('pages', __name__, template_folder='templates')
 
-uploaded_files = []
-output_file = []
+job_manager = JobManager()
 
 CSS_STYLES = """
 <style>
@@ -152,31 +153,6 @@ def about():
 
 @bp.route('/drawio_to_rdf', methods=['GET', 'POST'])
 def drawio_to_rsm():
-    def save_uploaded_file(file, file_path):
-        print('Saving file to ', file_path)
-        file.save(file_path)
-        uploaded_files.append(file_path)
-
-    def process_xml_file(file_path):
-        from Code.Import.drawIO_import import drawIO_XML_to_geojson as dxo
-        osm_generator = dxo.GeojsonGenerator()
-        osm_generator.drawio_to_geojson(file_path, OUTPUT_FOLDER)
-        osm_file_path = file_path.split('.')[0] + GEOJSON_EXTENSION
-        uploaded_files.append(osm_file_path)
-        result = transform_geojson_to_rsm(osm_file_path, 'output', OUTPUT_FOLDER)
-        if result:
-            escaped_result = escape(result)
-            rdf_turtle_path = os.path.join(OUTPUT_FOLDER, 'output.ttl')
-            with open(rdf_turtle_path, 'w') as rdf_file:
-                rdf_file.write(result)
-            uploaded_files.append(rdf_turtle_path)
-            return f"""<h2>Resulting sRSM file, in RDF Turtle format:</h2>
-                       <div style="max-height: 300px; overflow-y: scroll; border: 1px solid #ccc; padding: 10px; margin-top: 20px; font-size: 80%;">
-                           <pre>{escaped_result}</pre>
-                       </div>
-                       <a href="/download_rdf" download class="button">Download RDF Turtle file</a>"""
-        return ""
-
     def process_svg_file(file_path):
         with open(file_path, 'r', encoding='utf-8') as svg_file:
             file_content = svg_file.read()
@@ -193,13 +169,16 @@ def drawio_to_rsm():
         uploaded_file = request.files['file']
         if uploaded_file:
             selected_file_name = uploaded_file.filename
-            temporary_file_path = os.path.join(OUTPUT_FOLDER, selected_file_name)
-            save_uploaded_file(uploaded_file, temporary_file_path)
 
             if selected_file_name.endswith('.xml'):
-                result_html = process_xml_file(temporary_file_path)
+                # the drawIO import expects the .drawio.xml extension
+                source_name = f"{short_name_of(secure_filename(selected_file_name))}{DRAWIO_XML_EXTENSION}"
+                job = job_manager.create_job('drawio', uploaded_file, source_name)
+                job_manager.submit(job, convert_drawio)
+                return redirect(f"/jobs/{job.id}/view")
             elif selected_file_name.endswith('.svg'):
-                result_html = process_svg_file(temporary_file_path)
+                job = job_manager.create_job('svg', uploaded_file)
+                result_html = process_svg_file(job.source_path)
 
     drawio_content = render_drawio_form(selected_file_name, result_html)
     html_response = get_html_content_with_styles('drawio to RDF', drawio_content)
@@ -221,42 +200,12 @@ def render_drawio_form(selected_file_name, result_html):
 
 @bp.route('/osm_to_rdf', methods=['GET', 'POST'])
 def osm_to_rdf():
-    def generate_progress_script():
-        return f"""
-        <script>
-            function showProgressBar(time) {{
-                document.getElementById('progress-bar').style.display = 'block';
-                let progress = document.getElementById('progress');
-                let progressText = document.getElementById('progress-text');
-                let nearlyThereText = document.getElementById('nearly-there');
-                let value = 0;
-                let interval = setInterval(() => {{
-                    if (value < 100) {{
-                        value += 100 / time;
-                        progress.value = value;
-                        progressText.textContent = "Processing... " + Math.min(Math.floor(value), 100) + "%";
-                    }} else {{
-                        progressText.textContent = "Processing... 100%";
-                        nearlyThereText.style.display = 'inline';
-                        clearInterval(interval);
-                    }}
-                }}, 1000); // 1000 ms intervals
-            }}
-        </script>
-        """
-
-    def generate_convert_button(osm_file_path, estimated_time):
+    def generate_convert_button(job_id):
         return f"""
-        <form method="post" action="/convert_osm_to_sRSM" onsubmit="showProgressBar({estimated_time})">
-            <input type='hidden' name='file_path' value='{osm_file_path}'>
+        <form method="post" action="/convert_osm_to_sRSM">
+            <input type='hidden' name='job_id' value='{job_id}'>
             <input type="submit" value="Convert to sRSM">
         </form>
-        <div id="progress-bar" style="display: none; margin-top: 10px;">
-            <progress value="0" max="100" id="progress"></progress>
-            <span id="progress-text">Processing...</span>
-            <span id="nearly-there" style="display: none;"> (well, nearly there...)</span>
-        </div>
-        {generate_progress_script()}
         """
 
     osm_file_name = "No file selected"
@@ -265,12 +214,8 @@ def osm_to_rdf():
         uploaded_file = request.files['file']
         if uploaded_file:
             osm_file_name = uploaded_file.filename
-            file_size_mb = len(uploaded_file.read()) / (1024 * 1024)
-            uploaded_file.seek(0)
-            osm_file_path = os.path.join(OUTPUT_FOLDER, uploaded_file.filename)
-            uploaded_files.append(osm_file_path)
-            uploaded_file.save(osm_file_path)
-            convert_button = generate_convert_button(osm_file_path, estimated_conversion_time(file_size_mb))
+            job = job_manager.create_job('osm', uploaded_file)
+            convert_button = generate_convert_button(job.id)
 
     osm_content = f"""
     <h1>Convert an OpenStreetMap railway network into a semantic RSM
@@ -282,8 +227,9 @@ def osm_to_rdf():
         moz-do-not-send="true">Overpass Turbo</a>.<br>
     </p>
     <p>The resulting OSM file will contain railway nodes and ways (in
-      OSM parlance). Export it in GeoJSON. The GeoJSON file will then be transformed into a RailSystemModel file
-      in RDF/Turtle format.<br>
+      OSM parlance). Export it in GeoJSON, or as raw data (OSM XML or Overpass JSON; PBF files are accepted as
+      well). The file will then be transformed into a RailSystemModel file in RDF/Turtle format. Raw data are
+      processed faster, their nodes telling which tracks are connected.<br>
     </p>
     <p>At present, there is only one available option: crossings can be
       all instantiated as diamond crossings (FR: traversée simple, DE:
@@ -320,70 +266,130 @@ def osm_to_rdf():
     </form>
     <p>Selected file: <span id="file-name">{osm_file_name}</span></p>
     {convert_button}
-    <script>
-        document.addEventListener('DOMContentLoaded', () => {{
-            if (document.referrer.includes('/convert_osm_to_sRSM')) {{
-                document.getElementById('progress-bar').style.display = 'none';
-            }}
-        }});
-    </script>
     """
     html = get_html_content_with_styles('OSM to RDF', osm_content)
     return html
 
 
-def estimated_conversion_time(file_size_MB: float) -> int:
-    """
-    the parameters match a Macbook Air M2 execution time
-    :param file_size_MB: in megabytes
-    :return: execution time in milliseconds
-    """
-    return int(0.856 * file_size_MB ** 2 * 2.1113 * file_size_MB + 0.324)
-
-
 @bp.route('/convert_osm_to_sRSM', methods=['POST'])
 def osm_to_rsm():
-    import time
-    file_path = request.form['file_path']
-    file_name = os.path.basename(file_path)
+    job = job_manager.get(request.form['job_id'])
+    if job is None:
+        abort(404)
+    if job.future is None:  # the form may be posted again
+        job_manager.submit(job, convert_osm)
+    return redirect(f"/jobs/{job.id}/view")
+
+
+@bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Status of a job, as JSON: status (created, queued, running, done or failed), stage and fraction of the conversion
+    done, error message, and result (see conversions._result)
+    """
+    if (job := job_manager.get(job_id)) is None:
+        abort(404)
+    return jsonify(job.to_dict())
 
-    file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
 
-    start_time = time.time()
-    result = transform_geojson_to_rsm(file_path, 'converted_osm', OUTPUT_FOLDER)
-    end_time = time.time()
+@bp.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Status of a job, as a stream of server-sent events (same content as /jobs/<job_id>), until the job is finished
+    """
+    return Response(job_manager.events(job_id), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
-    transformation_time = end_time - start_time
 
-    if result:
-        escaped_result = escape(result)
-        rdf_turtle_path = os.path.join(OUTPUT_FOLDER, 'output.ttl')
-        with open(rdf_turtle_path, 'w') as rdf_file:
-            rdf_file.write(result)
-        uploaded_files.append(rdf_turtle_path)
+@bp.route('/jobs/<job_id>/view')
+def job_view(job_id):
+    """
+    Page of a job: its progress while it runs (followed as server-sent events), then its result.
+    """
+    if (job := job_manager.get(job_id)) is None:
+        abort(404)
+    if job.status == DONE:
+        result = job.result
+        preview, truncated = read_preview(os.path.join(job.workspace, result['output']))
+        more_html = f"""<p>Only the first {PREVIEW_LINES} lines are shown ({result['output_size_mb']:.2f} MB in
+        all): <a href="/jobs/{job.id}/pages/{result['output']}">view the whole file, page by page</a>.</p>""" \
+            if truncated else ""
+        kml_link = f"""<br><a href="/jobs/{job.id}/download/{result['kml']}" download class="button">Download KML
+        file</a>""" if result['kml'] else ""
         result_html = f"""<h2>Resulting sRSM file, in RDF Turtle format:</h2>
-        <p>Source file: {file_name}</p>
+        <p>Source file: {escape(job.source_name)}</p>
         <div style="max-height: 300px; overflow-y: scroll; border: 1px solid #ccc; padding: 10px; margin-top: 20px; font-size: 80%;">
-            <pre>{escaped_result}</pre>
+            <pre>{escape(preview)}</pre>
         </div>
-        <p>Transformation time: {transformation_time:.2f} seconds | Input file size: {file_size_mb:.2f} MB</p>
-        <a href="/download_rdf" download class="button">Download RDF Turtle file</a>"""
+        {more_html}
+        <p>Transformation time: {result['seconds']:.2f} seconds | Input file size: {result['input_size_mb']:.2f} MB</p>
+        <a href="/jobs/{job.id}/download/{result['output']}" download class="button">Download RDF Turtle file</a>
+        {kml_link}"""
+    elif job.status == FAILED:
+        result_html = f"<p>An error occurred during conversion: {escape(job.error or '')}</p>"
     else:
-        result_html = "<p>An error occurred during conversion.</p>"
-
-    html = get_html_content_with_styles('Converted RDF', result_html)
-    return render_template_string(html)
-
-
-@bp.route('/download_rdf')
-def download_rdf():
-    return send_from_directory(OUTPUT_FOLDER, 'output.ttl', as_attachment=True)
+        result_html = f"""<h2>Converting {escape(job.source_name)}</h2>
+        <div id="progress-bar" style="margin-top: 10px;">
+            <progress value="0" max="100" id="progress"></progress>
+            <span id="progress-text">Waiting for a free worker...</span>
+        </div>
+        <script>
+            let progress = document.getElementById('progress');
+            let progressText = document.getElementById('progress-text');
+            let source = new EventSource('/jobs/{job.id}/events');
+            source.onmessage = (event) => {{
+                let data = JSON.parse(event.data);
+                if (data.done) {{
+                    source.close();
+                    window.location.reload();
+                }} else if (data.status === 'running') {{
+                    progress.value = 100 * data.fraction;
+                    progressText.textContent = "Processing (" + data.stage + ")... " +
+                        Math.floor(100 * data.fraction) + "%";
+                }}
+            }};
+        </script>"""
+
+    return get_html_content_with_styles('Converted RDF', result_html)
+
+
+@bp.route('/jobs/<job_id>/pages/<file_name>')
+def job_file_pages(job_id, file_name):
+    """
+    Viewer of a (text) file of a job, page by page; the page number (from 1) is given by the 'page' query parameter.
+    """
+    if (file_path := job_manager.file_path(job_id, file_name)) is None:
+        abort(404)
+    last_page = page_count(file_path)
+    page = request.args.get('page', 1, type=int)
+    if not 1 <= page <= last_page:
+        abort(404)
+
+    def page_link(number, text):
+        return f'<a href="?page={number}">{text}</a>' if 1 <= number <= last_page and number != page else text
+
+    navigation = f"""<p>{page_link(1, 'First')} | {page_link(page - 1, 'Previous')} | Page {page} of {last_page} |
+    {page_link(page + 1, 'Next')} | {page_link(last_page, 'Last')}</p>"""
+    page_html = f"""<h2>{escape(file_name)}</h2>
+    {navigation}
+    <div style="border: 1px solid #ccc; padding: 10px; font-size: 80%;">
+        <pre>{escape(read_page(file_path, page - 1))}</pre>
+    </div>
+    {navigation}
+    <p><a href="/jobs/{job_id}/view">Back to the conversion result</a></p>"""
+    return get_html_content_with_styles(file_name, page_html)
+
+
+@bp.route('/jobs/<job_id>/download/<file_name>')
+def job_download(job_id, file_name):
+    """
+    Download of a file of a job, streamed, gzip-compressed if the client accepts it; supports range requests.
+    """
+    if (file_path := job_manager.file_path(job_id, file_name)) is None:
+        abort(404)
+    return send_output_file(file_path, request.headers.get('Accept-Encoding', ''))
 
 
 @bp.route('/erase_and_quit', methods=['POST'])
 def erase_and_quit():
-    for file_path in uploaded_files:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    uploaded_files.clear()
+    job_manager.erase_all()
     return '', 200